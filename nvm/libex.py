@@ -8,6 +8,8 @@ pmemobj_structs = """
         PObjPtr type_table;
         PObjPtr root_object;
         PObjPtr clean_shutdown;
+        size_t hash_scheme;         /* see pmemobj.dict.HASH_SCHEME */
+        PObjPtr shared_keys;        /* PSharedKeysTable */
         } PRoot;
     typedef struct {
         size_t ob_refcnt;
@@ -26,6 +28,19 @@ pmemobj_structs = """
         PVarObject ob_base;
         PObjPtr ob_items;
         } PTupleObject;
+    typedef struct {
+        PVarObject ob_base;
+        PObjPtr ob_items;
+        size_t allocated;
+        size_t head;
+        ssize_t maxlen;             /* -1 if unbounded */
+        } PDequeObject;
+    typedef struct {
+        PVarObject ob_base;
+        PObjPtr ob_data;
+        size_t allocated;
+        size_t typecode;            /* ord() of the array typecode */
+        } PArrayObject;
     typedef struct {
         PObjPtr  key;
         uint64_t hash;
@@ -56,15 +71,39 @@ pmemobj_structs = """
         } PDictKeyEntry;
     typedef struct {
         ssize_t dk_refcnt;
-        ssize_t dk_size;
+        ssize_t dk_size;            /* size of dk_indices, a power of 2 */
       /*dict_lookup_func dk_lookup;*/
         ssize_t dk_usable;
-        PDictKeyEntry dk_entries[1];
+        ssize_t dk_nentries;        /* entries used, including deleted ones */
+        char dk_indices[];          /* followed by the PDictKeyEntry array */
         } PDictKeysObject;
+    typedef struct {
+        /* The sparse layout used before the compact one, which we only read
+           in order to convert it. */
+        ssize_t dk_refcnt;
+        ssize_t dk_size;
+        ssize_t dk_usable;
+        PDictKeyEntry dk_entries[1];
+        } PSparseDictKeysObject;
+    typedef struct {
+        size_t size;                /* number of slots in values */
+        PObjPtr values[];           /* parallel to the shared keys' entries */
+        } PDictValuesObject;
+    typedef struct {
+        size_t size;                /* number of slots in keys */
+        PObjPtr keys[];             /* PDictKeysObject, by type code */
+        } PSharedKeysTable;
     typedef struct {
         PObject ob_base;
         PObjPtr ob_dict;
         } PObjectObject;
+    typedef struct {
+        PObject ob_base;
+        PObjPtr ob_dict;            /* OID_NULL until an extra is set */
+        size_t ob_nslots;
+        uint64_t ob_layout;         /* digest of the slot names */
+        PObjPtr ob_slots[];
+        } PSlotsObject;
 
     """
 
@@ -154,6 +193,11 @@ ffi.cdef("""
         TX_STAGE_FINALLY,
         ...
         };
+    enum pobj_log_type {
+        TX_LOG_TYPE_SNAPSHOT,
+        TX_LOG_TYPE_INTENT,
+        ...
+        };
 
     const char *pmemobj_errormsg(void);
     PMEMobjpool *pmemobj_open(const char *path, const char *layout);
@@ -176,6 +220,13 @@ ffi.cdef("""
     PMEMoid pmemobj_tx_zrealloc(PMEMoid oid, size_t size, uint64_t type_num);
     PMEMoid pmemobj_tx_strdup(const char *s, uint64_t type_num);
     int pmemobj_tx_free(PMEMoid oid);
+    int pmemobj_tx_log_append_buffer(enum pobj_log_type type, void *addr,
+        size_t size);
+    size_t pmemobj_tx_log_snapshots_max_size(size_t *sizes, size_t nsizes);
+    size_t pmemobj_tx_log_intents_max_size(size_t nintents);
+    int pmemobj_zalloc(PMEMobjpool *pop, PMEMoid *oidp, size_t size,
+        uint64_t type_num);
+    void pmemobj_free(PMEMoid *oidp);
     enum pobj_tx_stage pmemobj_tx_stage(void);
     PMEMoid pmemobj_first(PMEMobjpool *pop);
     PMEMoid pmemobj_next(PMEMoid oid);
@@ -4,3 +4,5 @@ from .dict import PersistentDict
 from .object import PersistentObject
 from .tuple import PersistentTuple
 from .set import PersistentSet, PersistentFrozenSet
+from .deque import PersistentDeque
+from .typedarray import PersistentArray
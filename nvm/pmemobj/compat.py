@@ -8,6 +8,11 @@ try:
 except ImportError:
     import collections as abc
 
+if sys.version_info[0] > 2:
+    string_types = (str,)
+else:
+    string_types = (basestring,)
+
 try:
     from reprlib import recursive_repr
 except ImportError:
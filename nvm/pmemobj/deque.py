@@ -0,0 +1,404 @@
+import collections
+import sys
+
+from .compat import recursive_repr, abc
+
+from _pmem import ffi
+
+# XXX: refactor to allocate this instead of hardcoding it.
+DEQUE_POBJPTR_ARRAY_TYPE_NUM = 80
+
+# The item array always holds a power of two number of slots, so that a
+# position in the ring can be computed by masking.
+DEQUE_MINSIZE = 8
+
+
+class PersistentDeque(abc.MutableSequence):
+    """Persistent version of the 'collections.deque' type.
+
+    The items are kept in a circular array of pointers, so that adding or
+    removing an item at either end only touches that item's slot and the
+    header fields, regardless of the length of the deque.
+    """
+
+    # XXX locking!
+
+    def __init__(self, iterable=(), maxlen=None):
+        if maxlen is not None:
+            if maxlen < 0:
+                raise ValueError("maxlen must be non-negative")
+            mm = self._p_mm
+            with mm.transaction():
+                mm.snapshot_range(ffi.addressof(self._body, 'maxlen'),
+                                  ffi.sizeof('ssize_t'))
+                self._body.maxlen = maxlen
+        self.extend(iterable)
+
+    def _p_new(self, manager):
+        mm = self._p_mm = manager
+        with mm.transaction():
+            self._p_oid = mm.zalloc(ffi.sizeof('PDequeObject'))
+            ob = ffi.cast('PObject *', mm.direct(self._p_oid))
+            ob.ob_type = mm._get_type_code(PersistentDeque)
+            self._body = ffi.cast('PDequeObject *', mm.direct(self._p_oid))
+            self._body.maxlen = -1
+
+    def _p_resurrect(self, manager, oid):
+        mm = self._p_mm = manager
+        self._p_oid = oid
+        self._body = ffi.cast('PDequeObject *', mm.direct(oid))
+
+    # Bookkeeping for the ring buffer.
+
+    @property
+    def _size(self):
+        return ffi.cast('PVarObject *', self._body).ob_size
+
+    @property
+    def _items(self):
+        mm = self._p_mm
+        ob_items = mm.otuple(self._body.ob_items)
+        if ob_items == mm.OID_NULL:
+            return None
+        return ffi.cast('PObjPtr *', mm.direct(ob_items))
+
+    @property
+    def maxlen(self):
+        maxlen = self._body.maxlen
+        return None if maxlen < 0 else maxlen
+
+    def _slot(self, index):
+        # Return the position in the item array of the item at index.
+        return (self._body.head + index) & (self._body.allocated - 1)
+
+    def _set_size(self, size):
+        mm = self._p_mm
+        ob = ffi.cast('PVarObject *', self._body)
+        mm.snapshot_range(ffi.addressof(ob, 'ob_size'), ffi.sizeof('size_t'))
+        ob.ob_size = size
+
+    def _set_head(self, head):
+        mm = self._p_mm
+        mm.snapshot_range(ffi.addressof(self._body, 'head'),
+                          ffi.sizeof('size_t'))
+        self._body.head = head
+
+    def _put(self, index, oid):
+        # Store oid in the slot of the item at index.  The caller is
+        # responsible for the refcounts.
+        items = self._items
+        pos = self._slot(index)
+        self._p_mm.snapshot_range(ffi.addressof(items, pos),
+                                  ffi.sizeof('PObjPtr'))
+        items[pos] = oid
+
+    def _get_oid(self, index):
+        return self._p_mm.otuple(self._items[self._slot(index)])
+
+    def _reallocate(self, allocated):
+        # Move the items to a new array of allocated slots, unwrapping them so
+        # that the first item ends up at the start of the new array.
+        mm = self._p_mm
+        body = self._body
+        size = self._size
+        ptr_size = ffi.sizeof('PObjPtr')
+        with mm.transaction():
+            new_items = mm.OID_NULL
+            if allocated:
+                new_items = mm.zalloc(allocated * ptr_size,
+                                      type_num=DEQUE_POBJPTR_ARRAY_TYPE_NUM)
+                if size:
+                    dest = ffi.cast('PObjPtr *', mm.direct(new_items))
+                    items = self._items
+                    head = body.head
+                    first = min(size, body.allocated - head)
+                    ffi.memmove(dest, items + head, first * ptr_size)
+                    ffi.memmove(dest + first, items, (size - first) * ptr_size)
+            old_items = mm.otuple(body.ob_items)
+            if old_items != mm.OID_NULL:
+                mm.free(old_items)
+            mm.snapshot_range(body, ffi.sizeof('PDequeObject'))
+            body.ob_items = new_items
+            body.allocated = allocated
+            body.head = 0
+
+    def _grow(self, newsize):
+        # Double the item array until it can hold newsize items.
+        allocated = self._body.allocated
+        if newsize <= allocated:
+            return
+        allocated = max(allocated, DEQUE_MINSIZE)
+        while allocated < newsize:
+            allocated <<= 1
+        self._reallocate(allocated)
+
+    def _shrink(self):
+        # Halve the item array once it is no more than a quarter full.  We
+        # never go below the minimum size, so a deque that keeps going between
+        # empty and a few items does not reallocate on every operation.
+        allocated = self._body.allocated
+        if allocated > DEQUE_MINSIZE and self._size <= allocated >> 2:
+            self._reallocate(allocated >> 1)
+
+    def _take(self, left):
+        # Remove the item at one end and return its oid without touching its
+        # refcount.  The caller is responsible for the decref.
+        mm = self._p_mm
+        size = self._size
+        if not size:
+            raise IndexError("pop from an empty deque")
+        with mm.transaction():
+            index = 0 if left else size - 1
+            oid = self._get_oid(index)
+            self._put(index, mm.OID_NULL)
+            if left:
+                self._set_head(self._slot(1))
+            self._set_size(size - 1)
+        return oid
+
+    def _normalize_index(self, index):
+        if isinstance(index, slice):
+            raise TypeError("sequence index must be integer, not 'slice'")
+        try:
+            index = int(index)
+        except TypeError:
+            raise TypeError("sequence index must be integer, not {!r}".format(
+                                index.__class__.__name__))
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError("deque index out of range")
+        return index
+
+    # Methods and properties needed to implement the ABC required methods.
+
+    def __getitem__(self, index):
+        index = self._normalize_index(index)
+        return self._p_mm.resurrect(self._get_oid(index))
+
+    def __setitem__(self, index, value):
+        mm = self._p_mm
+        index = self._normalize_index(index)
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            mm.incref(v_oid)
+            oid = self._get_oid(index)
+            self._put(index, v_oid)
+            mm.decref(oid)
+
+    def __delitem__(self, index):
+        mm = self._p_mm
+        index = self._normalize_index(index)
+        size = self._size
+        with mm.transaction():
+            oid = self._get_oid(index)
+            # Close the gap from whichever end is nearer.
+            if index < size // 2:
+                for i in range(index, 0, -1):
+                    self._put(i, self._get_oid(i - 1))
+                self._put(0, mm.OID_NULL)
+                self._set_head(self._slot(1))
+            else:
+                for i in range(index, size - 1):
+                    self._put(i, self._get_oid(i + 1))
+                self._put(size - 1, mm.OID_NULL)
+            self._set_size(size - 1)
+            mm.decref(oid)
+            self._shrink()
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, index, value):
+        mm = self._p_mm
+        size = self._size
+        if size == self._body.maxlen:
+            raise IndexError("deque already at its maximum size")
+        if index < 0:
+            index += size
+            if index < 0:
+                index = 0
+        if index > size:
+            index = size
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            mm.incref(v_oid)
+            self._grow(size + 1)
+            # Open the gap from whichever end is nearer.
+            if index < size // 2:
+                self._set_head(self._slot(-1))
+                for i in range(index):
+                    self._put(i, self._get_oid(i + 1))
+            else:
+                for i in range(size, index, -1):
+                    self._put(i, self._get_oid(i - 1))
+            self._put(index, v_oid)
+            self._set_size(size + 1)
+
+    # Additional deque methods not provided by the ABC.
+
+    def append(self, value):
+        mm = self._p_mm
+        if self._body.maxlen == 0:
+            return
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            mm.incref(v_oid)
+            if self._size == self._body.maxlen:
+                mm.decref(self._take(True))
+            size = self._size
+            self._grow(size + 1)
+            self._put(size, v_oid)
+            self._set_size(size + 1)
+
+    def appendleft(self, value):
+        mm = self._p_mm
+        if self._body.maxlen == 0:
+            return
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            mm.incref(v_oid)
+            if self._size == self._body.maxlen:
+                mm.decref(self._take(False))
+            size = self._size
+            self._grow(size + 1)
+            self._set_head(self._slot(-1))
+            self._put(0, v_oid)
+            self._set_size(size + 1)
+
+    def pop(self):
+        mm = self._p_mm
+        with mm.transaction():
+            oid = self._take(False)
+            # Resurrect before the decref, which may free the object.
+            value = mm.resurrect(oid)
+            mm.decref(oid)
+            self._shrink()
+        return value
+
+    def popleft(self):
+        mm = self._p_mm
+        with mm.transaction():
+            oid = self._take(True)
+            value = mm.resurrect(oid)
+            mm.decref(oid)
+            self._shrink()
+        return value
+
+    def extend(self, values):
+        if values is self:
+            values = list(values)
+        with self._p_mm.transaction():
+            for value in values:
+                self.append(value)
+
+    def extendleft(self, values):
+        if values is self:
+            values = list(values)
+        with self._p_mm.transaction():
+            for value in values:
+                self.appendleft(value)
+
+    def rotate(self, n=1):
+        mm = self._p_mm
+        size = self._size
+        if size < 2:
+            return
+        n %= size
+        if not n:
+            return
+        with mm.transaction():
+            if size == self._body.allocated:
+                # The ring is full, so moving the head is all it takes.
+                self._set_head(self._slot(size - n))
+            elif n <= size // 2:
+                for _ in range(n):
+                    oid = self._get_oid(size - 1)
+                    self._put(size - 1, mm.OID_NULL)
+                    self._set_head(self._slot(-1))
+                    self._put(0, oid)
+            else:
+                for _ in range(size - n):
+                    oid = self._get_oid(0)
+                    self._put(0, mm.OID_NULL)
+                    self._set_head(self._slot(1))
+                    self._put(size - 1, oid)
+
+    def reverse(self):
+        mm = self._p_mm
+        size = self._size
+        if size < 2:
+            return
+        oids = [self._get_oid(i) for i in range(size)]
+        with mm.transaction():
+            for i, oid in enumerate(reversed(oids)):
+                self._put(i, oid)
+
+    def clear(self):
+        mm = self._p_mm
+        if self._items is None:
+            return
+        with mm.transaction():
+            oids = [self._get_oid(i) for i in range(self._size)]
+            self._set_size(0)
+            self._reallocate(0)
+            mm.decref_many(oids)
+
+    def _state(self):
+        body = self._body
+        return (ffi.cast('PVarObject *', body).ob_size, body.head,
+                body.ob_items.off)
+
+    def __iter__(self):
+        mm = self._p_mm
+        state = self._state()
+        items = self._items
+        for i in range(self._size):
+            if self._state() != state:
+                raise RuntimeError("deque mutated during iteration")
+            yield mm.resurrect(items[self._slot(i)])
+
+    def __reversed__(self):
+        mm = self._p_mm
+        state = self._state()
+        items = self._items
+        for i in range(self._size - 1, -1, -1):
+            if self._state() != state:
+                raise RuntimeError("deque mutated during iteration")
+            yield mm.resurrect(items[self._slot(i)])
+
+    @recursive_repr()
+    def __repr__(self):
+        items = ', '.join("{!r}".format(x) for x in self)
+        if self.maxlen is None:
+            return "{}([{}])".format(self.__class__.__name__, items)
+        return "{}([{}], maxlen={})".format(self.__class__.__name__, items,
+                                            self.maxlen)
+
+    def __eq__(self, other):
+        if not (isinstance(other, PersistentDeque) or
+                isinstance(other, collections.deque)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        for a, b in zip(self, other):
+            if a != b:
+                return False
+        return True
+
+    if sys.version_info[0] < 3:
+        def __ne__(self, other):
+            return not self == other
+
+    # Additional methods required by the pmemobj API.
+
+    def _p_traverse(self):
+        items = self._items
+        for i in range(self._size):
+            yield items[self._slot(i)]
+
+    def _p_substructures(self):
+        return ((self._body.ob_items, DEQUE_POBJPTR_ARRAY_TYPE_NUM),)
+
+    def _p_deallocate(self):
+        self.clear()
@@ -1,27 +1,33 @@
 import collections
-import hashlib
 import logging
+import struct
 import sys
+import zlib
 
 from .compat import recursive_repr, abc
 
-from _pmem import ffi
+from _pmem import ffi, lib
+from .tuple import PersistentTuple
 
 log = logging.getLogger('nvm.pmemobj.dict')
 
-# XXX CPython has a dictionary structure that has an optimization for a common
+# CPython has a dictionary structure that has an optimization for a common
 # Python case: multiple instances of a class, where each instance has the same
 # unicode *keys* in its attribute dictionary, but may have different values.
-# This is called a "split key dictionary".  In this module I'm following the
-# data structure layout that CPython uses that caters to this split dictionary
-# case, but I'm only implementing the "combined" dictionary case at the present
-# time.  I'm using the CPython layout, even though it is a bit more complex
-# than needed for a combined dictionary, to make it easier to come back later
-# when I add support for arbitrary Persistent subclasses, and implement the
-# split dictionary case if desired.  It also makes it easier to port the
-# CPython code.
+# This is called a "split key dictionary".  We do the same for the attribute
+# dicts of PersistentObjects: the pool keeps one keys object per class, shared
+# by the dicts of all of its instances, and each of those dicts stores only an
+# array of values (ma_values) parallel to the shared entries.  As in CPython a
+# split dict holds its items in the order of the shared entries, so the live
+# values are always the first ma_used ones.  Anything that would break that
+# (deleting other than the last item, inserting keys in a different order, or
+# running out of room in the shared keys) converts the dict to a combined one.
 MIN_SIZE_SPLIT = 4
 
+# The size of the keys objects shared by split dicts.  These never resize, so
+# this bounds the number of attributes that can be shared.
+SHARED_KEYS_SIZE = 64
+
 # This constant is taken from CPython 3.6.  Since our dictionaries are *not*
 # used principally for keyword argument passing the way CPython's are, a
 # different constant may be appropriate.
@@ -30,219 +36,674 @@ MIN_SIZE_COMBINED = 8
 # This is a well tested constant and should be correct for us as well.
 PERTURB_SHIFT = 5
 
-# These will never be real OIDs, so we can use them as flag entries in an OID
-# field.  Even if another module uses the same value it shouldn't be a problem,
-# since the value should never leak outside the module that uses it.
+# The layout of the keys object follows CPython 3.6's compact dict: a small
+# hash table of indices (dk_indices) into a dense array of entries kept in
+# insertion order.  An index slot is either an index into the entries, or one
+# of these.
+DKIX_EMPTY = -1
+DKIX_DUMMY = -2
+
+# Before the compact layout the keys object was one sparse table of entries
+# (PSparseDictKeysObject).  Those are converted the first time the dict is
+# used.  Deleted entries in them have a null value and a flag key of (0, 10).
 # XXX need to make None, True, and False similar constants, and figure
 # how to manage the numbers so we don't risk collisions.  Oh, and they
 # need to come out of mm, which should help solve the management problem.
-DUMMY = (0, 10)
 
-# Arbitrary number.  XXX find a way to make sure we don't duplicate these.
-PDICTKEYSOBJECT_TYPE_NUM = 40
+# Arbitrary numbers.  XXX find a way to make sure we don't duplicate these.
+PSPARSEDICTKEYSOBJECT_TYPE_NUM = 40
+PDICTKEYSOBJECT_TYPE_NUM = 41
+PDICTVALUESOBJECT_TYPE_NUM = 42
 
 # Python3's hash function is not guaranteed to produce the same results
 # between versions or across platforms, so we need a stable hash of our own.
-# XXX This is a prime candidate for being recoded in C, hopefully avoiding
-# the string conversion step somehow.
-def is_hashable(s):
-    return hasattr(s, "__len__") == False or len(s) > 0
-
-def fixed_hash(s):
-    if not is_hashable(s):
-        raise TypeError("Key is not hashable")
+# The hash values are stored in the dict and set tables, so the scheme used to
+# compute them is recorded in the pool, and the tables are rebuilt when a pool
+# written with a different scheme is opened.  Scheme 0 was md5(str(key)).
+HASH_SCHEME = 1
+
+_MASK64 = 2**64 - 1
+
+# Zero and all ones mark unused and dummy set table entries, so keys that
+# hash to them get these instead.  They are arbitrary, so that no small int
+# or other common key hashes to them as well.
+_HASH_FOR_ZERO = 0x5d588b656c078965
+_HASH_FOR_ONES = 0x6c8e9cf570932bd5
+
+# Arbitrary constants separating the encodings of the different key types.
+_INT_SEED = 0x9e3779b97f4a7c15
+_STR_SEED = 0x243f6a8885a308d3
+_BYTES_SEED = 0x13198a2e03707344
+_FLOAT_SEED = 0xa4093822299f31d0
+_OTHER_SEED = 0x082efa98ec4e6c89
+_FROZENSET_SEED = 0x452821e638d01377
+
+# The primes CPython uses for its xxHash based tuple hash.
+_XXPRIME_1 = 11400714785074694791
+_XXPRIME_2 = 14029467366897019727
+_XXPRIME_5 = 2870177450012600261
+
+if sys.version_info[0] > 2:
+    _encode_errors = 'surrogatepass'
+    _text_types = (str,)
+    _bytes_types = (bytes,)
+    _int_types = (int,)
+else:
+    # A py2 str is equal to the unicode string with the same ascii text, so
+    # they must hash alike.
+    _encode_errors = 'strict'
+    _text_types = (str, unicode)
+    _bytes_types = ()
+    _int_types = (int, long)
+
+
+def _mix64(z):
+    # The splitmix64 finalizer, which spreads every input bit over the word.
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _hash_bytes(data, seed):
+    # zlib's checksums are the fastest stable hashes available from the
+    # standard library on every version we support.  The crc forms the low
+    # bits, which pick the table slot, and adler32 the high bits, which feed
+    # the probe sequence.
+    return ((zlib.adler32(data) & 0xffffffff) << 32
+            | (zlib.crc32(data) & 0xffffffff)) ^ seed
+
+
+def _hash_text(s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8', _encode_errors)
+    return _hash_bytes(s, _STR_SEED)
+
+
+def _hash_int(i):
+    # Like CPython, use the value itself: consecutive ints fill consecutive
+    # slots.
+    if -2**63 <= i <= _MASK64:
+        return i & _MASK64
+    return _hash_bytes(repr(i).rstrip('L').encode('ascii'), _INT_SEED)
+
+
+def _hash_float(f):
+    if f.is_integer():
+        return _hash_int(int(f))
+    return _hash_bytes(struct.pack('<d', f), _FLOAT_SEED)
+
+
+def _hash_tuple(t):
+    acc = _XXPRIME_5
+    for item in t:
+        acc = (acc + _hash(item) * _XXPRIME_2) & _MASK64
+        acc = ((acc << 31) | (acc >> 33)) & _MASK64
+        acc = (acc * _XXPRIME_1) & _MASK64
+    return (acc + (len(t) ^ _XXPRIME_5 ^ 3527539)) & _MASK64
+
+
+def _hash_frozenset(fs):
+    acc = len(fs)
+    for item in fs:
+        acc += _mix64(_hash(item) ^ _FROZENSET_SEED)
+    return _mix64(acc & _MASK64)
+
+
+def _cached(hasher):
+    # Wrap hasher for persistent immutables, which keep their hash in
+    # persistent memory so that it is only computed once.
+    def hash_cached(obj):
+        h = obj._p_cached_hash()
+        if h is None:
+            h = hasher(obj)
+            obj._p_cache_hash(h)
+        return h
+    return hash_cached
+
+
+_hashers = {
+    bool: _hash_int,
+    float: _hash_float,
+    tuple: _hash_tuple,
+    PersistentTuple: _cached(_hash_tuple),
+    frozenset: _hash_frozenset,
+    }
+for _t in _text_types:
+    _hashers[_t] = _hash_text
+for _t in _int_types:
+    _hashers[_t] = _hash_int
+for _t in _bytes_types:
+    _hashers[_t] = lambda b: _hash_bytes(b, _BYTES_SEED)
+
+
+def _hash(s):
+    try:
+        return _hashers[s.__class__](s)
+    except KeyError:
+        pass
+    # Subclasses of the handled types hash like their base type, since they
+    # compare equal to it.
+    for base in s.__class__.__mro__[1:]:
+        if base in _hashers:
+            return _hashers[base](s)
+    if getattr(s, '__hash__', None) is None:
+        raise TypeError("unhashable type: '{}'".format(s.__class__.__name__))
     s = str(s)
     if sys.version_info[0] > 2:
-        s = s.encode()
-    digits = hashlib.md5(s).hexdigest()
-    return int(digits[:16], 16) ^ int(digits[16:], 16)
+        s = s.encode('utf-8', _encode_errors)
+    return _hash_bytes(s, _OTHER_SEED)
+
+
+def fixed_hash(s):
+    """Return a 64 bit hash of s that is stable across processes.
+
+    Keys that compare equal hash alike, as long as they are of the types
+    encoded natively here (numbers, strings, bytes, tuples and frozensets)
+    or subclasses of them.  Other hashable keys are hashed via their str().
+    """
+    h = _hash(s)
+    if h == 0:
+        h = _HASH_FOR_ZERO
+    elif h == _MASK64:
+        h = _HASH_FOR_ONES
+    return h
+
 
 def _usable_fraction(n):
     return (2*n+1)//3
 
+def _ixtype(size):
+    # The indices are as narrow as the table size allows.
+    if size <= 0xff:
+        return 'int8_t'
+    if size <= 0xffff:
+        return 'int16_t'
+    if size <= 0xffffffff:
+        return 'int32_t'
+    return 'int64_t'
+
+def _indices_size(size):
+    # Keep the entries that follow the indices 8 byte aligned.
+    return (size * ffi.sizeof(_ixtype(size)) + 7) & ~7
+
+def _dk_indices(dk):
+    return ffi.cast(_ixtype(dk.dk_size) + ' *',
+                    ffi.cast('char *', dk) + ffi.sizeof('PDictKeysObject'))
+
+def _dk_entries(dk):
+    return ffi.cast('PDictKeyEntry *',
+                    ffi.cast('char *', dk) + ffi.sizeof('PDictKeysObject')
+                    + _indices_size(dk.dk_size))
+
+def _find_empty_slot(indices, mask, khash):
+    # Return the first slot on khash's probe sequence that doesn't index an
+    # entry.  Reusing DKIX_DUMMY slots is safe because dk_usable, not the
+    # number of free slots, limits the number of entries.
+    i = khash & mask
+    perturb = khash
+    while indices[i] >= 0:
+        perturb >>= PERTURB_SHIFT
+        i = (i*5 + perturb + 1) & mask
+    return i
+
+def _new_keys_object(mm, size):
+    assert size >= MIN_SIZE_SPLIT
+    usable = _usable_fraction(size)
+    with mm.transaction():
+        dk_oid = mm.zalloc(ffi.sizeof('PDictKeysObject')
+                           + _indices_size(size)
+                           + ffi.sizeof('PDictKeyEntry') * usable,
+                           type_num=PDICTKEYSOBJECT_TYPE_NUM)
+        dk = ffi.cast('PDictKeysObject *', mm.direct(dk_oid))
+        dk.dk_refcnt = 1
+        dk.dk_size = size
+        dk.dk_usable = usable
+        dk.dk_nentries = 0
+        # DKIX_EMPTY is all one bits at every index width.  The entries
+        # are zeroed, which makes their key and value OID_NULL.
+        nbytes = size * ffi.sizeof(_ixtype(size))
+        ffi.buffer(_dk_indices(dk), nbytes)[:] = b'\xff' * nbytes
+        # XXX Set dk_lookup to lookdict_unicode_nodummy if we end up using it.
+    return dk_oid
+
+def _append_entry(mm, keys, khash, k_oid, v_oid):
+    # Add an entry to keys, which must have room for it, and return its
+    # index.  The caller is responsible for the refcounts.
+    indices = _dk_indices(keys)
+    hashpos = _find_empty_slot(indices, keys.dk_size - 1, khash)
+    ix = keys.dk_nentries
+    ep = _dk_entries(keys) + ix
+    mm.snapshot_range(ep, ffi.sizeof('PDictKeyEntry'))
+    ep.me_hash = khash
+    ep.me_key = k_oid
+    ep.me_value = v_oid
+    mm.snapshot_range(indices + hashpos, ffi.sizeof(_ixtype(keys.dk_size)))
+    indices[hashpos] = ix
+    mm.snapshot_range(ffi.addressof(keys, 'dk_usable'),
+                      2 * ffi.sizeof('ssize_t'))
+    keys.dk_usable -= 1
+    keys.dk_nentries += 1
+    assert keys.dk_usable >= 0, "dk_usable is %s" % keys.dk_usable
+    return ix
+
+def _release_shared_keys(mm, keys_oid):
+    # Drop a reference to a shared keys object.  The keys object holds the
+    # references to its keys, so they go when it does.
+    keys = ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
+    with mm.transaction():
+        mm.snapshot_range(ffi.addressof(keys, 'dk_refcnt'),
+                          ffi.sizeof('ssize_t'))
+        keys.dk_refcnt -= 1
+        if keys.dk_refcnt < 1:
+            ep0 = _dk_entries(keys)
+            oids = [mm.otuple(ep0[i].me_key) for i in range(keys.dk_nentries)]
+            mm.free(keys_oid)
+            mm.decref_many(oids)
+
+def _rehash_shared_keys(mm, keys_oid):
+    # Recompute the hashes of a shared keys object and rebuild its indices in
+    # place, so that the entries keep their positions in the value arrays of
+    # the dicts sharing it.
+    keys = ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
+    size = keys.dk_size
+    indices = _dk_indices(keys)
+    ep0 = _dk_entries(keys)
+    with mm.transaction():
+        mm.snapshot_range(indices, _indices_size(size)
+                          + ffi.sizeof('PDictKeyEntry') * keys.dk_nentries)
+        nbytes = size * ffi.sizeof(_ixtype(size))
+        ffi.buffer(indices, nbytes)[:] = b'\xff' * nbytes
+        for ix in range(keys.dk_nentries):
+            ep = ep0[ix]
+            ep.me_hash = fixed_hash(mm.resurrect(ep.me_key))
+            indices[_find_empty_slot(indices, size - 1, ep.me_hash)] = ix
+
 class PersistentDict(abc.MutableMapping):
     """Persistent version of the 'dict' type."""
 
     # XXX locking
 
+    # _v_version is a volatile count of the changes made to the items
+    # through this object, which lets PersistentObject tell whether the
+    # attribute values it has cached from its dict may be out of date.
+
     def __init__(self, *args, **kw):
         if len(args) > 1:
             raise TypeError("PersistentDict expected at most 1"
                             "argument, got {}", len(args))
-        if args:
-            arg = args[0]
-            if hasattr(arg, 'items'):
-                arg = arg.items()
-            for key, value in arg:
-                self[key] = value
-        if kw:
-            for key, value in kw.items():
-                self[key] = value
-
-    def _p_new(self, manager):
+        self.update(*args, **kw)
+
+    def _p_new(self, manager, shared_keys=None):
+        # If shared_keys is given this is a split dict using those keys.
         mm = self._p_mm = manager
+        self._v_version = 0
         with mm.transaction():
             # XXX will want to implement a freelist here.
             self._p_oid = mm.zalloc(ffi.sizeof('PDictObject'))
             ob = ffi.cast('PObject *', mm.direct(self._p_oid))
             ob.ob_type = mm._get_type_code(PersistentDict)
             d = self._body = ffi.cast('PDictObject *', mm.direct(self._p_oid))
-            # This code may get moved to a _new_dict method when we implement
-            # split dicts.
-            d.ma_keys = self._new_keys_object(MIN_SIZE_COMBINED)
-            d.ma_values = mm.OID_NULL
+            if shared_keys is None:
+                d.ma_keys = _new_keys_object(mm, MIN_SIZE_COMBINED)
+                d.ma_values = mm.OID_NULL
+                return
+            keys = ffi.cast('PDictKeysObject *', mm.direct(shared_keys))
+            mm.snapshot_range(ffi.addressof(keys, 'dk_refcnt'),
+                              ffi.sizeof('ssize_t'))
+            keys.dk_refcnt += 1
+            d.ma_keys = shared_keys
+            # Start with room for the keys the other instances have.
+            d.ma_values = self._new_values_object(
+                                max(keys.dk_nentries, MIN_SIZE_SPLIT))
 
     def _p_resurrect(self, manager, oid):
         mm = self._p_mm = manager
         self._p_oid = oid
         self._body = ffi.cast('PDictObject *', mm.direct(oid))
+        self._v_version = 0
 
     # Methods and properties needed to implement the ABC required methods.
 
+    def _is_sparse(self):
+        keys_oid = self._p_mm.otuple(self._body.ma_keys)
+        return lib.pmemobj_type_num(keys_oid) == PSPARSEDICTKEYSOBJECT_TYPE_NUM
+
+    def _is_split(self):
+        return self._p_mm.otuple(self._body.ma_values) != self._p_mm.OID_NULL
+
     @property
     def _keys(self):
         mm = self._p_mm
+        if self._is_sparse():
+            self._convert_sparse_keys()
         keys_oid = mm.otuple(self._body.ma_keys)
         return ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
 
+    @property
+    def _values(self):
+        mm = self._p_mm
+        return ffi.cast('PDictValuesObject *', mm.direct(self._body.ma_values))
+
     def _growth_rate(self):
         return self._body.ma_used*2 + (self._keys.dk_size >> 1)
 
-    def _new_keys_object(self, size):
-        assert size >= MIN_SIZE_SPLIT
+    def _new_values_object(self, size):
         mm = self._p_mm
         with mm.transaction():
-            dk_oid = mm.zalloc(ffi.sizeof('PDictKeysObject')
-                               + ffi.sizeof('PDictKeyEntry') * (size - 1),
-                               type_num=PDICTKEYSOBJECT_TYPE_NUM)
-            dk = ffi.cast('PDictKeysObject *', mm.direct(dk_oid))
-            dk.dk_refcnt = 1
-            dk.dk_size = size
-            dk.dk_usable = _usable_fraction(size)
-            ep = ffi.cast('PDictKeyEntry *', ffi.addressof(dk.dk_entries[0]))
-            # Hash value of slot 0 is used by popitem, so it must be initizlied
-            ep[0].me_hash = 0
-            for i in range(size):
-                ep[i].me_key = mm.OID_NULL
-                ep[i].me_value = mm.OID_NULL
-            # XXX Set dk_lookup to lookdict_unicode_nodummy if we end up using it.
-        return dk_oid
-
-    def _free_keys_object(self, oid):
+            values_oid = mm.zalloc(ffi.sizeof('PDictValuesObject')
+                                   + ffi.sizeof('PObjPtr') * size,
+                                   type_num=PDICTVALUESOBJECT_TYPE_NUM)
+            values = ffi.cast('PDictValuesObject *', mm.direct(values_oid))
+            values.size = size
+        return values_oid
+
+    def _split_values(self, needed):
+        # Return the values of a split dict, grown to hold at least needed.
+        mm = self._p_mm
+        values = self._values
+        if values.size >= needed:
+            return values
+        size = min(values.size * 2, _usable_fraction(self._keys.dk_size))
+        size = max(size, needed)
+        with mm.transaction():
+            values_oid = mm.zrealloc(self._body.ma_values,
+                                     ffi.sizeof('PDictValuesObject')
+                                     + ffi.sizeof('PObjPtr') * size,
+                                     PDICTVALUESOBJECT_TYPE_NUM)
+            values = ffi.cast('PDictValuesObject *', mm.direct(values_oid))
+            values.size = size
+            mm.snapshot_range(ffi.addressof(self._body, 'ma_values'),
+                              ffi.sizeof('PObjPtr'))
+            self._body.ma_values = values_oid
+        return values
+
+    def _value_oid(self, ix):
+        # Return the oid of the value of entry ix, OID_NULL if it has none.
+        mm = self._p_mm
+        if self._is_split():
+            if ix >= self._body.ma_used:
+                return mm.OID_NULL
+            return mm.otuple(self._values.values[ix])
+        return mm.otuple(_dk_entries(self._keys)[ix].me_value)
+
+    def _live_entries(self):
+        # Return a list of (hash, key oid, value oid) for the entries in the
+        # dict, in order, from any keys layout.  This never converts the
+        # layout, so it is safe to use from gc.
+        mm = self._p_mm
+        keys_oid = mm.otuple(self._body.ma_keys)
+        result = []
+        if self._is_split():
+            keys = ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
+            ep0 = _dk_entries(keys)
+            values = self._values.values
+            for i in range(self._body.ma_used):
+                result.append((ep0[i].me_hash, mm.otuple(ep0[i].me_key),
+                               mm.otuple(values[i])))
+            return result
+        if self._is_sparse():
+            keys = ffi.cast('PSparseDictKeysObject *', mm.direct(keys_oid))
+            ep0 = ffi.cast('PDictKeyEntry *',
+                           ffi.addressof(keys.dk_entries[0]))
+            count = keys.dk_size
+        else:
+            keys = ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
+            ep0 = _dk_entries(keys)
+            count = keys.dk_nentries
+        for i in range(count):
+            ep = ep0[i]
+            me_value = mm.otuple(ep.me_value)
+            if me_value != mm.OID_NULL:
+                result.append((ep.me_hash, mm.otuple(ep.me_key), me_value))
+        return result
+
+    def _build_keys(self, newsize, entries):
+        # Install a new combined keys object of newsize holding entries, a
+        # list of (hash, key oid, value oid), and release the old keys.  We
+        # don't touch the refcounts, except that a split dict's keys belong
+        # to the shared keys object, so a dict that stops sharing them needs
+        # references of its own.
         mm = self._p_mm
-        dk = ffi.cast('PDictKeysObject *', mm.direct(oid))
-        ep = ffi.cast('PDictKeyEntry *', ffi.addressof(dk.dk_entries[0]))
+        body = self._body
+        oldkeys_oid = mm.otuple(body.ma_keys)
+        oldvalues_oid = mm.otuple(body.ma_values)
         with mm.transaction():
-            for i in range(dk.dk_size):
-                mm.xdecref(ep[i].me_key)
-                mm.xdecref(ep[i].me_value)
-            mm.free(oid)
+            newkeys_oid = _new_keys_object(mm, newsize)
+            newkeys = ffi.cast('PDictKeysObject *', mm.direct(newkeys_oid))
+            indices = _dk_indices(newkeys)
+            ep0 = _dk_entries(newkeys)
+            mask = newsize - 1
+            # The new keys object was allocated in this transaction, so it
+            # needs no snapshots.
+            for ix, (me_hash, me_key, me_value) in enumerate(entries):
+                ep = ep0[ix]
+                ep.me_hash = me_hash
+                ep.me_key = me_key
+                ep.me_value = me_value
+                indices[_find_empty_slot(indices, mask, me_hash)] = ix
+            newkeys.dk_usable -= len(entries)
+            newkeys.dk_nentries = len(entries)
+            mm.snapshot_range(ffi.addressof(body, 'ma_keys'),
+                              2 * ffi.sizeof('PObjPtr'))
+            body.ma_keys = newkeys_oid
+            body.ma_values = mm.OID_NULL
+            if oldvalues_oid == mm.OID_NULL:
+                mm.free(oldkeys_oid)
+            else:
+                log.debug('combining split dict %s', self._p_oid)
+                mm.incref_many([me_key for _, me_key, _ in entries])
+                mm.free(oldvalues_oid)
+                _release_shared_keys(mm, oldkeys_oid)
+
+    def _convert_sparse_keys(self):
+        # Dicts written before the compact layout have a sparse keys object.
+        # Move their entries into a compact one of the same size.
+        mm = self._p_mm
+        keys_oid = mm.otuple(self._body.ma_keys)
+        keys = ffi.cast('PSparseDictKeysObject *', mm.direct(keys_oid))
+        log.debug('converting sparse dict keys %s', keys_oid)
+        self._build_keys(keys.dk_size, self._live_entries())
 
     def _lookdict(self, key, khash):
-        # Generalized key lookup method.
+        # Generalized key lookup method.  Return the index of key's entry, or
+        # DKIX_EMPTY if it is not in the keys, and the index slot at which
+        # the search stopped.  For a split dict the entry may belong to
+        # another dict sharing the keys; see _value_oid.
         mm = self._p_mm
+        # If key is already stored, finding its oid is a match without
+        # resurrecting anything.  Other keys come from the pool's object
+        # cache once they have been resurrected.
+        k_oid = mm.known_oid(key)
         while True:
+            keys = self._keys
             keys_oid = mm.otuple(self._body.ma_keys)
-            keys = ffi.cast('PDictKeysObject *', mm.direct(keys_oid))
             mask = keys.dk_size - 1
-            ep0 = ffi.cast('PDictKeyEntry *', ffi.addressof(keys.dk_entries[0]))
+            indices = _dk_indices(keys)
+            ep0 = _dk_entries(keys)
             i = khash & mask
-            ep = ffi.addressof(ep0[i])
-            me_key = mm.otuple(ep.me_key)
-            if me_key == mm.OID_NULL:
-                return ep
-            if me_key == DUMMY:
-                freeslot = ep
-            else:
-                if ep.me_hash == khash:
-                    match = mm.resurrect(me_key) == key  # dict could mutate
-                    if (mm.otuple(self._body.ma_keys) == keys_oid
-                            and mm.otuple(ep.me_key) == me_key):
-                        if match:
-                            return ep
-                    else:
-                        continue  # mutatation, start over from the top.
-                freeslot = None
             perturb = khash
             while True:
-                i = (i << 2) + i + perturb + 1
-                ep = ep0[i & mask]
-                me_key = mm.otuple(ep.me_key)
-                if me_key == mm.OID_NULL:
-                    return ep if freeslot is None else freeslot
-                if ep.me_hash == khash and me_key != DUMMY:
+                ix = indices[i]
+                if ix == DKIX_EMPTY:
+                    return DKIX_EMPTY, i
+                if ix >= 0 and ep0[ix].me_hash == khash:
+                    me_key = mm.otuple(ep0[ix].me_key)
+                    if me_key == k_oid:
+                        return ix, i
                     match = mm.resurrect(me_key) == key  # dict could mutate
-                    if (mm.otuple(self._body.ma_keys) == keys_oid
-                            and mm.otuple(ep.me_key) == me_key):
-                        if match:
-                            return ep
-                    else:
+                    if (mm.otuple(self._body.ma_keys) != keys_oid
+                            or mm.otuple(ep0[ix].me_key) != me_key):
                         break  # mutation, start over from the top.
-                elif me_key == DUMMY and freeslot is None:
-                    freeslot = ep
-                perturb = perturb >> PERTURB_SHIFT
-                # We will eventually visit every key slot in the dict, once
-                # perturb goes to zero, so we will eventually do a return.
-
-    def _find_empty_slot(self, key, khash):
-        # Find slot from hash when key is not in dict.
-        mm = self._p_mm
-        keys = self._keys
+                    if match:
+                        return ix, i
+                perturb >>= PERTURB_SHIFT
+                i = (i*5 + perturb + 1) & mask
+                # We will eventually visit every index slot, once perturb
+                # goes to zero, and there is always an empty one.
+
+    def _find_index(self, keys, khash, ix):
+        # Return the index slot that points to entry ix.
+        indices = _dk_indices(keys)
         mask = keys.dk_size - 1
-        ep0 = ffi.cast('PDictKeyEntry *', ffi.addressof(keys.dk_entries[0]))
         i = khash & mask
-        ep = ffi.addressof(ep0[i])
         perturb = khash
-        while mm.otuple(ep.me_key) != mm.OID_NULL:
-            i = (i << 2) + i + perturb + 1
-            ep = ep0[i & mask]
-            perturb = perturb >> PERTURB_SHIFT
-        assert mm.otuple(ep.me_key) == mm.OID_NULL
-        return ep
+        while indices[i] != ix:
+            perturb >>= PERTURB_SHIFT
+            i = (i*5 + perturb + 1) & mask
+        return i
 
     def _insertion_resize(self):
-        # This is modeled on CPython's insertion_resize/dictresize, but
-        # assuming we always have a combined dict.  We copy the keys and values
-        # into a new dict structure and free the old one.  We don't touch the
-        # refcounts.
-        mm = self._p_mm
+        # This is modeled on CPython's insertion_resize/dictresize.  The
+        # result is always a combined dict.  Only the live entries are copied,
+        # so the deleted ones are dropped.
         minused = self._growth_rate()
         newsize = MIN_SIZE_COMBINED
         while newsize <= minused and newsize > 0:
             newsize = newsize << 1
-        oldkeys = self._keys
-        oldkeys_oid = mm.otuple(self._body.ma_keys)
+        self._build_keys(newsize, self._live_entries())
+
+    def _size_for(self, n):
+        # Return the smallest combined table size that can hold n entries.
+        newsize = MIN_SIZE_COMBINED
+        while _usable_fraction(newsize) < n:
+            newsize <<= 1
+        return newsize
+
+    def _insert_many(self, items):
+        # Insert the (key, value) pairs from items with at most one resize,
+        # doing the refcounting for all of them at the end.
+        mm = self._p_mm
+        if not items:
+            return
+        self._v_version += 1
         with mm.transaction():
-            mm.snapshot_range(ffi.addressof(self._body, 'ma_keys'),
+            if self._is_split():
+                for key, value in items:
+                    self[key] = value
+                return
+            self.reserve(self._body.ma_used + len(items))
+            body = self._body
+            new_oids = []
+            old_oids = []
+            for key, value in items:
+                khash = fixed_hash(key)
+                ix, hashpos = self._lookdict(key, khash)
+                v_oid = mm.persist(value)
+                new_oids.append(v_oid)
+                keys = self._keys
+                if ix >= 0:
+                    ep = _dk_entries(keys) + ix
+                    old_oids.append(mm.otuple(ep.me_value))
+                    mm.snapshot_range(ffi.addressof(ep, 'me_value'),
+                                      ffi.sizeof('PObjPtr'))
+                    ep.me_value = v_oid
+                    continue
+                k_oid = mm.persist(key)
+                new_oids.append(k_oid)
+                _append_entry(mm, keys, khash, k_oid, v_oid)
+                mm.snapshot_range(ffi.addressof(body, 'ma_used'),
+                                  ffi.sizeof('size_t'))
+                body.ma_used += 1
+            # The increfs go first, in case a new value replaced itself.
+            mm.incref_many(new_oids)
+            mm.decref_many(old_oids)
+
+    def _maybe_compact(self):
+        # Rebuild a combined dict's keys once at least half of the entries
+        # used up are deleted ones.  Those still take up dk_usable, and their
+        # DKIX_DUMMY index slots lengthen the probe sequences.  The new keys
+        # are sized for twice the live items, so a dict has to lose or churn
+        # through as many items again before the next rebuild.
+        keys = self._keys
+        used = self._body.ma_used
+        deleted = _usable_fraction(keys.dk_size) - keys.dk_usable - used
+        if deleted >= MIN_SIZE_COMBINED and deleted >= used:
+            log.debug('compacting dict %s: %s live, %s deleted',
+                      self._p_oid, used, deleted)
+            self._build_keys(self._size_for(used * 2), self._live_entries())
+
+    def _split_insert(self, key, khash, ix, v_oid):
+        # Store v_oid under key in a split dict if that keeps the values in
+        # the order of the shared entries.  ix is the result of _lookdict.
+        # Return False if the dict has to be combined first.
+        mm = self._p_mm
+        body = self._body
+        used = body.ma_used
+        if 0 <= ix < used:
+            values = self._values
+            old_v_oid = mm.otuple(values.values[ix])
+            mm.snapshot_range(ffi.addressof(values.values, ix),
                               ffi.sizeof('PObjPtr'))
-            self._body.ma_keys = self._new_keys_object(newsize)
-            oldsize = oldkeys.dk_size
-            old_ep0 = ffi.cast('PDictKeyEntry *',
-                               ffi.addressof(oldkeys.dk_entries[0]))
-            for i in range(oldsize):
-                old_ep = old_ep0[i]
-                me_value = mm.otuple(old_ep.me_value)
-                if me_value != mm.OID_NULL:
-                    me_key = mm.otuple(old_ep.me_key)
-                    assert me_key != DUMMY
-                    me_hash = old_ep.me_hash
-                    new_ep = self._find_empty_slot(me_key, me_hash)
-                    new_ep.me_key = me_key
-                    new_ep.me_hash = me_hash
-                    new_ep.me_value = me_value
-            self._keys.dk_usable -= self._body.ma_used
-            mm.free(oldkeys_oid)
+            values.values[ix] = v_oid
+            mm.decref(old_v_oid)
+            return True
+        keys = self._keys
+        if ix == DKIX_EMPTY:
+            # Only the dict that is furthest along may add a key.
+            if used != keys.dk_nentries or keys.dk_usable <= 0:
+                return False
+            k_oid = mm.persist(key)
+            mm.incref(k_oid)
+            ix = _append_entry(mm, keys, khash, k_oid, mm.OID_NULL)
+        elif ix != used:
+            return False
+        values = self._split_values(ix + 1)
+        mm.snapshot_range(ffi.addressof(values.values, ix),
+                          ffi.sizeof('PObjPtr'))
+        values.values[ix] = v_oid
+        mm.snapshot_range(ffi.addressof(body, 'ma_used'),
+                          ffi.sizeof('size_t'))
+        body.ma_used += 1
+        return True
+
+    def _delete_entry(self, keys, hashpos, ix):
+        # Remove entry ix, found at index slot hashpos, and return its key
+        # and value oids without touching their refcounts.
+        mm = self._p_mm
+        indices = _dk_indices(keys)
+        mm.snapshot_range(indices + hashpos, ffi.sizeof(_ixtype(keys.dk_size)))
+        indices[hashpos] = DKIX_DUMMY
+        ep = _dk_entries(keys) + ix
+        mm.snapshot_range(ep, ffi.sizeof('PDictKeyEntry'))
+        k_oid = mm.otuple(ep.me_key)
+        v_oid = mm.otuple(ep.me_value)
+        ep.me_key = mm.OID_NULL
+        ep.me_value = mm.OID_NULL
+        mm.snapshot_range(ffi.addressof(self._body, 'ma_used'),
+                          ffi.sizeof('size_t'))
+        self._body.ma_used -= 1
+        return k_oid, v_oid
+
+    def _pop_split_value(self):
+        # Remove the last value of a split dict and return its oid without
+        # touching its refcount.  The key stays in the shared keys.
+        mm = self._p_mm
+        body = self._body
+        values = self._values
+        ix = body.ma_used - 1
+        v_oid = mm.otuple(values.values[ix])
+        mm.snapshot_range(ffi.addressof(values.values, ix),
+                          ffi.sizeof('PObjPtr'))
+        values.values[ix] = mm.OID_NULL
+        mm.snapshot_range(ffi.addressof(body, 'ma_used'),
+                          ffi.sizeof('size_t'))
+        body.ma_used = ix
+        return v_oid
 
     def _dumpdict(self):
         # This is for debugging.
         mm = self._p_mm
         keys = self._keys
-        ep0 = ffi.cast('PDictKeyEntry *', ffi.addressof(keys.dk_entries[0]))
-        log.debug('size: %s', keys.dk_size)
-        for i in range(keys.dk_size):
+        indices = _dk_indices(keys)
+        ep0 = _dk_entries(keys)
+        log.debug('size: %s, nentries: %s, usable: %s, split: %s',
+                  keys.dk_size, keys.dk_nentries, keys.dk_usable,
+                  self._is_split())
+        log.debug('indices: %s', [indices[i] for i in range(keys.dk_size)])
+        for i in range(keys.dk_nentries):
             ep = ep0[i]
             log.debug('hash: %s, key oid: %s, value oid: %s',
-                    ep.me_hash, mm.otuple(ep.me_key), mm.otuple(ep.me_value))
+                    ep.me_hash, mm.otuple(ep.me_key), self._value_oid(i))
 
     def __len__(self):
         return self._body.ma_used
@@ -251,79 +712,234 @@ class PersistentDict(abc.MutableMapping):
         # This is modeled on CPython's insertdict.
         khash = fixed_hash(key)
         mm = self._p_mm
-        keys = self._keys
-        ep = self._lookdict(key, khash)
+        ix, hashpos = self._lookdict(key, khash)
+        self._v_version += 1
         with mm.transaction():
             v_oid = mm.persist(value)
-            old_v_oid = mm.otuple(ep.me_value)
-            me_key = mm.otuple(ep.me_key)
-            if old_v_oid != mm.OID_NULL:
-                assert me_key not in (mm.OID_NULL, DUMMY)
+            mm.incref(v_oid)
+            if self._is_split():
+                if self._split_insert(key, khash, ix, v_oid):
+                    return
+                # The key is not in the dict, or it would have been stored.
+                self._insertion_resize()
+                ix = DKIX_EMPTY
+            keys = self._keys
+            if ix >= 0:
+                ep = _dk_entries(keys) + ix
+                old_v_oid = mm.otuple(ep.me_value)
+                mm.snapshot_range(ffi.addressof(ep, 'me_value'),
+                                  ffi.sizeof('PObjPtr'))
                 ep.me_value = v_oid
-                mm.incref(v_oid)
                 mm.decref(old_v_oid)
                 return
             k_oid = mm.persist(key)
-            if me_key == mm.OID_NULL:
-                if keys.dk_usable <= 0:
-                    self._insertion_resize()
-                    keys = self._keys
-                ep = self._find_empty_slot(key, khash)
-                keys.dk_usable -= 1
-                assert keys.dk_usable >= 0, "dk_usable is %s" % keys.dk_usable
-                ep.me_key = k_oid
-                mm.incref(k_oid)
-                ep.me_hash = khash
-            else:
-                if me_key == DUMMY:
-                    ep.me_key = k_oid
-                    mm.incref(k_oid)
-                    ep.me_hash = khash
-                else:
-                    raise NotImplementedError("CPython algo thinks this should"
-                                              " be a split dict at this point")
+            mm.incref(k_oid)
+            if keys.dk_usable <= 0:
+                self._insertion_resize()
+                keys = self._keys
+            _append_entry(mm, keys, khash, k_oid, v_oid)
+            mm.snapshot_range(ffi.addressof(self._body, 'ma_used'),
+                              ffi.sizeof('size_t'))
             self._body.ma_used += 1
-            ep.me_value = v_oid
-            mm.incref(v_oid)
-            assert mm.otuple(ep.me_key) not in (mm.OID_NULL, DUMMY)
 
     def __getitem__(self, key):
         mm = self._p_mm
         khash = fixed_hash(key)
-        ep = self._lookdict(key, khash)
-        if ep is None or mm.otuple(ep.me_value) == mm.OID_NULL:
+        ix, hashpos = self._lookdict(key, khash)
+        if ix < 0:
             raise KeyError(key)
-        mm = self._p_mm
-        return self._p_mm.resurrect(ep.me_value)
+        v_oid = self._value_oid(ix)
+        if v_oid == mm.OID_NULL:
+            raise KeyError(key)
+        return mm.resurrect(v_oid)
+
+    def __contains__(self, key):
+        ix, hashpos = self._lookdict(key, fixed_hash(key))
+        return ix >= 0 and self._value_oid(ix) != self._p_mm.OID_NULL
 
     def __delitem__(self, key):
         mm = self._p_mm
         khash = fixed_hash(key)
-        ep = self._lookdict(key, khash)
-        if ep is None or mm.otuple(ep.me_value) == mm.OID_NULL:
+        ix, hashpos = self._lookdict(key, khash)
+        if ix < 0 or self._value_oid(ix) == mm.OID_NULL:
             raise KeyError(key)
+        self._v_version += 1
         with mm.transaction():
-            old_value_oid = mm.otuple(ep.me_value)
-            ep.me_value = mm.OID_NULL
-            self._body.ma_used -= 1
-            old_key_oid = mm.otuple(ep.me_key)
-            ep.me_key = DUMMY
-            mm.decref(old_value_oid)
-            mm.decref(old_key_oid)
-
-    def __iter__(self):
+            if self._is_split():
+                if ix == self._body.ma_used - 1:
+                    mm.decref(self._pop_split_value())
+                    return
+                # Like CPython, don't leave holes in a split dict's values.
+                self._insertion_resize()
+                ix, hashpos = self._lookdict(key, khash)
+            k_oid, v_oid = self._delete_entry(self._keys, hashpos, ix)
+            self._maybe_compact()
+            mm.decref(v_oid)
+            mm.decref(k_oid)
+
+    def _iter_entries(self):
+        # Yield the (key oid, value oid) of each item, in order, walking the
+        # entries just once.
         mm = self._p_mm
         keys = self._keys
-        ep0 = ffi.cast('PDictKeyEntry *', ffi.addressof(keys.dk_entries[0]))
-        for i in range(keys.dk_size):
+        keys_oid = mm.otuple(self._body.ma_keys)
+        split = self._is_split()
+        used = self._body.ma_used
+        ep0 = _dk_entries(keys)
+        if split:
+            values = self._values.values
+        i = 0
+        while i < (used if split else keys.dk_nentries):
+            if self._body.ma_used != used:
+                raise RuntimeError("dictionary changed size during iteration")
+            if mm.otuple(self._body.ma_keys) != keys_oid:
+                raise RuntimeError("dictionary keys changed during iteration")
             ep = ep0[i]
-            if (ep.me_hash == ffi.NULL
-                    or mm.otuple(ep.me_key) in (mm.OID_NULL, DUMMY)):
+            v_oid = mm.otuple(values[i] if split else ep.me_value)
+            i += 1
+            if v_oid == mm.OID_NULL:
                 continue
-            yield mm.resurrect(ep.me_key)
+            yield mm.otuple(ep.me_key), v_oid
+
+    def __iter__(self):
+        mm = self._p_mm
+        for k_oid, v_oid in self._iter_entries():
+            yield mm.resurrect(k_oid)
 
     # Additional dict methods not provided by the ABC.
 
+    def popitem(self):
+        # Like CPython's, pop the most recently inserted item.  Dropping the
+        # trailing deleted entries from dk_nentries keeps iteration cheap.
+        mm = self._p_mm
+        if not self._body.ma_used:
+            raise KeyError('popitem(): dictionary is empty')
+        self._v_version += 1
+        keys = self._keys
+        ep0 = _dk_entries(keys)
+        if self._is_split():
+            with mm.transaction():
+                k_oid = mm.otuple(ep0[self._body.ma_used - 1].me_key)
+                v_oid = self._pop_split_value()
+                item = mm.resurrect(k_oid), mm.resurrect(v_oid)
+                mm.decref(v_oid)
+            return item
+        ix = keys.dk_nentries - 1
+        while mm.otuple(ep0[ix].me_value) == mm.OID_NULL:
+            ix -= 1
+        hashpos = self._find_index(keys, ep0[ix].me_hash, ix)
+        with mm.transaction():
+            k_oid, v_oid = self._delete_entry(keys, hashpos, ix)
+            # Resurrect before the decrefs, which may free the objects.
+            item = mm.resurrect(k_oid), mm.resurrect(v_oid)
+            mm.snapshot_range(ffi.addressof(keys, 'dk_nentries'),
+                              ffi.sizeof('ssize_t'))
+            keys.dk_nentries = ix
+            self._maybe_compact()
+            mm.decref(v_oid)
+            mm.decref(k_oid)
+        return item
+
+    def clear(self):
+        mm = self._p_mm
+        body = self._body
+        self._v_version += 1
+        if self._is_split():
+            # A split dict stays split; only its values go.
+            with mm.transaction():
+                oids = []
+                while body.ma_used:
+                    oids.append(self._pop_split_value())
+                mm.decref_many(oids)
+            return
+        if not body.ma_used and not self._is_sparse():
+            keys = self._keys
+            if keys.dk_size == MIN_SIZE_COMBINED and not keys.dk_nentries:
+                return
+        with mm.transaction():
+            oids = []
+            for me_hash, me_key, me_value in self._live_entries():
+                oids.append(me_key)
+                oids.append(me_value)
+            self._build_keys(MIN_SIZE_COMBINED, [])
+            mm.snapshot_range(ffi.addressof(body, 'ma_used'),
+                              ffi.sizeof('size_t'))
+            body.ma_used = 0
+            mm.decref_many(oids)
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    if sys.version_info[0] < 3:
+        def items(self):
+            return list(_ItemsView(self))
+
+        def values(self):
+            return list(_ValuesView(self))
+
+        def iteritems(self):
+            return iter(_ItemsView(self))
+
+        def itervalues(self):
+            return iter(_ValuesView(self))
+
+    def update(self, *args, **kw):
+        if len(args) > 1:
+            raise TypeError("update expected at most 1 arguments,"
+                            " got {}".format(len(args)))
+        items = []
+        if args:
+            arg = args[0]
+            if isinstance(arg, abc.Mapping):
+                items.extend(arg.items())
+            elif hasattr(arg, 'keys'):
+                items.extend((key, arg[key]) for key in arg.keys())
+            else:
+                items.extend(arg)
+        items.extend(kw.items())
+        self._insert_many(items)
+
+    def fromkeys(self, iterable, value=None):
+        """Return a new dict, in the same pool, with keys from iterable.
+
+        Unlike dict.fromkeys this must be called on an instance, since that
+        is where the pool comes from.
+        """
+        d = self._p_mm.new(self.__class__)
+        d._insert_many([(key, value) for key in iterable])
+        return d
+
+    def compact(self):
+        """Rebuild the dict in the smallest table that holds its items."""
+        mm = self._p_mm
+        if self._is_split():
+            # Split dicts have no deleted entries to drop.
+            return
+        used = self._body.ma_used
+        newsize = self._size_for(used)
+        keys = self._keys
+        if (keys.dk_size == newsize
+                and keys.dk_usable == _usable_fraction(newsize) - used):
+            return
+        with mm.transaction():
+            self._build_keys(newsize, self._live_entries())
+
+    def reserve(self, n):
+        """Make room for the dict to hold n items without resizing."""
+        mm = self._p_mm
+        split = self._is_split()
+        keys = self._keys
+        if not split and keys.dk_usable >= n - self._body.ma_used:
+            return
+        if split and n <= self._body.ma_used:
+            return
+        newsize = self._size_for(max(n, self._body.ma_used))
+        with mm.transaction():
+            self._build_keys(newsize, self._live_entries())
+
     @recursive_repr()
     def __repr__(self):
         return "{}({{{}}})".format(self.__class__.__name__,
@@ -333,22 +949,60 @@ class PersistentDict(abc.MutableMapping):
     # Additional methods required by the pmemobj API.
 
     def _p_traverse(self):
-        mm = self._p_mm
-        keys = self._keys
-        ep0 = ffi.cast('PDictKeyEntry *', ffi.addressof(keys.dk_entries[0]))
-        for i in range(keys.dk_size):
-            ep = ep0[i]
-            if (ep.me_hash == ffi.NULL
-                    or mm.otuple(ep.me_key) in (mm.OID_NULL, DUMMY)):
-                continue
-            yield mm.otuple(ep.me_key)
-            yield mm.otuple(ep.me_value)
+        # The keys of a split dict are also traversed by the pool, through
+        # its table of shared keys.
+        for me_hash, me_key, me_value in self._live_entries():
+            yield me_key
+            yield me_value
 
     def _p_substructures(self):
-        return ((self._p_mm.otuple(self._body.ma_keys),
-                 PDICTKEYSOBJECT_TYPE_NUM),
-               )
+        mm = self._p_mm
+        if self._is_split():
+            return ((mm.otuple(self._body.ma_keys), PDICTKEYSOBJECT_TYPE_NUM),
+                    (mm.otuple(self._body.ma_values),
+                     PDICTVALUESOBJECT_TYPE_NUM))
+        if self._is_sparse():
+            type_num = PSPARSEDICTKEYSOBJECT_TYPE_NUM
+        else:
+            type_num = PDICTKEYSOBJECT_TYPE_NUM
+        return ((mm.otuple(self._body.ma_keys), type_num),)
+
+    def _p_rehash(self):
+        # Recompute the stored key hashes after a change of hash scheme.
+        mm = self._p_mm
+        if self._is_split():
+            # The pool rehashes the shared keys.
+            return
+        size = self._keys.dk_size
+        entries = [(fixed_hash(mm.resurrect(me_key)), me_key, me_value)
+                   for me_hash, me_key, me_value in self._live_entries()]
+        self._build_keys(size, entries)
 
     def _p_deallocate(self):
+        mm = self._p_mm
         self.clear()
-        self._p_mm.free(self._body.ma_keys)
+        if self._is_split():
+            mm.free(self._body.ma_values)
+            _release_shared_keys(mm, self._body.ma_keys)
+        else:
+            mm.free(self._body.ma_keys)
+
+
+class _ItemsView(abc.ItemsView):
+    # Resurrect the keys and values straight from the entries, rather than
+    # looking up each key again the way the ABC does.
+
+    def __iter__(self):
+        d = self._mapping
+        mm = d._p_mm
+        for k_oid, v_oid in d._iter_entries():
+            yield mm.resurrect(k_oid), mm.resurrect(v_oid)
+
+
+class _ValuesView(abc.ValuesView):
+
+    def __iter__(self):
+        d = self._mapping
+        mm = d._p_mm
+        for k_oid, v_oid in d._iter_entries():
+            yield mm.resurrect(v_oid)
@@ -101,59 +101,231 @@ class PersistentList(abc.MutableSequence):
             if index > size:
                 index = size
             items = self._items
-            mm.snapshot_range(items + index,
-                              ffi.offsetof('PObjPtr *', newsize))
-            for i in range(size, index, -1):
-                items[i] = items[i-1]
+            ptr_size = ffi.sizeof('PObjPtr')
+            mm.snapshot_range(items + index, (newsize - index) * ptr_size)
+            ffi.memmove(items + index + 1, items + index,
+                        (size - index) * ptr_size)
             v_oid = mm.persist(value)
             mm.incref(v_oid)
             items[index] = v_oid
             ffi.cast('PVarObject *', self._body).ob_size = newsize
 
+    def append(self, value):
+        mm = self._p_mm
+        size = self._size
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            self._resize(size + 1)
+            items = self._items
+            mm.snapshot_range(items + size, ffi.sizeof('PObjPtr'))
+            items[size] = v_oid
+            mm.incref(v_oid)
+            ffi.cast('PVarObject *', self._body).ob_size = size + 1
+
+    def extend(self, values):
+        # Unlike the ABC's extend, which appends one item at a time, size the
+        # item array once and write all of the new pointers with one copy.
+        mm = self._p_mm
+        # Copying the values first also makes lst.extend(lst) safe.
+        values = list(values)
+        count = len(values)
+        if not count:
+            return
+        size = self._size
+        newsize = size + count
+        with mm.transaction():
+            oids = [mm.persist(value) for value in values]
+            self._resize(newsize)
+            mm.snapshot_range(self._items + size,
+                              count * ffi.sizeof('PObjPtr'))
+            self._store(size, oids)
+            mm.incref_many(oids)
+            ffi.cast('PVarObject *', self._body).ob_size = newsize
+
     def _normalize_index(self, index):
         try:
             index = int(index)
         except TypeError:
-            # Assume it is a slice
-            # XXX fixme
-            raise NotImplementedError("Slicing not yet implemented")
+            raise TypeError("{} indices must be integers or slices,"
+                            " not {}".format(self.__class__.__name__,
+                                             index.__class__.__name__))
         if index < 0:
             index += self._size
         if index < 0 or index >= self._size:
             raise IndexError(index)
         return index
 
+    def _store(self, index, oids):
+        # Copy oids into the item array starting at index with one memmove.
+        # The caller is responsible for the snapshot and the refcounts.
+        if oids:
+            ffi.memmove(self._items + index, ffi.new('PObjPtr[]', oids),
+                        len(oids) * ffi.sizeof('PObjPtr'))
+
+    def _zero(self, index, count):
+        # Set count item cells starting at index to OID_NULL.
+        nbytes = count * ffi.sizeof('PObjPtr')
+        ffi.buffer(self._items + index, nbytes)[:] = b'\0' * nbytes
+
+    def _get_slice(self, index):
+        start, stop, step = index.indices(self._size)
+        if not len(range(start, stop, step)):
+            return []
+        items = self._items
+        resurrect = self._p_mm.resurrect
+        return [resurrect(items[i]) for i in range(start, stop, step)]
+
+    def _set_slice(self, index, values):
+        mm = self._p_mm
+        size = self._size
+        start, stop, step = index.indices(size)
+        # Copying the values first also makes lst[:] = lst safe.
+        values = list(values)
+        count = len(values)
+        ptr_size = ffi.sizeof('PObjPtr')
+        if step != 1:
+            indexes = range(start, stop, step)
+            if count != len(indexes):
+                raise ValueError("attempt to assign sequence of size {} to"
+                                 " extended slice of size {}".format(
+                                    count, len(indexes)))
+            if not count:
+                return
+            lo = min(indexes[0], indexes[-1])
+            hi = max(indexes[0], indexes[-1])
+            with mm.transaction():
+                oids = [mm.persist(value) for value in values]
+                items = self._items
+                mm.snapshot_range(items + lo, (hi - lo + 1) * ptr_size)
+                old_oids = []
+                for i, oid in zip(indexes, oids):
+                    old_oids.append(mm.otuple(items[i]))
+                    items[i] = oid
+                mm.incref_many(oids)
+                mm.decref_many(old_oids)
+            return
+        stop = max(start, stop)
+        if not count and start == stop:
+            return
+        newsize = size - (stop - start) + count
+        with mm.transaction():
+            oids = [mm.persist(value) for value in values]
+            items = self._items
+            old_oids = [mm.otuple(items[i]) for i in range(start, stop)]
+            if newsize > size:
+                self._resize(newsize)
+                items = self._items
+            if newsize != size:
+                mm.snapshot_range(items + start,
+                                  (max(size, newsize) - start) * ptr_size)
+                ffi.memmove(items + start + count, items + stop,
+                            (size - stop) * ptr_size)
+                if newsize < size:
+                    self._zero(newsize, size - newsize)
+                ob = ffi.cast('PVarObject *', self._body)
+                mm.snapshot_range(ffi.addressof(ob, 'ob_size'),
+                                  ffi.sizeof('size_t'))
+                ob.ob_size = newsize
+            else:
+                mm.snapshot_range(items + start, count * ptr_size)
+            self._store(start, oids)
+            mm.incref_many(oids)
+            mm.decref_many(old_oids)
+            if newsize < size:
+                self._resize(newsize)
+
+    def _del_slice(self, index):
+        mm = self._p_mm
+        size = self._size
+        start, stop, step = index.indices(size)
+        if step == 1:
+            self._set_slice(slice(start, stop), [])
+            return
+        indexes = range(start, stop, step)
+        if not len(indexes):
+            return
+        lo = min(indexes[0], indexes[-1])
+        deleted = set(indexes)
+        newsize = size - len(deleted)
+        ptr_size = ffi.sizeof('PObjPtr')
+        with mm.transaction():
+            items = self._items
+            old_oids = [mm.otuple(items[i]) for i in indexes]
+            kept = [mm.otuple(items[i]) for i in range(lo, size)
+                    if i not in deleted]
+            mm.snapshot_range(items + lo, (size - lo) * ptr_size)
+            self._store(lo, kept)
+            self._zero(newsize, size - newsize)
+            ob = ffi.cast('PVarObject *', self._body)
+            mm.snapshot_range(ffi.addressof(ob, 'ob_size'),
+                              ffi.sizeof('size_t'))
+            ob.ob_size = newsize
+            mm.decref_many(old_oids)
+            self._resize(newsize)
+
     def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._set_slice(index, value)
+            return
         mm = self._p_mm
         index = self._normalize_index(index)
         items = self._items
         with mm.transaction():
             v_oid = mm.persist(value)
             mm.snapshot_range(ffi.addressof(items, index),
-                              ffi.sizeof('PObjPtr *'))
+                              ffi.sizeof('PObjPtr'))
             mm.xdecref(items[index])
             items[index] = v_oid
             mm.incref(v_oid)
 
     def __delitem__(self, index):
+        if isinstance(index, slice):
+            self._del_slice(index)
+            return
         mm = self._p_mm
         index = self._normalize_index(index)
         size = self._size
         newsize = size - 1
-        items = self._items
         with mm.transaction():
-            ffi.cast('PVarObject *', self._body).ob_size = newsize
-            # We can't completely hide the process of transformation...this
-            # really needs a lock (or translation to GIL-locked C).
-            mm.snapshot_range(ffi.addressof(items, index),
-                              ffi.offsetof('PObjPtr *', size))
-            oid = mm.otuple(items[index])
-            for i in range(index, newsize):
-                items[i] = items[i+1]
+            oid = self._remove(index)
             mm.decref(oid)
             self._resize(newsize)
 
+    def _remove(self, index):
+        # Remove the pointer at index from the item array and return it
+        # without touching its refcount.  The caller is responsible for the
+        # decref and the resize.
+        mm = self._p_mm
+        size = self._size
+        newsize = size - 1
+        items = self._items
+        ptr_size = ffi.sizeof('PObjPtr')
+        ob = ffi.cast('PVarObject *', self._body)
+        mm.snapshot_range(ffi.addressof(ob, 'ob_size'), ffi.sizeof('size_t'))
+        ob.ob_size = newsize
+        # We can't completely hide the process of transformation...this
+        # really needs a lock (or translation to GIL-locked C).
+        mm.snapshot_range(items + index, (size - index) * ptr_size)
+        oid = mm.otuple(items[index])
+        ffi.memmove(items + index, items + index + 1,
+                    (newsize - index) * ptr_size)
+        items[newsize] = mm.OID_NULL
+        return oid
+
+    def pop(self, index=-1):
+        mm = self._p_mm
+        index = self._normalize_index(index)
+        with mm.transaction():
+            oid = self._remove(index)
+            # Resurrect before the decref, which may free the object.
+            value = mm.resurrect(oid)
+            mm.decref(oid)
+            self._resize(self._size)
+        return value
+
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._get_slice(index)
         index = self._normalize_index(index)
         items = self._items
         return self._p_mm.resurrect(items[index])
@@ -161,6 +333,53 @@ class PersistentList(abc.MutableSequence):
     def __len__(self):
         return self._size
 
+    def _iter_oids(self, start=0):
+        # Resolve the item array once rather than going through __getitem__
+        # for every index.  The array moves if the list is reallocated during
+        # the iteration, which we detect by watching its offset.
+        body = self._body
+        ob = ffi.cast('PVarObject *', body)
+        items_off = None
+        i = start
+        while i < ob.ob_size:
+            if body.ob_items.off != items_off:
+                items = self._items
+                items_off = body.ob_items.off
+            yield items[i]
+            i += 1
+
+    def __iter__(self):
+        resurrect = self._p_mm.resurrect
+        for oid in self._iter_oids():
+            yield resurrect(oid)
+
+    def __reversed__(self):
+        body = self._body
+        ob = ffi.cast('PVarObject *', body)
+        resurrect = self._p_mm.resurrect
+        items_off = None
+        i = ob.ob_size - 1
+        while 0 <= i < ob.ob_size:
+            if body.ob_items.off != items_off:
+                items = self._items
+                items_off = body.ob_items.off
+            yield resurrect(items[i])
+            i -= 1
+
+    def iterchunks(self, size=256):
+        """Return an iterator over lists of up to size consecutive items.
+
+        Each list is produced by a single slice of the underlying array, which
+        is cheaper than iterating item by item when scanning a large list.
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1, not {}".format(size))
+        start = 0
+        while start < self._size:
+            chunk = self._get_slice(slice(start, start + size))
+            start += len(chunk)
+            yield chunk
+
     # Additional list methods not provided by the ABC.
 
     @recursive_repr()
@@ -168,17 +387,89 @@ class PersistentList(abc.MutableSequence):
         return "{}([{}])".format(self.__class__.__name__,
                                  ', '.join("{!r}".format(x) for x in self))
 
-    def __eq__(self, other):
-        if not (isinstance(other, PersistentList) or
-                isinstance(other, list)):
-            return NotImplemented
+    def _matcher(self, value):
+        # Return a function that tells whether the object stored at an oid is
+        # equal to value.  An oid identical to value's own oid is a match
+        # without looking at the object, and a str can be compared against the
+        # stored bytes without decoding them; anything else is resurrected.
+        mm = self._p_mm
+        v_oid = mm.known_oid(value)
+        raw = None
+        if type(value) is str:
+            raw = value
+            if sys.version_info[0] > 2:
+                try:
+                    raw = value.encode('utf-8')
+                except UnicodeEncodeError:
+                    raw = None
+        str_offset = ffi.sizeof('PObject')
+
+        def matches(oid):
+            oid = mm.otuple(oid)
+            if oid == v_oid:
+                return True
+            if raw is not None and oid[0]:
+                obj_ptr = ffi.cast('PObject *', mm.direct(oid))
+                # Type code 1 is always str, see MemoryManager.resurrect.
+                if obj_ptr.ob_type == 1:
+                    return ffi.string(
+                        ffi.cast('char *', obj_ptr) + str_offset) == raw
+            obj = mm.resurrect(oid)
+            return obj is value or obj == value
+        return matches
+
+    def __contains__(self, value):
+        matches = self._matcher(value)
+        for oid in self._iter_oids():
+            if matches(oid):
+                return True
+        return False
+
+    def index(self, value, start=0, stop=None):
+        size = self._size
+        if start < 0:
+            start = max(start + size, 0)
+        if stop is None:
+            stop = size
+        elif stop < 0:
+            stop += size
+        matches = self._matcher(value)
+        for i, oid in enumerate(self._iter_oids(start), start):
+            if i >= stop:
+                break
+            if matches(oid):
+                return i
+        raise ValueError("{!r} is not in list".format(value))
+
+    def count(self, value):
+        matches = self._matcher(value)
+        return sum(1 for oid in self._iter_oids() if matches(oid))
+
+    def _items_equal(self, other):
+        # Compare the items pairwise, by oid first where we can.
         if len(self) != len(other):
             return False
-        for i in range(len(self)):
-            if self[i] != other[i]:
+        mm = self._p_mm
+        if isinstance(other, PersistentList) and other._p_mm is mm:
+            for oid, other_oid in zip(self._iter_oids(), other._iter_oids()):
+                oid = mm.otuple(oid)
+                other_oid = mm.otuple(other_oid)
+                if oid == other_oid:
+                    continue
+                if mm.resurrect(oid) != mm.resurrect(other_oid):
+                    return False
+            return True
+        for oid, value in zip(self._iter_oids(), other):
+            if not self._matcher(value)(oid):
                 return False
         return True
 
+    def __eq__(self, other):
+        if not (isinstance(other, PersistentList) or
+                isinstance(other, list)):
+            return NotImplemented
+        return self._items_equal(other)
+
     if sys.version_info[0] < 3:
         def __ne__(self, other):
             return not self == other
@@ -199,6 +490,42 @@ class PersistentList(abc.MutableSequence):
                 mm.decref(oid)
             self._resize(0)
 
+    def reverse(self):
+        mm = self._p_mm
+        size = self._size
+        if size < 2:
+            return
+        items = self._items
+        oids = [mm.otuple(items[i]) for i in range(size)]
+        oids.reverse()
+        with mm.transaction():
+            mm.snapshot_range(items, size * ffi.sizeof('PObjPtr'))
+            self._store(0, oids)
+
+    def sort(self, key=None, reverse=False):
+        # Sort a permutation of the indexes and then rewrite the item array
+        # in that order.  Every item stays referenced by the list throughout,
+        # so no refcounts change and nothing is persisted again.
+        mm = self._p_mm
+        size = self._size
+        items = self._items
+        oids = [mm.otuple(items[i]) for i in range(size)]
+        keys = [mm.resurrect(oid) for oid in oids]
+        if key is not None:
+            keys = [key(value) for value in keys]
+        order = sorted(range(size), key=keys.__getitem__, reverse=reverse)
+        # The key function or the comparisons may have changed the list.  An
+        # item replaced in place must not be overwritten by its old oid, which
+        # the list no longer holds a reference to.
+        if (self._size != size or self._items != items
+                or [mm.otuple(items[i]) for i in range(size)] != oids):
+            raise ValueError("list modified during sort")
+        if order == list(range(size)):
+            return
+        with mm.transaction():
+            mm.snapshot_range(items, size * ffi.sizeof('PObjPtr'))
+            self._store(0, [oids[i] for i in order])
+
     # Additional methods required by the pmemobj API.
 
     def _p_traverse(self):
@@ -1,13 +1,127 @@
 import collections
+import hashlib
 import logging
+import struct
 
 from _pmem import ffi
 
+from .compat import string_types
 from .dict import PersistentDict
 
 
 log = logging.getLogger('nvm.pmemobj.object')
 
+# Attribute cache markers: a name not cached yet, and a name that is not one
+# of the persistent attributes, to be looked up normally.
+_MISSING = object()
+_NOT_PERSISTENT = object()
+
+
+class _SlotLayout(object):
+    """The persistent slots of a class using __pslots__."""
+
+    __slots__ = ('index', 'has_dict', 'digest')
+
+    def __init__(self, names, has_dict):
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.has_dict = has_dict
+        # Stored in each instance, so that a stored instance is not read
+        # through a layout whose names differ from the one it was written
+        # with.  It does not depend on the hash scheme of the pool.
+        data = u'\0'.join(names).encode('utf-8')
+        self.digest = struct.unpack('<Q', hashlib.sha1(data).digest()[:8])[0]
+
+
+class _PSlot(object):
+    """Descriptor for one of the persistent slots of a class."""
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        get = object.__getattribute__
+        mm = get(obj, '_p_mm')
+        oid = mm.otuple(get(obj, '_p_body').ob_slots[self.index])
+        if oid == mm.OID_NULL:
+            raise AttributeError(self.name)
+        return mm.resurrect(oid)
+
+    def __set__(self, obj, value):
+        get = object.__getattribute__
+        mm = get(obj, '_p_mm')
+        body = get(obj, '_p_body')
+        with mm.transaction():
+            v_oid = mm.persist(value)
+            mm.incref(v_oid)
+            old_oid = mm.otuple(body.ob_slots[self.index])
+            mm.snapshot_range(ffi.addressof(body.ob_slots, self.index),
+                              ffi.sizeof('PObjPtr'))
+            body.ob_slots[self.index] = v_oid
+            mm.xdecref(old_oid)
+
+    def __delete__(self, obj):
+        get = object.__getattribute__
+        mm = get(obj, '_p_mm')
+        body = get(obj, '_p_body')
+        oid = mm.otuple(body.ob_slots[self.index])
+        if oid == mm.OID_NULL:
+            raise AttributeError(self.name)
+        with mm.transaction():
+            mm.snapshot_range(ffi.addressof(body.ob_slots, self.index),
+                              ffi.sizeof('PObjPtr'))
+            body.ob_slots[self.index] = mm.OID_NULL
+            mm.decref(oid)
+
+
+def _extras_dict(self):
+    # The _p_dict of a class using __pslots__, which is only allocated when
+    # an attribute that has no slot is first set.
+    mm = self._p_mm
+    oid = mm.otuple(self._p_body.ob_dict)
+    if oid == mm.OID_NULL:
+        return None
+    return mm.resurrect(oid)
+
+
+def _slot_layout(cls):
+    # Return the _SlotLayout of cls, or None if none of its classes declare
+    # __pslots__.  The first call for a class installs the slot descriptors.
+    try:
+        return cls.__dict__['_p_slot_layout']
+    except KeyError:
+        pass
+    names = []
+    has_dict = False
+    declared = False
+    for klass in reversed(cls.__mro__):
+        if not issubclass(klass, PersistentObject) or klass is PersistentObject:
+            continue
+        pslots = klass.__dict__.get('__pslots__')
+        if pslots is None:
+            # As with __slots__, a class that does not declare any gives its
+            # instances a dict.
+            has_dict = True
+            continue
+        declared = True
+        if isinstance(pslots, string_types):
+            pslots = (pslots,)
+        for name in pslots:
+            if name == '__dict__':
+                has_dict = True
+            elif name not in names:
+                names.append(name)
+    layout = None
+    if declared:
+        layout = _SlotLayout(names, has_dict)
+        for name, index in layout.index.items():
+            setattr(cls, name, _PSlot(name, index))
+        cls._p_dict = property(_extras_dict)
+    cls._p_slot_layout = layout
+    return layout
+
 
 class PersistentObject(object):
     """Base class for arbitrary persistent objects.
@@ -28,7 +142,10 @@ class PersistentObject(object):
     # XXX locking
 
     def _p_new(self, manager):
-        self._p_dict = {}    # This makes __getattribute__ simpler
+        layout = _slot_layout(type(self))
+        if layout is not None:
+            self._p_new_slots(manager, layout)
+            return
         mm = self._p_mm = manager
         with mm.transaction():
             # XXX will want to implement a freelist here.
@@ -37,18 +154,74 @@ class PersistentObject(object):
             ob.ob_type = mm._get_type_code(self.__class__)
             d = self._p_body = ffi.cast('PObjectObject *',
                                         mm.direct(self._p_oid))
-            self._p_dict = mm.new(PersistentDict)
+            # Instances of a class share the keys of their attribute dicts.
+            self._p_dict = PersistentDict.__new__(PersistentDict)
+            self._p_dict._p_new(mm, mm._get_shared_keys(self.__class__))
             d.ob_dict = self._p_dict._p_oid
             mm.incref(self._p_dict._p_oid)
+        self._v_attr_cache = {}
+        self._v_attr_version = None
+        self._v__init__()
+
+    def _p_new_slots(self, manager, layout):
+        # A class using __pslots__ keeps its slots in the object itself, so
+        # a new instance is a single allocation.
+        mm = self._p_mm = manager
+        nslots = len(layout.index)
+        with mm.transaction():
+            self._p_oid = mm.zalloc(ffi.sizeof('PSlotsObject')
+                                    + nslots * ffi.sizeof('PObjPtr'))
+            ob = ffi.cast('PObject *', mm.direct(self._p_oid))
+            ob.ob_type = mm._get_type_code(self.__class__)
+            self._p_body = ffi.cast('PSlotsObject *', mm.direct(self._p_oid))
+            self._p_body.ob_nslots = nslots
+            self._p_body.ob_layout = layout.digest
+        self._v_attr_cache = {}
+        self._v_attr_version = None
         self._v__init__()
 
     def _p_resurrect(self, manager, oid):
         mm = self._p_mm = manager
         self._p_oid = oid
-        self._p_body = ffi.cast('PObjectObject *', mm.direct(oid))
-        self._p_dict = mm.resurrect(self._p_body.ob_dict)
+        layout = _slot_layout(type(self))
+        if layout is not None:
+            self._p_body = ffi.cast('PSlotsObject *', mm.direct(oid))
+            if self._p_body.ob_nslots != len(layout.index):
+                raise TypeError("{} object at {} has {} slots, but its class"
+                                " declares {}".format(
+                                    self.__class__.__name__, oid,
+                                    self._p_body.ob_nslots,
+                                    len(layout.index)))
+            if self._p_body.ob_layout != layout.digest:
+                raise TypeError("{} object at {} was stored with other"
+                                " __pslots__ than its class declares".format(
+                                    self.__class__.__name__, oid))
+        else:
+            self._p_body = ffi.cast('PObjectObject *', mm.direct(oid))
+            self._p_dict = mm.resurrect(self._p_body.ob_dict)
+        self._v_attr_cache = {}
+        self._v_attr_version = None
         self._v__init__()
 
+    def _p_extras(self):
+        # Return the dict holding the attributes that have no slot, creating
+        # it if need be.
+        d = self._p_dict
+        if d is not None:
+            return d
+        if not _slot_layout(type(self)).has_dict:
+            return None
+        mm = self._p_mm
+        with mm.transaction():
+            d = PersistentDict.__new__(PersistentDict)
+            d._p_new(mm, mm._get_shared_keys(self.__class__))
+            body = self._p_body
+            mm.snapshot_range(ffi.addressof(body, 'ob_dict'),
+                              ffi.sizeof('PObjPtr'))
+            body.ob_dict = d._p_oid
+            mm.incref(d._p_oid)
+        return d
+
     def _v__init__(self):
         """Method called during object creation *and* resurrection.
 
@@ -59,32 +232,89 @@ class PersistentObject(object):
 
     # Methods to emulate a normal class.
 
+    # The value of each persistent attribute read is cached, and so is the
+    # fact that a name (a method, say) is not a persistent attribute, so that
+    # the persistent dict is only searched once per name.  The cache is
+    # emptied whenever the _v_version of the dict shows that its items have
+    # changed, whether through this object or by writing to _p_dict
+    # directly.  Nothing is cached while a transaction is open, so an abort
+    # cannot leave the cache out of step with the dict.
+
     def __getattribute__(self, name):
-        if not name.startswith(('_p_', '_v_')) and name in self._p_dict:
-            return self._p_dict[name]
-        return object.__getattribute__(self, name)
+        get = object.__getattribute__
+        # The _p_ and _v_ names are never persistent attributes, and neither
+        # are the special ones.  These are also the only names looked up
+        # before _p_new or _p_resurrect has set up the cache.
+        if (name.startswith(('_p_', '_v_')) or
+                name[:2] == name[-2:] == '__'):
+            return get(self, name)
+        try:
+            cache = get(self, '_v_attr_cache')
+        except AttributeError:
+            # An instance that has no persistent state (yet).
+            return get(self, name)
+        d = get(self, '_p_dict')
+        version = None if d is None else d._v_version
+        if version != get(self, '_v_attr_version'):
+            cache.clear()
+            object.__setattr__(self, '_v_attr_version', version)
+        value = cache.get(name, _MISSING)
+        if value is _MISSING:
+            if d is None:
+                value = _NOT_PERSISTENT
+            else:
+                value = d.get(name, _NOT_PERSISTENT)
+            if not get(self, '_p_mm')._transaction.depth:
+                cache[name] = value
+        if value is _NOT_PERSISTENT:
+            return get(self, name)
+        return value
 
     def __setattr__(self, name, value):
         if name.startswith(('_p_', '_v_')):
             object.__setattr__(self, name, value)
             return
-        self._p_dict[name] = value
+        layout = _slot_layout(type(self))
+        if layout is not None and name in layout.index:
+            object.__setattr__(self, name, value)
+            return
+        d = self._p_extras()
+        if d is None:
+            raise AttributeError("{!r} object has no attribute {!r}".format(
+                                    self.__class__.__name__, name))
+        d[name] = value
 
     def __delattr__(self, name):
         if name.startswith(('_p_', '_v_')):
             object.__delattr__(self, name)
+            return
+        layout = _slot_layout(type(self))
+        if layout is not None and name in layout.index:
+            object.__delattr__(self, name)
+            return
+        d = self._p_dict
+        if d is None:
+            raise AttributeError(name)
         try:
-            del self._p_dict[name]
+            del d[name]
         except KeyError as e:
             raise AttributeError(str(e))
 
     # methods required for pmemobj Persistent API.
 
     def _p_traverse(self):
-        yield self._p_mm.otuple(self._p_body.ob_dict)
+        mm = self._p_mm
+        body = self._p_body
+        if mm.otuple(body.ob_dict) != mm.OID_NULL:
+            yield mm.otuple(body.ob_dict)
+        if _slot_layout(type(self)) is not None:
+            for i in range(body.ob_nslots):
+                oid = mm.otuple(body.ob_slots[i])
+                if oid != mm.OID_NULL:
+                    yield oid
 
     def _p_deallocate(self):
-        self._p_mm.decref(self._p_body.ob_dict)
+        self._p_mm.decref_many(list(self._p_traverse()))
 
     def _p_substructures(self):
         return []
@@ -2,14 +2,21 @@ import collections
 import errno
 if not hasattr(errno, 'ECANCELED'):
     errno.ECANCELED = 125  # 2.7 errno doesn't define this, so guess.
+import itertools
 import logging
 import os
 import sys
+from bisect import bisect_left, bisect_right
 from pickle import whichmodule, dumps, loads
 from threading import RLock
 
 from _pmem import lib, ffi
 from .list import PersistentList
+from .dict import (HASH_SCHEME, SHARED_KEYS_SIZE, PDICTKEYSOBJECT_TYPE_NUM,
+                   PersistentDict, _new_keys_object, _dk_entries,
+                   _rehash_shared_keys)
+from .set import PersistentSet, PersistentFrozenSet
+from .tuple import PersistentTuple
 from .compat import _coerce_fn, ErrChecker
 
 log = logging.getLogger('nvm.pmemobj')
@@ -25,8 +32,21 @@ MAX_OBJ_SIZE = lib.PMEMOBJ_MAX_ALLOC_SIZE
 OID_NULL = (lib.OID_NULL.pool_uuid_lo, lib.OID_NULL.off)
 # Arbitrary numbers.
 POBJECT_TYPE_NUM = 20
+SHARED_KEYS_TABLE_TYPE_NUM = 43
+LOG_BUFFER_TYPE_NUM = 70
 INTERNAL_ABORT_ERRNO = 99999
 
+# The persistent types that built-in containers are stored as, and the method
+# that fills in an empty one (None for the immutables, which must be created
+# with their contents).
+_CONTAINER_TYPES = {
+    list: (PersistentList, 'extend'),
+    dict: (PersistentDict, 'update'),
+    set: (PersistentSet, 'update'),
+    tuple: (PersistentTuple, None),
+    frozenset: (PersistentFrozenSet, None),
+    }
+
 # Dummy class used to mark objects persisted by pickling.
 class PICKLE_SENTINEL:
     pass
@@ -212,14 +232,74 @@ class _ObjCache(object):
             tlog.debug('not in cache: %r', oid)
 
 
+class _SnapshotTracker(object):
+    """Track the memory ranges snapshotted by the current transaction.
+
+    libpmemobj keeps every range added to a transaction until the outermost
+    transaction ends, so once a byte has been snapshotted there is no point in
+    adding it again.  We keep the covered ranges as a sorted list of disjoint
+    [start, end) intervals, merging overlapping and adjacent ranges as they
+    are added, and only pass the uncovered gaps of a new range to the library.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self.stats = collections.defaultdict(int)
+
+    def reset(self):
+        """Forget all covered ranges (called when a transaction ends)."""
+        del self._starts[:]
+        del self._ends[:]
+
+    def add(self, start, size):
+        """Record [start, start+size) and return the list of uncovered gaps.
+
+        Each gap is a (start, size) tuple that still needs to be snapshotted.
+        """
+        if size <= 0:
+            return []
+        end = start + size
+        starts, ends = self._starts, self._ends
+        stats = self.stats
+        stats['calls'] += 1
+        stats['bytes-requested'] += size
+        # First interval that overlaps or touches the new range...
+        lo = bisect_left(ends, start)
+        # ...and one past the last such interval.
+        hi = bisect_right(starts, end, lo)
+        gaps = []
+        pos = start
+        for i in range(lo, hi):
+            if starts[i] > pos:
+                gaps.append((pos, starts[i] - pos))
+            pos = max(pos, ends[i])
+        if pos < end:
+            gaps.append((pos, end - pos))
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi-1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+        if gaps:
+            stats['pmem-calls'] += len(gaps)
+            stats['bytes-snapshotted'] += sum(n for _, n in gaps)
+        else:
+            stats['suppressed'] += 1
+        return gaps
+
+
 class _Transaction(object):
 
     _FREE = 'F'
     _CONTEXT = 'C'
 
-    def __init__(self, pool_ptr, obj_cache):
+    def __init__(self, pool_ptr, obj_cache, snapshots):
         self.pool_ptr = pool_ptr
         self._obj_cache = obj_cache
+        self._snapshots = snapshots
+        self._reserved = []
+        self._log_buffers = []
         self._trans_stack = []
 
     @property
@@ -229,9 +309,14 @@ class _Transaction(object):
     def begin(self):
         """Start a new (sub)transaction."""
         tlog.debug('start_transaction %s', self._trans_stack)
+        outermost = not self._trans_stack
+        if outermost:
+            self._snapshots.reset()
         _err_check.check_errno(
             lib.pmemobj_tx_begin(self.pool_ptr, ffi.NULL, ffi.NULL))
         self._trans_stack.append(self._FREE)
+        if outermost:
+            self._append_reserved()
 
     def commit(self):
         """Commit the current (sub)transaction."""
@@ -242,7 +327,11 @@ class _Transaction(object):
             raise RuntimeError("Non-context commit inside a context")
         self._trans_stack.pop()
         lib.pmemobj_tx_commit()
-        _err_check.check_errno(lib.pmemobj_tx_end())
+        try:
+            _err_check.check_errno(lib.pmemobj_tx_end())
+        finally:
+            if not self._trans_stack:
+                self._ended()
 
     def abort(self, errno=errno.ECANCELED):
         """Abort the current (sub)transaction."""
@@ -251,16 +340,26 @@ class _Transaction(object):
             raise RuntimeError("abort called outside of transaction")
         lib.pmemobj_tx_abort(errno)
         self._obj_cache.clear_transaction_cache()
+        self._snapshots.reset()
         if self._trans_stack[-1] == self._FREE:
             self._trans_stack.pop()
-            # This will raise ECANCELED.
-            _err_check.check_errno(lib.pmemobj_tx_end())
+            try:
+                # This will raise ECANCELED.
+                _err_check.check_errno(lib.pmemobj_tx_end())
+            finally:
+                if not self._trans_stack:
+                    self._ended()
 
     def __enter__(self):
+        outermost = not self._trans_stack
+        if outermost:
+            self._snapshots.reset()
         self._trans_stack.append(self._CONTEXT)
         tlog.debug('__enter__ %s', self._trans_stack)
         _err_check.check_errno(
             lib.pmemobj_tx_begin(self.pool_ptr, ffi.NULL, ffi.NULL))
+        if outermost:
+            self._append_reserved()
         return self
 
     def __exit__(self, *args):
@@ -282,12 +381,128 @@ class _Transaction(object):
                 # since the python block won't have completed.
                 lib.pmemobj_tx_abort(INTERNAL_ABORT_ERRNO)
         err = lib.pmemobj_tx_end()
-        if err:
-            self._obj_cache.clear_transaction_cache()
-            if err != INTERNAL_ABORT_ERRNO:
-                _err_check.raise_per_errno()
-        elif not self._trans_stack:
-            self._obj_cache.commit_transaction_cache()
+        try:
+            if err:
+                self._obj_cache.clear_transaction_cache()
+                if err != INTERNAL_ABORT_ERRNO:
+                    _err_check.raise_per_errno()
+            elif not self._trans_stack:
+                self._obj_cache.commit_transaction_cache()
+        finally:
+            if not self._trans_stack:
+                self._ended()
+
+    def _ended(self):
+        # The outermost transaction is over, so the undo log is gone.
+        self._snapshots.reset()
+        while self._log_buffers:
+            oidp = ffi.new('PMEMoid *', self._log_buffers.pop())
+            lib.pmemobj_free(oidp)
+
+    def reserve_log_buffer(self, size):
+        """Allocate size bytes of log space for the next transaction.
+
+        The buffer is allocated with the atomic API, which must not be used
+        while a transaction is open, so that it survives an abort.  It is
+        handed to the next outermost transaction when that begins, and freed
+        when that transaction ends.
+        """
+        if self._trans_stack:
+            raise RuntimeError("reserve_log called inside a transaction")
+        oidp = ffi.new('PMEMoid *')
+        _err_check.check_errno(
+            lib.pmemobj_zalloc(self.pool_ptr, oidp, size,
+                               LOG_BUFFER_TYPE_NUM))
+        self._reserved.append(((oidp.pool_uuid_lo, oidp.off), size))
+
+    def reserved_log_buffers(self):
+        """Return the oids of the buffers waiting for the next transaction."""
+        return [oid for oid, size in self._reserved]
+
+    def _append_reserved(self):
+        # Give the outermost transaction that has just begun the log buffers
+        # reserved for it.  They are freed by _ended.
+        while self._reserved:
+            oid, size = self._reserved.pop(0)
+            self._log_buffers.append(oid)
+            oidp = ffi.new('PMEMoid *', oid)
+            _err_check.check_errno(
+                lib.pmemobj_tx_log_append_buffer(
+                    lib.TX_LOG_TYPE_SNAPSHOT, lib.pmemobj_direct(oidp[0]),
+                    size))
+
+
+class _BulkLoad(object):
+    """Context manager that commits a long series of operations in chunks.
+
+    A single transaction covering millions of operations needs an undo log
+    big enough to hold all of them.  Instead, a new transaction is started
+    every 'chunk' operations, and 'cursor' records how many operations have
+    been committed so far, so that an interrupted load can be resumed.
+    """
+
+    def __init__(self, mm, chunk, start=0, checkpoint=None, log_size=None):
+        if chunk < 1:
+            raise ValueError("chunk must be at least 1, not {}".format(chunk))
+        self._mm = mm
+        self.chunk = chunk
+        self.cursor = start
+        self._pending = 0
+        self._checkpoint = checkpoint
+        self._log_size = log_size
+
+    def _begin(self):
+        # The log space has to be reserved before the transaction begins.
+        if self._log_size:
+            self._mm.reserve_log(self._log_size)
+        self._mm.transaction().__enter__()
+
+    def _commit(self):
+        if self._pending and self._checkpoint is not None:
+            # Done inside the transaction, so that the recorded progress is
+            # committed atomically with the work it describes.
+            self._checkpoint(self.cursor + self._pending)
+        self._mm.transaction().__exit__(None, None, None)
+        self.cursor += self._pending
+        self._pending = 0
+
+    def step(self, count=1):
+        """Record that count operations have been done.
+
+        Commit the current chunk and start a new one if the chunk is full.
+        """
+        self._pending += count
+        if self._pending >= self.chunk:
+            self._commit()
+            self._begin()
+
+    def __call__(self, iterable):
+        """Return an iterator over iterable that calls step for each item.
+
+        The first 'cursor' items are skipped, so passing the same input to a
+        loader created with start=cursor resumes an interrupted load.  An item
+        is counted when it is handed out, and a new chunk is started before
+        handing out the first item that would not fit in the current one.
+        """
+        for item in itertools.islice(iterable, self.cursor, None):
+            if self._pending >= self.chunk:
+                self._commit()
+                self._begin()
+            self._pending += 1
+            yield item
+
+    def __enter__(self):
+        if self._mm.transaction().depth:
+            raise RuntimeError("bulk_load cannot be used inside a transaction")
+        self._begin()
+        return self
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self._commit()
+        else:
+            self._pending = 0
+            self._mm.transaction().__exit__(*args)
 
 
 class MemoryManager(object):
@@ -301,11 +516,15 @@ class MemoryManager(object):
     def __init__(self, pool_ptr, type_table=None):
         log.debug('MemoryManager.__init__: %r', pool_ptr)
         self._pool_ptr = pool_ptr
+        self._pmem_root = None
         self._track_free = None
         self._obj_cache = _ObjCache()
-        self._transaction = _Transaction(self._pool_ptr, self._obj_cache)
+        self._snapshots = _SnapshotTracker()
+        self._transaction = _Transaction(self._pool_ptr, self._obj_cache,
+                                         self._snapshots)
         self._init_caches()
         self._pickleable = set()
+        self._converted = None
 
     def transaction(self):
         """Return a (context manager) object that represents a transaction."""
@@ -402,8 +621,64 @@ class MemoryManager(object):
         return _err_check.check_null(lib.pmemobj_direct(oid))
 
     def snapshot_range(self, ptr, size):
+        """Add size bytes starting at ptr to the current transaction.
+
+        Ranges (or parts of ranges) that have already been added during the
+        current outermost transaction are not passed to libpmemobj again.
+        """
         tlog.debug('snapshot %s %s', ptr, size)
-        lib.pmemobj_tx_add_range_direct(ptr, size)
+        if not self._transaction.depth:
+            # Let libpmemobj report the error.
+            lib.pmemobj_tx_add_range_direct(ptr, size)
+            return
+        start = int(ffi.cast('uintptr_t', ptr))
+        for gap_start, gap_size in self._snapshots.add(start, size):
+            lib.pmemobj_tx_add_range_direct(
+                ffi.cast('void *', gap_start), gap_size)
+
+    def reserve_log(self, size):
+        """Preallocate size bytes of undo log space for the next transaction.
+
+        Without this the undo log is extended on demand as ranges are
+        snapshotted, which for very large transactions is slow and may fail
+        partway through with a MemoryError.  This must be called outside of
+        any transaction; the space is given to the next transaction begun,
+        and released when it ends.
+        """
+        self._transaction.reserve_log_buffer(size)
+
+    def snapshot_log_size(self, sizes):
+        """Return the log space needed to snapshot ranges of the given sizes."""
+        sizes = list(sizes)
+        return lib.pmemobj_tx_log_snapshots_max_size(
+            ffi.new('size_t[]', sizes), len(sizes))
+
+    def bulk_load(self, chunk=1000, start=0, checkpoint=None, log_size=None):
+        """Return a context manager that commits every chunk operations.
+
+        The returned loader must be used as a context manager outside of any
+        transaction.  Call its step method after each operation, or iterate
+        over loader(iterable), and every chunk operations the current
+        transaction is committed and a new one begun.  loader.cursor is the
+        number of operations committed; if the load fails, a new loader
+        created with start=cursor will skip the items already loaded.
+
+        If checkpoint is not None it is called with the new cursor value
+        inside each chunk's transaction just before it commits, which allows
+        the progress to be recorded persistently.  If log_size is not None,
+        reserve_log(log_size) is called before each chunk begins.
+        """
+        return _BulkLoad(self, chunk, start, checkpoint, log_size)
+
+    def snapshot_stats(self):
+        """Return a dict of counters describing snapshot_range activity.
+
+        'calls' and 'bytes-requested' count what was asked for,
+        'pmem-calls' and 'bytes-snapshotted' what was actually passed to
+        libpmemobj, and 'suppressed' the number of calls that were entirely
+        covered by earlier snapshots in the same transaction.
+        """
+        return dict(self._snapshots.stats)
 
     #
     # Object Management
@@ -437,6 +712,52 @@ class MemoryManager(object):
         self._type_table = type_table
         return type_table._p_oid
 
+    def _get_shared_keys(self, cls):
+        """Return the oid of the dict keys shared by the instances of cls.
+
+        This is a private method for coordination between PersistentObject
+        and the MemoryManager.  The shared keys are created the first time
+        they are needed, and the table of shared keys in the pool root holds
+        a reference to them for the life of the pool.
+        """
+        code = self._get_type_code(cls)
+        root = self._pmem_root
+        table_oid = self.otuple(root.shared_keys)
+        if table_oid != self.OID_NULL:
+            table = ffi.cast('PSharedKeysTable *', self.direct(table_oid))
+            if code < table.size:
+                keys_oid = self.otuple(table.keys[code])
+                if keys_oid != self.OID_NULL:
+                    return keys_oid
+        with self.transaction():
+            if table_oid == self.OID_NULL or code >= table.size:
+                size = max(code + 1, len(self._type_table))
+                table_oid = self.zrealloc(table_oid,
+                                          ffi.sizeof('PSharedKeysTable')
+                                          + ffi.sizeof('PObjPtr') * size,
+                                          SHARED_KEYS_TABLE_TYPE_NUM)
+                table = ffi.cast('PSharedKeysTable *', self.direct(table_oid))
+                table.size = size
+                self.snapshot_range(ffi.addressof(root, 'shared_keys'),
+                                    ffi.sizeof('PObjPtr'))
+                root.shared_keys = table_oid
+            keys_oid = _new_keys_object(self, SHARED_KEYS_SIZE)
+            self.snapshot_range(ffi.addressof(table.keys, code),
+                                ffi.sizeof('PObjPtr'))
+            table.keys[code] = keys_oid
+        log.debug('new shared keys for %s: %s', cls, keys_oid)
+        return keys_oid
+
+    def _shared_keys(self):
+        """Return a list of the oids of all the shared dict keys objects."""
+        root = self._pmem_root
+        table_oid = self.otuple(root.shared_keys)
+        if table_oid == self.OID_NULL:
+            return []
+        table = ffi.cast('PSharedKeysTable *', self.direct(table_oid))
+        oids = (self.otuple(table.keys[i]) for i in range(table.size))
+        return [oid for oid in oids if oid != self.OID_NULL]
+
     def _get_type_code(self, cls):
         """Return the index into the type table for cls.
 
@@ -475,7 +796,8 @@ class MemoryManager(object):
         log.debug('persist: %r', obj)
         try:
             return self._obj_cache.oid_from_obj(obj)
-        except KeyError:
+        except (KeyError, TypeError):
+            # TypeError: a tuple holding unhashable items.
             pass
         if hasattr(obj, '_p_mm'):
             tlog.debug('Persistent object: %s %s', obj._p_oid, obj)
@@ -487,12 +809,54 @@ class MemoryManager(object):
             oid = getattr(self, persister)(obj)
         elif cls_str in self._pickleable:
             oid = self._persist_nvm_pmemobj_pool_PICKLE_SENTINEL(obj)
+        elif obj.__class__ in _CONTAINER_TYPES:
+            # The persistent copy is cached by persist, not obj itself.
+            return self._persist_container(obj)
         else:
             raise TypeError("Don't know how to persist {!r}".format(cls_str))
         self._obj_cache.cache(oid, obj, in_transaction=self._transaction.depth)
         log.debug('new %s object: %r', cls_str, oid)
         return oid
 
+    def _persist_container(self, obj):
+        # Store a built-in container as the equivalent persistent type.  All
+        # of the containers nested in obj are converted in one transaction,
+        # and one that appears more than once in the tree is only converted
+        # once, so the copies share it just as the originals did.  Mutable
+        # containers are registered before being filled in, which also takes
+        # care of cycles through them.
+        outermost = self._converted is None
+        if outermost:
+            self._converted = {}
+        try:
+            pobj = self._converted.get(id(obj))
+            if pobj is None:
+                typ, fill = _CONTAINER_TYPES[obj.__class__]
+                with self.transaction():
+                    if fill is None:
+                        pobj = self.new(typ, obj)
+                        self._converted[id(obj)] = pobj
+                    else:
+                        pobj = self._converted[id(obj)] = self.new(typ)
+                        getattr(pobj, fill)(obj)
+            return self.persist(pobj)
+        finally:
+            if outermost:
+                self._converted = None
+
+    def known_oid(self, obj):
+        """Return the oid obj is already stored under, or None.
+
+        Unlike persist this never allocates anything, so it is a cheap way to
+        compare obj against stored oids before resorting to resurrecting them.
+        """
+        if getattr(obj, '_p_mm', None) is self:
+            return self.otuple(obj._p_oid)
+        try:
+            return self._obj_cache.oid_from_obj(obj)
+        except (KeyError, TypeError):
+            return None
+
     def resurrect(self, oid):
         """Return python object representing the data stored at oid."""
         oid = self.otuple(oid)
@@ -613,6 +977,25 @@ class MemoryManager(object):
                                 ffi.sizeof('size_t'))
             p_obj.ob_refcnt += 1
 
+    def incref_many(self, oids):
+        """Increment the reference counts of all of oids in one transaction.
+
+        An oid that appears more than once in oids is incremented once for each
+        appearance, but its refcount is only snapshotted and updated once.
+        """
+        counts = collections.Counter(self.otuple(oid) for oid in oids)
+        with self.transaction():
+            for oid, count in counts.items():
+                assert oid != self.OID_NULL
+                if not oid[0]:
+                    # Unlike CPython, we don't ref-track our constants.
+                    continue
+                p_obj = ffi.cast('PObject *', self.direct(oid))
+                log.debug('incref %r %r', oid, p_obj.ob_refcnt + count)
+                self.snapshot_range(ffi.addressof(p_obj, 'ob_refcnt'),
+                                    ffi.sizeof('size_t'))
+                p_obj.ob_refcnt += count
+
     def decref(self, oid):
         """Decrement the reference count of oid, and free it if zero."""
         oid = self.otuple(oid)
@@ -631,6 +1014,28 @@ class MemoryManager(object):
             if p_obj.ob_refcnt < 1:
                 self._deallocate(oid)
 
+    def decref_many(self, oids):
+        """Decrement the reference counts of all of oids in one transaction.
+
+        Like incref_many, each distinct refcount is only snapshotted once.
+        Objects whose refcount drops to zero are deallocated.
+        """
+        counts = collections.Counter(self.otuple(oid) for oid in oids)
+        with self.transaction():
+            for oid, count in counts.items():
+                if not oid[0]:
+                    # Unlike CPython we do not ref-track our constants.
+                    continue
+                p_obj = ffi.cast('PObject *', self.direct(oid))
+                log.debug('decref %r %r', oid, p_obj.ob_refcnt - count)
+                self.snapshot_range(ffi.addressof(p_obj, 'ob_refcnt'),
+                                    ffi.sizeof('size_t'))
+                assert p_obj.ob_refcnt >= count, "{} oid refcount {}".format(
+                                                 oid, p_obj.ob_refcnt)
+                p_obj.ob_refcnt -= count
+                if p_obj.ob_refcnt < 1:
+                    self._deallocate(oid)
+
     def xdecref(self, oid):
         """decref oid if it is not OID_NULL."""
         if self.otuple(oid) != self.OID_NULL:
@@ -727,6 +1132,7 @@ class PersistentObjectPool(object):
         mm = self.mm = MemoryManager(self._pool_ptr)
         pmem_root = lib.pmemobj_root(self._pool_ptr, ffi.sizeof('PRoot'))
         pmem_root = ffi.cast('PRoot *', mm.direct(pmem_root))
+        mm._pmem_root = pmem_root
         type_table_oid = mm.otuple(pmem_root.type_table)
         if type_table_oid == mm.OID_NULL:
             with mm.transaction():
@@ -735,11 +1141,16 @@ class PersistentObjectPool(object):
                 pmem_root.type_table = type_table_oid
                 pmem_root.root_object = self.mm.persist(None)
                 pmem_root.clean_shutdown = self.mm.persist(False)
+                pmem_root.hash_scheme = HASH_SCHEME
                 gc_needed = False
         else:
             mm._resurrect_type_table(type_table_oid)
             gc_needed = not self.mm.resurrect(pmem_root.clean_shutdown)
         self._pmem_root = pmem_root
+        # Pools written before the hash scheme was recorded read it as zero,
+        # since libpmemobj zero fills the root object when it grows.
+        if pmem_root.hash_scheme != HASH_SCHEME:
+            self._migrate_hash_scheme()
         # Make sure any objects orphaned by a crash are cleaned up.
         if gc_needed:
             self.gc()
@@ -813,6 +1224,18 @@ class PersistentObjectPool(object):
         """
         return self.mm.new(typ, *args, **kw)
 
+    def bulk_load(self, chunk=1000, start=0, checkpoint=None, log_size=None):
+        """Return a context manager that commits every chunk operations.
+
+        See MemoryManager.bulk_load.  For example:
+
+            with pool.bulk_load(chunk=10000) as loader:
+                for row in loader(rows):
+                    pool.root.append(row)
+
+        """
+        return self.mm.bulk_load(chunk, start, checkpoint, log_size)
+
     def persist_via_pickle(self, *types):
         """Nominate types to be persisted by pickling them.
 
@@ -827,6 +1250,45 @@ class PersistentObjectPool(object):
         for t in types:
             self.mm._pickleable.add(_class_string(t))
 
+    def _migrate_hash_scheme(self):
+        # Rebuild the tables of every object that stores key hashes using the
+        # current scheme, and then record the scheme.  Each object is rebuilt
+        # in its own transaction; if we crash part way through the scheme is
+        # still the old one, and rehashing the objects already done again is
+        # harmless.
+        scheme = self._pmem_root.hash_scheme
+        if scheme > HASH_SCHEME:
+            raise ValueError("{} uses hash scheme {}, but this version only"
+                             " supports up to {}".format(
+                                self.filename, scheme, HASH_SCHEME))
+        log.debug('migrating hash scheme %s to %s', scheme, HASH_SCHEME)
+        mm = self.mm
+        # Collect the oids first, since rehashing reallocates tables.  The
+        # hashes cached by immutables are cleared before any table is
+        # rehashed, so that none of the old hashes is reused.
+        rehash = []
+        clear_hash = []
+        oid = mm.otuple(lib.pmemobj_first(self._pool_ptr))
+        while oid != mm.OID_NULL:
+            if lib.pmemobj_type_num(oid) == POBJECT_TYPE_NUM:
+                obj = ffi.cast('PObject *', mm.direct(oid))
+                typ = _find_class_from_string(mm._type_table[obj.ob_type])
+                if obj.ob_refcnt and hasattr(typ, '_p_rehash'):
+                    rehash.append(oid)
+                if obj.ob_refcnt and hasattr(typ, '_p_clear_hash'):
+                    clear_hash.append(oid)
+            oid = mm.otuple(lib.pmemobj_next(oid))
+        for oid in clear_hash:
+            mm.resurrect(oid)._p_clear_hash()
+        for oid in rehash:
+            mm.resurrect(oid)._p_rehash()
+        for oid in mm._shared_keys():
+            _rehash_shared_keys(mm, oid)
+        with mm.transaction():
+            mm.snapshot_range(ffi.addressof(self._pmem_root, 'hash_scheme'),
+                              ffi.sizeof('size_t'))
+            self._pmem_root.hash_scheme = HASH_SCHEME
+
     # If I didn't have to support python2 I'd make debug keyword only.
     def gc(self, debug=None):
         # XXX add debug flag to constructor, and a test that orphans
@@ -855,6 +1317,7 @@ class PersistentObjectPool(object):
         containers = set()
         other = set()
         orphans = set()
+        log_buffers = []
         types = {}
         substructures = collections.defaultdict(dict)
         type_counts = collections.defaultdict(int)
@@ -897,6 +1360,8 @@ class PersistentObjectPool(object):
                             log.debug('gc: other: %s %s %r',
                                       oid, obj.ob_refcnt, self.mm.resurrect(oid))
                         other.add(oid)
+                elif type_num == LOG_BUFFER_TYPE_NUM:
+                    log_buffers.append(oid)
                 else:
                     if debug:
                         log.debug("gc: non PObject (type %s): %s", type_num, oid)
@@ -905,6 +1370,16 @@ class PersistentObjectPool(object):
             gc_counts['containers-total'] = len(containers)
             gc_counts['other-total'] = len(other)
 
+            # Log buffers left over from a transaction interrupted by a crash.
+            if not self.mm._transaction.depth:
+                reserved = self.mm._transaction.reserved_log_buffers()
+                log_buffers = [oid for oid in log_buffers
+                               if oid not in reserved]
+                log.debug("gc: freeing %s log buffers", len(log_buffers))
+                gc_counts['logbuffers-gced'] = len(log_buffers)
+                for oid in log_buffers:
+                    lib.pmemobj_free(ffi.new('PMEMoid *', oid))
+
             # Clean up refcount 0 orphans (from a crash or code bug).
             log.debug("gc: deallocating %s orphans", len(orphans))
             gc_counts['orphans0-gced'] = len(orphans)
@@ -931,20 +1406,49 @@ class PersistentObjectPool(object):
                                       container_oid, type_num, oid)
                         else:
                             substructures[type_num][oid].append(container_oid)
+                # The pool root refers to the shared dict keys, which are
+                # also referenced by each split dict using them.
+                table_oid = self.mm.otuple(self._pmem_root.shared_keys)
+                if table_oid != self.mm.OID_NULL:
+                    substructures[SHARED_KEYS_TABLE_TYPE_NUM][
+                        table_oid].append('root')
+                for oid in self.mm._shared_keys():
+                    substructures[PDICTKEYSOBJECT_TYPE_NUM][oid].append('root')
                 for type_num, structs in substructures.items():
                     for struct_oid, parent_oids in structs.items():
+                        refcnt = 1
+                        if type_num == PDICTKEYSOBJECT_TYPE_NUM:
+                            refcnt = ffi.cast('PDictKeysObject *',
+                                        self.mm.direct(struct_oid)).dk_refcnt
                         if not parent_oids:
                             log.error("substructure type %s at %s is not"
                                       " referenced by any existing object.",
                                       type_num, struct_oid)
-                        elif len(parent_oids) > 1:
+                        elif len(parent_oids) > refcnt:
                             log.error("substructure type %s at %s is"
                                       "referenced by more than once object: %s",
                                       type_num, struct_oid, parent_oids)
+                        elif len(parent_oids) < refcnt:
+                            log.error("substructure type %s at %s has"
+                                      " refcount %s but is referenced by: %s",
+                                      type_num, struct_oid, refcnt,
+                                      parent_oids)
 
             # Trace the object tree, removing objects that are referenced.
             containers.remove(self.mm._type_table._p_oid)
             live = [self.mm._type_table._p_oid]
+            # The keys of split dicts are held by the shared keys objects.
+            for keys_oid in self.mm._shared_keys():
+                keys = ffi.cast('PDictKeysObject *', self.mm.direct(keys_oid))
+                ep0 = _dk_entries(keys)
+                for i in range(keys.dk_nentries):
+                    sub_key = self.mm.otuple(ep0[i].me_key)
+                    if sub_key in containers:
+                        containers.remove(sub_key)
+                        live.append(sub_key)
+                    elif sub_key in other:
+                        other.remove(sub_key)
+                        gc_counts['other-live'] += 1
             root_oid = self.mm.otuple(self._pmem_root.root_object)
             root = self.mm.resurrect(root_oid)
             if hasattr(root, '_p_traverse'):
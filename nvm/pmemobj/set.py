@@ -3,9 +3,11 @@ import sys
 
 from .compat import recursive_repr, abc
 from _pmem import ffi
-from .dict import fixed_hash
+from .dict import fixed_hash, _cached, _hash_frozenset, _hashers
 
-PERM_SET_MINSIZE = 64
+# Like PySet_MINSIZE, the smallest table has room for four elements before it
+# is resized.  Empty sets have no table at all.
+PERM_SET_MINSIZE = 8
 
 HASH_DUMMY = ffi.cast('uint64_t', -1)
 HASH_UNUSED = 0
@@ -21,6 +23,22 @@ PERTURB_SHIFT = 5
 
 SET_POBJPTR_ARRAY_TYPE_NUM = 60
 
+# What a set without a table sees in its place: a single unused entry, so that
+# lookups and iteration find nothing.  It is never written to.
+_EMPTY_TABLE = ffi.new('PSetEntry[1]')
+
+
+def _find_unused(table_data, mask, khash):
+    # Return the index of the first unused slot on khash's probe sequence.
+    perturb = khash
+    i = khash & mask
+    while True:
+        for j in range(i, min(i + LINEAR_PROBES, mask) + 1):
+            if table_data[j].hash == HASH_UNUSED:
+                return j
+        perturb >>= PERTURB_SHIFT
+        i = (i * 5 + 1 + perturb) & mask
+
 
 class PersistentSet(abc.MutableSet):
 
@@ -31,8 +49,7 @@ class PersistentSet(abc.MutableSet):
         if len(args) != 1:
             raise TypeError("PersistentSet takes at most 1"
                             " argument, {} given".format(len(args)))
-        for item in args[0]:
-            self._add(item)
+        self._update(args[0])
 
     def _alloc_empty_table(self, tablesize):
         return self._p_mm.zalloc(ffi.sizeof('PSetEntry') * tablesize,
@@ -44,50 +61,37 @@ class PersistentSet(abc.MutableSet):
             self._p_oid = mm.zalloc(ffi.sizeof('PSetObject'))
             ob = ffi.cast('PObject *', mm.direct(self._p_oid))
             ob.ob_type = mm._get_type_code(self.__class__)
-            size = PERM_SET_MINSIZE
+            # The table is only allocated when the first element is added.
             self._body = ffi.cast('PSetObject *', mm.direct(self._p_oid))
-            self._body.mask = (size - 1)
+            self._body.mask = 0
             self._body.hash = HASH_INVALID
-            self._body.table = self._alloc_empty_table(PERM_SET_MINSIZE)
+            self._body.table = mm.OID_NULL
 
-    """ Derived from set_insert_clean in setobject.c """
-    def _insert_clean(self, table, mask, key_oid, khash):
+    def _table_data(self):
         mm = self._p_mm
-        perturb = khash
-        i = khash & mask
-        table_data = ffi.cast('PSetEntry *', mm.direct(table))
-        found_index = -1
-
-        while True:
-            if table_data[i].hash == HASH_UNUSED:
-                found_index = i
-                break
+        table = mm.otuple(self._body.table)
+        if table == mm.OID_NULL:
+            return _EMPTY_TABLE
+        return ffi.cast('PSetEntry *', mm.direct(table))
 
-            for j in range(i + 1, min(i + LINEAR_PROBES, mask) + 1):
-                if table_data[j].hash == HASH_UNUSED:
-                    found_index = j
-                    break
-
-            if found_index != -1:
-                break
-
-            perturb >>= PERTURB_SHIFT
-            i = (i * 5 + 1 + perturb) & mask
+    def _ensure_table(self):
+        # Give a set without a table the smallest one, before writing to it.
+        mm = self._p_mm
+        if mm.otuple(self._body.table) == mm.OID_NULL:
+            self._fill_table([], PERM_SET_MINSIZE)
 
-        with mm.transaction():
-            mm.snapshot_range(ffi.addressof(table_data, found_index),
-                              ffi.sizeof('PSetEntry'))
-            table_data[found_index].hash = khash
-            table_data[found_index].key = key_oid
+    def _free_table(self, table):
+        mm = self._p_mm
+        if mm.otuple(table) != mm.OID_NULL:
+            mm.free(table)
 
     @classmethod
     def _make_new_set(cls, manager, iterable):
         return manager.new(cls, iterable)
 
-    """ Derived from set_table_resize in setobject.c. """
-    def _table_resize(self, minused):
-        mm = self._p_mm
-
+    @staticmethod
+    def _table_size(minused):
+        # Return the table size set_table_resize would pick for minused.
         if minused > 50000:
             minused = (minused << 1)
         else:
@@ -102,39 +106,115 @@ class PersistentSet(abc.MutableSet):
 
         if newsize == 0:
             raise MemoryError("Out of memory")
+        return int(newsize)
 
-        newsize = int(newsize)
+    """ Derived from set_table_resize in setobject.c. """
+    def _table_resize(self, minused):
+        self._fill_table(self._entries(), minused)
 
-        with mm.transaction():
-            oldtable = mm.otuple(self._body.table)
-            oldtable_data = ffi.cast('PSetEntry *', mm.direct(oldtable))
-            newtable = self._alloc_empty_table(newsize)
+    # Entry level operations, used to combine sets from the same pool using
+    # the stored oids and hashes rather than resurrecting the elements.
 
-            newmask = newsize - 1
+    def _same_pool_set(self, other):
+        return (isinstance(other, PersistentSet)
+                and getattr(other, '_p_mm', None) is self._p_mm)
 
-            for i in range(0, self._body.mask + 1):
-                if oldtable_data[i].hash == HASH_UNUSED or \
-                   oldtable_data[i].hash == HASH_DUMMY:
-                    continue
-                self._insert_clean(newtable, newmask,
-                                   oldtable_data[i].key,
-                                   oldtable_data[i].hash)
+    def _entries(self):
+        # Return the (key oid, hash) of each element.
+        mm = self._p_mm
+        table_data = self._table_data()
+        entries = []
+        for i in range(0, self._body.mask + 1):
+            entry = table_data[i]
+            if entry.hash in (HASH_UNUSED, HASH_DUMMY):
+                continue
+            entries.append((mm.otuple(entry.key), entry.hash))
+        return entries
 
+    def _contains_entry(self, key_oid, khash):
+        # Tell whether the element stored at key_oid, whose hash is khash, is
+        # in the set.  Elements are only resurrected to compare them if their
+        # hashes match but their oids don't.
+        mm = self._p_mm
+        mask = self._body.mask
+        table_data = self._table_data()
+        perturb = khash
+        i = khash & mask
+        while True:
+            for j in range(i, min(i + LINEAR_PROBES, mask) + 1):
+                entry = table_data[j]
+                if entry.hash == HASH_UNUSED:
+                    return False
+                if entry.hash == khash:
+                    entry_oid = mm.otuple(entry.key)
+                    if (entry_oid == key_oid or
+                            mm.resurrect(entry_oid) == mm.resurrect(key_oid)):
+                        return True
+            perturb >>= PERTURB_SHIFT
+            i = (i * 5 + 1 + perturb) & mask
+
+    def _insert_entry(self, key_oid, khash):
+        # Add an element known not to be in the set, given its oid and hash.
+        mm = self._p_mm
+        with mm.transaction():
+            self._ensure_table()
+            table_data = self._table_data()
+            index = _find_unused(table_data, self._body.mask, khash)
+            mm.snapshot_range(ffi.addressof(table_data, index),
+                              ffi.sizeof('PSetEntry'))
+            table_data[index].key = key_oid
+            table_data[index].hash = khash
+            mm.incref(key_oid)
+            mm.snapshot_range(
+                ffi.addressof(self._body, 'fill'),
+                ffi.sizeof('PSetObject') - ffi.sizeof('PObject'))
+            self._body.used += 1
+            self._body.fill += 1
+            if self._body.fill * 3 >= self._body.mask * 2:
+                self._table_resize(self._body.used)
+
+    def _fill_table(self, entries, minused):
+        # Replace the table by a new one with room for minused elements,
+        # holding entries, a list of distinct (key oid, hash).  The table is
+        # new, so the entries need no snapshots.  The caller is responsible
+        # for the refcounts.  A set left empty gets no table at all.
+        mm = self._p_mm
+        with mm.transaction():
+            oldtable = mm.otuple(self._body.table)
+            newtable = mm.OID_NULL
+            newmask = 0
+            if entries or minused:
+                newsize = self._table_size(max(minused, len(entries)))
+                newtable = self._alloc_empty_table(newsize)
+                table_data = ffi.cast('PSetEntry *', mm.direct(newtable))
+                newmask = newsize - 1
+                for key_oid, khash in entries:
+                    index = _find_unused(table_data, newmask, khash)
+                    table_data[index].key = key_oid
+                    table_data[index].hash = khash
             mm.snapshot_range(ffi.addressof(self._body, 'fill'),
                               ffi.sizeof('PSetObject') - ffi.sizeof('PObject'))
-
             self._body.mask = newmask
-            self._body.fill = self._body.used
+            self._body.fill = self._body.used = len(entries)
             self._body.table = newtable
+            self._free_table(oldtable)
 
-            mm.free(oldtable)
+    def _new_from_entries(self, entries, minused=0):
+        # Return a new set of our class holding entries.
+        mm = self._p_mm
+        with mm.transaction():
+            new_set = self.__class__._make_new_set(mm, [])
+            new_set._fill_table(entries, minused)
+            mm.incref_many(key_oid for key_oid, khash in entries)
+        return new_set
 
     """ Derived from set_add_entry in setobject.c """
     def _get_available_entry_slot(self, key, khash):
         mm = self._p_mm
         mask = self._body.mask
         i = khash & mask
-        table_data = ffi.cast('PSetEntry *', mm.direct(self._body.table))
+        table_oid = mm.otuple(self._body.table)
+        table_data = self._table_data()
 
         entry = table_data[i]
         if entry.hash == HASH_UNUSED:
@@ -142,17 +222,20 @@ class PersistentSet(abc.MutableSet):
 
         perturb = khash
         freeslot = -1
+        k_oid = mm.known_oid(key)
 
         while True:
             if entry.hash == khash:
+                if mm.otuple(entry.key) == k_oid:
+                    return i, ADD_RESULT_FOUND_ACTIVE
                 startkey = self._p_mm.resurrect(entry.key)
                 if startkey == key:
                     return i, ADD_RESULT_FOUND_ACTIVE
 
                 """ TODO: find a test for this unlikely behaviour """
                 crtkey = self._p_mm.resurrect(entry.key)
-                crttable = ffi.cast('PSetEntry *', mm.direct(self._body.table))
-                if crtkey is not startkey or crttable is not table_data:
+                if (crtkey is not startkey or
+                        mm.otuple(self._body.table) != table_oid):
                     return -1, ADD_RESULT_RESTART
 
             elif entry.hash == HASH_DUMMY and freeslot == -1:
@@ -166,15 +249,16 @@ class PersistentSet(abc.MutableSet):
                     return freeslot, ADD_RESULT_FOUND_DUMMY
 
                 if entry.hash == khash:
+                    if mm.otuple(entry.key) == k_oid:
+                        return j, ADD_RESULT_FOUND_ACTIVE
                     startkey = self._p_mm.resurrect(entry.key)
                     if startkey == key:
                         return j, ADD_RESULT_FOUND_ACTIVE
 
                     """ TODO: find a test for this unlikely behaviour """
                     crtkey = self._p_mm.resurrect(entry.key)
-                    crttable = ffi.cast('PSetEntry *',
-                                        mm.direct(self._body.table))
-                    if crtkey is not startkey or crttable is not table_data:
+                    if (crtkey is not startkey or
+                            mm.otuple(self._body.table) != table_oid):
                         return -1, ADD_RESULT_RESTART
 
                 elif entry.hash == HASH_DUMMY and freeslot == -1:
@@ -194,12 +278,12 @@ class PersistentSet(abc.MutableSet):
         khash = fixed_hash(key)
         result = ADD_RESULT_RESTART
         with mm.transaction():
+            self._ensure_table()
             while result == ADD_RESULT_RESTART:
                 index, result = self._get_available_entry_slot(key, khash)
             if result == ADD_RESULT_FOUND_UNUSED or \
                result == ADD_RESULT_FOUND_DUMMY:
-                table_data = ffi.cast('PSetEntry *',
-                                      mm.direct(self._body.table))
+                table_data = self._table_data()
                 mm.snapshot_range(ffi.addressof(table_data, index),
                                   ffi.sizeof('PSetEntry'))
                 oid = mm.persist(key)
@@ -220,29 +304,130 @@ class PersistentSet(abc.MutableSet):
     def add(self, key):
         self._add(key)
 
+    def _missing_entries(self, iterable):
+        # Return the (key oid, hash) of the distinct elements of iterable
+        # that are not in the set, persisting them as needed.
+        mm = self._p_mm
+        if self._same_pool_set(iterable):
+            return [entry for entry in iterable._entries()
+                    if not self._contains_entry(*entry)]
+        entries = []
+        pending = {}
+        for key in iterable:
+            khash = fixed_hash(key)
+            if self._lookkey(key, khash) != -1:
+                continue
+            same_hash = pending.setdefault(khash, [])
+            if any(other == key for other in same_hash):
+                continue
+            same_hash.append(key)
+            entries.append((mm.persist(key), khash))
+        return entries
+
+    def _update(self, iterable):
+        # Add the elements of iterable.  If they don't fit in the current
+        # table it is rebuilt once at its final size, rather than growing
+        # step by step as they are added.
+        mm = self._p_mm
+        with mm.transaction():
+            entries = self._missing_entries(iterable)
+            if not entries:
+                return
+            body = self._body
+            if (body.fill + len(entries)) * 3 >= body.mask * 2:
+                self._fill_table(self._entries() + entries,
+                                 body.used + len(entries))
+            else:
+                table_data = ffi.cast('PSetEntry *', mm.direct(body.table))
+                for key_oid, khash in entries:
+                    index = _find_unused(table_data, body.mask, khash)
+                    mm.snapshot_range(ffi.addressof(table_data, index),
+                                      ffi.sizeof('PSetEntry'))
+                    table_data[index].key = key_oid
+                    table_data[index].hash = khash
+                mm.snapshot_range(
+                    ffi.addressof(body, 'fill'),
+                    ffi.sizeof('PSetObject') - ffi.sizeof('PObject'))
+                body.used += len(entries)
+                body.fill += len(entries)
+            mm.incref_many(key_oid for key_oid, khash in entries)
+
+    def update(self, *others):
+        with self._p_mm.transaction():
+            for other in others:
+                self._update(other)
+
+    def _intersection_update(self, other):
+        # Keep only the elements also in other, in a table sized for them.
+        mm = self._p_mm
+        entries = self._entries()
+        if self._same_pool_set(other):
+            kept = [entry for entry in entries
+                    if other._contains_entry(*entry)]
+        else:
+            found = set()
+            for key in other:
+                index = self._lookkey(key, fixed_hash(key))
+                if index != -1:
+                    found.add(index)
+            table_data = self._table_data()
+            kept = [(mm.otuple(table_data[i].key), table_data[i].hash)
+                    for i in sorted(found)]
+        if len(kept) == len(entries):
+            return
+        with mm.transaction():
+            self._fill_table(kept, len(kept))
+            mm.decref_many(key_oid for key_oid, khash
+                           in set(entries).difference(kept))
+
+    def intersection_update(self, *others):
+        with self._p_mm.transaction():
+            for other in others:
+                self._intersection_update(other)
+
+    def __ior__(self, other):
+        if not self._check_set(other):
+            raise TypeError("unsupported operand type(s) for |= %s and %s" %
+                            (self.__class__.__name__,
+                             other.__class__.__name__))
+        self._update(other)
+        return self
+
+    def __iand__(self, other):
+        if not self._check_set(other):
+            raise TypeError("unsupported operand type(s) for &= %s and %s" %
+                            (self.__class__.__name__,
+                             other.__class__.__name__))
+        self._intersection_update(other)
+        return self
+
     """ Derived from set_lookkey in setobject.c """
     def _lookkey(self, key, khash):
         mm = self._p_mm
         mask = self._body.mask
         i = khash & mask
-        table_data = ffi.cast('PSetEntry *', mm.direct(self._body.table))
+        table_oid = mm.otuple(self._body.table)
+        table_data = self._table_data()
 
         entry = table_data[i]
         if entry.hash == HASH_UNUSED:
             return -1
 
         perturb = khash
+        k_oid = mm.known_oid(key)
 
         while(True):
             if entry.hash == khash:
+                if mm.otuple(entry.key) == k_oid:
+                    return i
                 startkey = self._p_mm.resurrect(entry.key)
                 if startkey == key:
                     return i
 
                 """ TODO: find a test for this unlikely behaviour """
                 crtkey = self._p_mm.resurrect(entry.key)
-                crttable = ffi.cast('PSetEntry *', mm.direct(self._body.table))
-                if crtkey != startkey:
+                if (crtkey is not startkey or
+                        mm.otuple(self._body.table) != table_oid):
                     return self._lookkey(key, khash)
 
             for j in range(i + 1, min(i + LINEAR_PROBES, mask) + 1):
@@ -251,15 +436,16 @@ class PersistentSet(abc.MutableSet):
                     return -1
 
                 if entry.hash == khash:
+                    if mm.otuple(entry.key) == k_oid:
+                        return j
                     startkey = self._p_mm.resurrect(entry.key)
                     if startkey == key:
                         return j
 
                     """ TODO: find a test for this unlikely behaviour """
                     crtkey = self._p_mm.resurrect(entry.key)
-                    crttable = ffi.cast('PSetEntry *',
-                                        mm.direct(self._body.table))
-                    if crtkey is not startkey or crttable is not table_data:
+                    if (crtkey is not startkey or
+                            mm.otuple(self._body.table) != table_oid):
                         return self._lookkey(key, khash)
 
             perturb >>= PERTURB_SHIFT
@@ -277,7 +463,7 @@ class PersistentSet(abc.MutableSet):
 
     def __debug_repr__(self):
         mm = self._p_mm
-        table_data = ffi.cast('PSetEntry *', mm.direct(self._body.table))
+        table_data = self._table_data()
         set_content = ""
         for i in range(0, self._body.mask + 1):
             entry = table_data[i]
@@ -298,7 +484,7 @@ class PersistentSet(abc.MutableSet):
 
     def __iter__(self):
         mm = self._p_mm
-        table_data = ffi.cast('PSetEntry *', mm.direct(self._body.table))
+        table_data = self._table_data()
         for i in range(0, self._body.mask + 1):
             entry = table_data[i]
             if entry.hash in [HASH_UNUSED, HASH_DUMMY]:
@@ -308,8 +494,31 @@ class PersistentSet(abc.MutableSet):
     def union(self, *args):
         mm = self._p_mm
         with mm.transaction():
-            new_set = self.__class__._make_new_set(self._p_mm, self)
+            if not any(self._same_pool_set(arg) for arg in args):
+                new_set = self.__class__._make_new_set(self._p_mm, self)
+            else:
+                # Gather the entries of the persistent sets that are not in
+                # self first, so that the new set is filled and its elements
+                # incref'd in one go.
+                entries = self._entries()
+                pending = {}
+                for arg in args:
+                    if not self._same_pool_set(arg):
+                        continue
+                    for key_oid, khash in arg._entries():
+                        if self._contains_entry(key_oid, khash):
+                            continue
+                        same_hash = pending.setdefault(khash, [])
+                        if any(oid == key_oid or
+                               mm.resurrect(oid) == mm.resurrect(key_oid)
+                               for oid in same_hash):
+                            continue
+                        same_hash.append(key_oid)
+                        entries.append((key_oid, khash))
+                new_set = self._new_from_entries(entries)
             for arg in args:
+                if self._same_pool_set(arg):
+                    continue
                 try:
                     for item in arg:
                         new_set._add(item)
@@ -321,6 +530,13 @@ class PersistentSet(abc.MutableSet):
     def _set_intersection(self, other):
         mm = self._p_mm
         with mm.transaction():
+            if self._same_pool_set(other):
+                small, large = self, other
+                if len(other) < len(self):
+                    small, large = other, self
+                return self._new_from_entries(
+                    [entry for entry in small._entries()
+                     if large._contains_entry(*entry)])
             new_set = self.__class__._make_new_set(self._p_mm, [])
             if len(other) < len(self):
                 tmp = self
@@ -351,6 +567,11 @@ class PersistentSet(abc.MutableSet):
     def difference(self, *args):
         mm = self._p_mm
         with mm.transaction():
+            if all(self._same_pool_set(other) for other in args):
+                return self._new_from_entries(
+                    [entry for entry in self._entries()
+                     if not any(other._contains_entry(*entry)
+                                for other in args)])
             new_set = self.__class__._make_new_set(self._p_mm, [])
             for item in self:
                 for other in args:
@@ -364,6 +585,12 @@ class PersistentSet(abc.MutableSet):
     def symmetric_difference(self, other):
         mm = self._p_mm
         with mm.transaction():
+            if self._same_pool_set(other):
+                entries = [entry for entry in self._entries()
+                           if not other._contains_entry(*entry)]
+                entries.extend(entry for entry in other._entries()
+                               if not self._contains_entry(*entry))
+                return self._new_from_entries(entries)
             new_set = self.__class__._make_new_set(self._p_mm, self)
             for item in other:
                 if item in self:
@@ -431,8 +658,7 @@ class PersistentSet(abc.MutableSet):
         with mm.transaction():
             keyindex = self._lookkey(key, fixed_hash(key))
             if keyindex != -1:
-                table_data = ffi.cast('PSetEntry *',
-                                      mm.direct(self._body.table))
+                table_data = self._table_data()
                 mm.snapshot_range(ffi.addressof(table_data, keyindex),
                                   ffi.sizeof('PSetEntry'))
                 mm.decref(table_data[keyindex].key)
@@ -443,9 +669,16 @@ class PersistentSet(abc.MutableSet):
     def discard(self, key):
         self._discard(key)
 
+    def clear(self):
+        mm = self._p_mm
+        with mm.transaction():
+            entries = self._entries()
+            self._fill_table([], 0)
+            mm.decref_many(key_oid for key_oid, khash in entries)
+
     def _p_traverse(self):
         mm = self._p_mm
-        table_data = ffi.cast('PSetEntry *', mm.direct(self._body.table))
+        table_data = self._table_data()
         for i in range(0, self._body.mask + 1):
             entry = table_data[i]
             if entry.hash in (HASH_UNUSED, HASH_DUMMY):
@@ -455,11 +688,21 @@ class PersistentSet(abc.MutableSet):
     def _p_substructures(self):
         return ((self._body.table, SET_POBJPTR_ARRAY_TYPE_NUM),)
 
+    def _p_rehash(self):
+        # Recompute the stored key hashes after a change of hash scheme.
+        mm = self._p_mm
+        if mm.otuple(self._body.table) == mm.OID_NULL:
+            return
+        with mm.transaction():
+            self._fill_table([(key_oid, fixed_hash(mm.resurrect(key_oid)))
+                              for key_oid, khash in self._entries()],
+                             self._body.used)
+
     def _p_deallocate(self):
         mm = self._p_mm
         for key_oid in self._p_traverse():
             mm.decref(key_oid)
-        mm.free(self._body.table)
+        self._free_table(self._body.table)
 
     def _p_resurrect(self, manager, oid):
         mm = self._p_mm = manager
@@ -473,3 +716,47 @@ class PersistentFrozenSet(PersistentSet):
 
     def discard(self, key):
         raise AttributeError("PersistentFrozenSet has no attribute 'discard'")
+
+    def update(self, *others):
+        raise AttributeError("PersistentFrozenSet has no attribute 'update'")
+
+    def intersection_update(self, *others):
+        raise AttributeError(
+            "PersistentFrozenSet has no attribute 'intersection_update'")
+
+    def clear(self):
+        raise AttributeError("PersistentFrozenSet has no attribute 'clear'")
+
+    # The hash of a frozen set is computed when it is first used as a key,
+    # and kept in the hash field of its PSetObject.
+
+    def _p_cached_hash(self):
+        h = self._body.hash
+        return None if h == HASH_INVALID else h
+
+    def _p_cache_hash(self, h):
+        if h == HASH_INVALID:
+            return
+        mm = self._p_mm
+        with mm.transaction():
+            mm.snapshot_range(ffi.addressof(self._body, 'hash'),
+                              ffi.sizeof('size_t'))
+            self._body.hash = h
+
+    def _p_clear_hash(self):
+        mm = self._p_mm
+        with mm.transaction():
+            mm.snapshot_range(ffi.addressof(self._body, 'hash'),
+                              ffi.sizeof('size_t'))
+            self._body.hash = HASH_INVALID
+
+    # Like frozenset, the in-place operators rebind to a new set.
+
+    def __ior__(self, other):
+        return self | other
+
+    def __iand__(self, other):
+        return self & other
+
+
+_hashers[PersistentFrozenSet] = _cached(_hash_frozenset)
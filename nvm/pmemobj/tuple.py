@@ -3,9 +3,13 @@ import sys
 
 from .compat import recursive_repr, abc
 from .list import PersistentList
-from _pmem import ffi
+from _pmem import ffi, lib
 
 TUPLE_POBJPTR_ARRAY_TYPE_NUM = 50
+# Item arrays of this type have room after the items for the hash of the
+# tuple.  Tuples created before it was added use the type above, and have
+# their hash recomputed each time.
+TUPLE_HASHED_POBJPTR_ARRAY_TYPE_NUM = 51
 
 
 class PersistentTuple(PersistentList):
@@ -17,22 +21,20 @@ class PersistentTuple(PersistentList):
         if len(args) != 1:
             raise TypeError("PersistentTuple takes at most 1"
                             " argument, {} given".format(len(args)))
-        item_count = len(args[0])
         mm = self._p_mm
         with mm.transaction():
-            mm.snapshot_range(
-                ffi.addressof(self._body, 'ob_items'), ffi.sizeof('PObjPtr'))
+            # The item array is allocated in this transaction, so it is filled
+            # in with a single copy and needs no snapshot.
+            oids = [mm.persist(value) for value in args[0]]
+            if not oids:
+                return
+            mm.snapshot_range(self._body, ffi.sizeof('PTupleObject'))
             self._body.ob_items = mm.zalloc(
-                                    item_count * ffi.sizeof('PObjPtr'),
-                                    type_num=TUPLE_POBJPTR_ARRAY_TYPE_NUM)
-
-            ob = ffi.cast('PVarObject *', self._body)
-            mm.snapshot_range(ffi.addressof(ob, 'ob_size'),
-                              ffi.sizeof('size_t'))
-            ob.ob_size = item_count
-
-            for index, value in enumerate(args[0]):
-                super(self.__class__, self).__setitem__(index, value)
+                    len(oids) * ffi.sizeof('PObjPtr') + ffi.sizeof('uint64_t'),
+                    type_num=TUPLE_HASHED_POBJPTR_ARRAY_TYPE_NUM)
+            ffi.cast('PVarObject *', self._body).ob_size = len(oids)
+            self._store(0, oids)
+            mm.incref_many(oids)
 
     def _p_new(self, manager):
         mm = self._p_mm = manager
@@ -56,12 +58,12 @@ class PersistentTuple(PersistentList):
         if not (isinstance(other, PersistentTuple) or
                 isinstance(other, tuple)):
             return NotImplemented
-        if len(self) != len(other):
-            return False
-        for i in range(len(self)):
-            if self[i] != other[i]:
-                return False
-        return True
+        return self._items_equal(other)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self._get_slice(index))
+        return super(PersistentTuple, self).__getitem__(index)
 
     @property
     def _allocated(self):
@@ -75,20 +77,81 @@ class PersistentTuple(PersistentList):
         raise TypeError(
                 "'PersistentTuple' object does not support item deletion")
 
+    def pop(self, index=-1):
+        raise TypeError(
+                "'PersistentTuple' object does not support item deletion")
+
     def _resize(self, newsize):
         raise TypeError("'PersistentTuple' object does not support resizing")
 
     def insert(self, index, value):
         raise TypeError("'PersistentTuple' object does not support insertion")
 
+    def append(self, value):
+        raise TypeError("'PersistentTuple' object does not support insertion")
+
+    def extend(self, values):
+        raise TypeError("'PersistentTuple' object does not support insertion")
+
     def clear(self):
         raise TypeError("'PersistentTuple' object does not support clear")
 
+    def reverse(self):
+        raise TypeError("'PersistentTuple' object does not support reverse")
+
+    def sort(self, key=None, reverse=False):
+        raise TypeError("'PersistentTuple' object does not support sort")
+
     # Additional list methods not provided by the ABC.
     @recursive_repr()
     def __repr__(self):
         return "{}(({}))".format(self.__class__.__name__,
                                  ', '.join("{!r}".format(x) for x in self))
 
+    # The hash is computed when the tuple is first used as a key.  Zero marks
+    # it as not computed yet.
+
+    def _items_type_num(self):
+        mm = self._p_mm
+        ob_items = mm.otuple(self._body.ob_items)
+        if ob_items == mm.OID_NULL:
+            return TUPLE_POBJPTR_ARRAY_TYPE_NUM
+        return lib.pmemobj_type_num(ob_items)
+
+    def _hash_slot(self):
+        if self._items_type_num() != TUPLE_HASHED_POBJPTR_ARRAY_TYPE_NUM:
+            return None
+        return ffi.cast('uint64_t *', self._items + self._size)
+
+    def _p_cached_hash(self):
+        slot = self._hash_slot()
+        if slot is None or not slot[0]:
+            return None
+        return slot[0]
+
+    def _p_cache_hash(self, h):
+        slot = self._hash_slot()
+        if slot is None:
+            return
+        mm = self._p_mm
+        with mm.transaction():
+            mm.snapshot_range(slot, ffi.sizeof('uint64_t'))
+            slot[0] = h
+
+    def _p_clear_hash(self):
+        self._p_cache_hash(0)
+
     def _p_substructures(self):
-        return ((self._body.ob_items, TUPLE_POBJPTR_ARRAY_TYPE_NUM),)
+        return ((self._body.ob_items, self._items_type_num()),)
+
+    def _p_deallocate(self):
+        mm = self._p_mm
+        oids = list(self._p_traverse())
+        if not oids:
+            return
+        with mm.transaction():
+            mm.snapshot_range(self._body, ffi.sizeof('PTupleObject'))
+            ffi.cast('PVarObject *', self._body).ob_size = 0
+            mm.free(self._body.ob_items)
+            self._body.ob_items = mm.OID_NULL
+            mm.decref_many(oids)
@@ -0,0 +1,326 @@
+import array
+import sys
+
+from .compat import recursive_repr, abc
+
+from _pmem import ffi
+
+# XXX: refactor to allocate this instead of hardcoding it.
+ARRAY_DATA_TYPE_NUM = 90
+
+# The C type used to store the items of each supported typecode.
+_CTYPES = {
+    'q': 'int64_t',
+    'd': 'double',
+    'B': 'uint8_t',
+    }
+
+
+class PersistentArray(abc.MutableSequence):
+    """Persistent version of the 'array.array' type.
+
+    The items are stored as raw C values in a single contiguous allocation,
+    rather than as one persistent object per item.  Only the 'q' (int64),
+    'd' (double) and 'B' (uint8) typecodes are supported.
+    """
+
+    # XXX locking!
+
+    def __init__(self, typecode, initializer=()):
+        if typecode not in _CTYPES:
+            raise ValueError("bad typecode (must be one of {})".format(
+                                ', '.join(sorted(_CTYPES))))
+        mm = self._p_mm
+        with mm.transaction():
+            mm.snapshot_range(ffi.addressof(self._body, 'typecode'),
+                              ffi.sizeof('size_t'))
+            self._body.typecode = ord(typecode)
+            self.extend(initializer)
+
+    def _p_new(self, manager):
+        mm = self._p_mm = manager
+        with mm.transaction():
+            self._p_oid = mm.zalloc(ffi.sizeof('PArrayObject'))
+            ob = ffi.cast('PObject *', mm.direct(self._p_oid))
+            ob.ob_type = mm._get_type_code(PersistentArray)
+        self._body = ffi.cast('PArrayObject *', mm.direct(self._p_oid))
+
+    def _p_resurrect(self, manager, oid):
+        mm = self._p_mm = manager
+        self._p_oid = oid
+        self._body = ffi.cast('PArrayObject *', mm.direct(oid))
+
+    @property
+    def typecode(self):
+        return chr(self._body.typecode)
+
+    @property
+    def itemsize(self):
+        return ffi.sizeof(self._ctype)
+
+    @property
+    def _ctype(self):
+        return _CTYPES[self.typecode]
+
+    @property
+    def _size(self):
+        return ffi.cast('PVarObject *', self._body).ob_size
+
+    @property
+    def _data(self):
+        mm = self._p_mm
+        ob_data = mm.otuple(self._body.ob_data)
+        if ob_data == mm.OID_NULL:
+            return None
+        return ffi.cast(self._ctype + ' *', mm.direct(ob_data))
+
+    def _set_size(self, size):
+        mm = self._p_mm
+        ob = ffi.cast('PVarObject *', self._body)
+        mm.snapshot_range(ffi.addressof(ob, 'ob_size'), ffi.sizeof('size_t'))
+        ob.ob_size = size
+
+    def _resize(self, newsize):
+        # Make room for newsize items.  Unlike PersistentList._resize this
+        # never sets the size; the caller does that once the data is in place.
+        mm = self._p_mm
+        allocated = self._body.allocated
+        if allocated >= newsize and newsize >= allocated >> 1:
+            return
+        # We use CPython's array overallocation algorithm.
+        new_allocated = (newsize >> 4) + (3 if newsize < 8 else 7) + newsize
+        if newsize == 0:
+            new_allocated = 0
+        nbytes = new_allocated * self.itemsize
+        with mm.transaction():
+            data = mm.otuple(self._body.ob_data)
+            if data != mm.OID_NULL:
+                data = mm.zrealloc(data, nbytes, ARRAY_DATA_TYPE_NUM)
+            elif nbytes:
+                data = mm.zalloc(nbytes, type_num=ARRAY_DATA_TYPE_NUM)
+            mm.snapshot_range(self._body, ffi.sizeof('PArrayObject'))
+            self._body.ob_data = data
+            self._body.allocated = new_allocated
+
+    def _pack(self, values):
+        # Return the number of values and a C array holding them converted to
+        # our item type, ready to be copied into the data array.  Values that
+        # are already stored in our format are copied without conversion.
+        ctype = self._ctype
+        if (isinstance(values, (PersistentArray, array.array))
+                and values.typecode == self.typecode
+                and hasattr(values, 'tobytes')):
+            raw = values.tobytes()
+            count = len(raw) // self.itemsize
+            src = ffi.new(ctype + '[]', count)
+            ffi.memmove(src, raw, len(raw))
+            return count, src
+        values = list(values)
+        return len(values), ffi.new(ctype + '[]', values)
+
+    def _store(self, index, count, src):
+        # Copy count items from src into the data array starting at index.
+        if not count:
+            return
+        nbytes = count * self.itemsize
+        data = self._data
+        self._p_mm.snapshot_range(data + index, nbytes)
+        ffi.memmove(data + index, src, nbytes)
+
+    def _splice(self, start, stop, count, src):
+        # Replace the items from start to stop with count items from src.
+        mm = self._p_mm
+        size = self._size
+        itemsize = self.itemsize
+        newsize = size - (stop - start) + count
+        with mm.transaction():
+            if newsize > size:
+                self._resize(newsize)
+            if newsize != size:
+                data = self._data
+                mm.snapshot_range(data + start,
+                                  (max(size, newsize) - start) * itemsize)
+                ffi.memmove(data + start + count, data + stop,
+                            (size - stop) * itemsize)
+                self._set_size(newsize)
+            self._store(start, count, src)
+            if newsize < size:
+                self._resize(newsize)
+
+    def _normalize_index(self, index):
+        try:
+            index = int(index)
+        except TypeError:
+            raise TypeError("array indices must be integers or slices,"
+                            " not {}".format(index.__class__.__name__))
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError("array index out of range")
+        return index
+
+    # Methods and properties needed to implement the ABC required methods.
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            indexes = range(start, stop, step)
+            if not len(indexes):
+                return []
+            data = self._data
+            return [data[i] for i in indexes]
+        return self._data[self._normalize_index(index)]
+
+    def __setitem__(self, index, value):
+        mm = self._p_mm
+        if not isinstance(index, slice):
+            index = self._normalize_index(index)
+            index = slice(index, index + 1)
+            value = (value,)
+        start, stop, step = index.indices(self._size)
+        # Converting the values first also makes a[:] = a safe.
+        count, src = self._pack(value)
+        if step == 1:
+            stop = max(start, stop)
+            if count or start != stop:
+                self._splice(start, stop, count, src)
+            return
+        indexes = range(start, stop, step)
+        if count != len(indexes):
+            raise ValueError("attempt to assign array of size {} to extended"
+                             " slice of size {}".format(count, len(indexes)))
+        if not count:
+            return
+        lo = min(indexes[0], indexes[-1])
+        hi = max(indexes[0], indexes[-1])
+        with mm.transaction():
+            data = self._data
+            mm.snapshot_range(data + lo, (hi - lo + 1) * self.itemsize)
+            for i, j in zip(indexes, range(count)):
+                data[i] = src[j]
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            index = self._normalize_index(index)
+            self._splice(index, index + 1, 0, None)
+            return
+        start, stop, step = index.indices(self._size)
+        if step == 1:
+            if start < stop:
+                self._splice(start, stop, 0, None)
+            return
+        deleted = set(range(start, stop, step))
+        if deleted:
+            kept = [x for i, x in enumerate(self) if i not in deleted]
+            self[:] = kept
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, index, value):
+        size = self._size
+        if index < 0:
+            index += size
+            if index < 0:
+                index = 0
+        if index > size:
+            index = size
+        self[index:index] = (value,)
+
+    # Additional array methods not provided by the ABC.
+
+    def append(self, value):
+        size = self._size
+        self._splice(size, size, *self._pack((value,)))
+
+    def extend(self, values):
+        size = self._size
+        self._splice(size, size, *self._pack(values))
+
+    def frombytes(self, data):
+        """Append items from the machine values stored in the bytes data."""
+        itemsize = self.itemsize
+        if len(data) % itemsize:
+            raise ValueError("bytes length not a multiple of item size")
+        count = len(data) // itemsize
+        src = ffi.new(self._ctype + '[]', count)
+        ffi.memmove(src, data, len(data))
+        size = self._size
+        self._splice(size, size, count, src)
+
+    def tobytes(self):
+        """Return the items as machine values in a bytes object."""
+        size = self._size
+        if not size:
+            return b''
+        return ffi.buffer(self._data, size * self.itemsize)[:]
+
+    def tolist(self):
+        return self[:]
+
+    def buffer(self):
+        """Return a writable view of the items that does not copy them.
+
+        On Python 3 this is a memoryview whose format is the typecode, so it
+        can be handed to anything that supports the buffer protocol, such as
+        numpy.frombuffer.  Writes through the view bypass transactions, and
+        the view must not be used after the length of the array changes.
+        """
+        size = self._size
+        if size:
+            view = ffi.buffer(self._data, size * self.itemsize)
+        else:
+            view = bytearray()
+        if sys.version_info[0] < 3:
+            return view
+        return memoryview(view).cast(self.typecode)
+
+    def __buffer__(self, flags):
+        return self.buffer()
+
+    @recursive_repr()
+    def __repr__(self):
+        if not self._size:
+            return "{}({!r})".format(self.__class__.__name__, self.typecode)
+        return "{}({!r}, {!r})".format(self.__class__.__name__,
+                                       self.typecode, self.tolist())
+
+    def __eq__(self, other):
+        if not (isinstance(other, PersistentArray) or
+                isinstance(other, array.array)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        # Integer items are equal exactly when their bytes are; that isn't
+        # true of doubles (0.0 == -0.0, nan != nan).
+        if (other.typecode == self.typecode and self.typecode != 'd'
+                and hasattr(other, 'tobytes')):
+            return self.tobytes() == other.tobytes()
+        return self.tolist() == list(other)
+
+    if sys.version_info[0] < 3:
+        def __ne__(self, other):
+            return not self == other
+
+    # Additional methods required by the pmemobj API.
+
+    def _p_traverse(self):
+        # The items are plain numbers, not references, but being traversable
+        # makes gc treat the array as a container, and so account for its
+        # data substructure.
+        return iter(())
+
+    def _p_substructures(self):
+        return ((self._body.ob_data, ARRAY_DATA_TYPE_NUM),)
+
+    def _p_deallocate(self):
+        mm = self._p_mm
+        data = mm.otuple(self._body.ob_data)
+        if data == mm.OID_NULL:
+            return
+        with mm.transaction():
+            mm.free(data)
+            mm.snapshot_range(self._body, ffi.sizeof('PArrayObject'))
+            self._body.ob_data = mm.OID_NULL
+            self._body.allocated = 0
+            self._set_size(0)
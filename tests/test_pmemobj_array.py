@@ -0,0 +1,149 @@
+# -*- coding: utf8 -*-
+import array
+import sys
+import unittest
+
+from nvm import pmemobj
+
+from tests.support import TestCase
+
+
+class TestPersistentArray(TestCase):
+
+    def _make_array(self, *args):
+        self.fn = self._test_fn()
+        self.pop = pmemobj.create(self.fn, debug=True)
+        self.addCleanup(self.pop.close)
+        self.pop.root = self.pop.new(pmemobj.PersistentArray, *args)
+        return self.pop.root
+
+    def _reread_array(self):
+        self.pop.close()
+        self.pop = pmemobj.open(self.fn)
+        return self.pop.root
+
+    def test_typecodes(self):
+        for typecode, values in (('q', [-2**63, 0, 2**63 - 1]),
+                                 ('d', [-1.5, 0.0, 1e300]),
+                                 ('B', [0, 17, 255])):
+            arr = self._make_array(typecode, values)
+            self.assertEqual(arr.typecode, typecode)
+            self.assertEqual(list(arr), values)
+            arr = self._reread_array()
+            self.assertEqual(arr.typecode, typecode)
+            self.assertEqual(list(arr), values)
+
+    def test_bad_typecode(self):
+        with self.assertRaises(ValueError):
+            self._make_array('u')
+
+    def test_bad_values(self):
+        arr = self._make_array('q', [1])
+        with self.assertRaises(TypeError):
+            arr.append(1.5)
+        with self.assertRaises(OverflowError):
+            arr.append(2**64)
+        arr = self._make_array('B')
+        with self.assertRaises(OverflowError):
+            arr.extend([1, 256])
+        self.assertEqual(list(arr), [])
+
+    def test_append_extend(self):
+        arr = self._make_array('q')
+        for i in range(20):
+            arr.append(i)
+        arr.extend(range(20, 100))
+        arr.extend(arr)
+        self.assertEqual(list(arr), list(range(100)) * 2)
+        arr = self._reread_array()
+        self.assertEqual(list(arr), list(range(100)) * 2)
+
+    def test_getitem_setitem(self):
+        arr = self._make_array('d', [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(arr[0], 1.0)
+        self.assertEqual(arr[-1], 4.0)
+        self.assertEqual(arr[1:3], [2.0, 3.0])
+        self.assertEqual(arr[::-2], [4.0, 2.0])
+        arr[1] = 7
+        arr[-1] = 8.5
+        self.assertEqual(list(arr), [1.0, 7.0, 3.0, 8.5])
+        with self.assertRaises(IndexError):
+            arr[4]
+        with self.assertRaises(IndexError):
+            arr[-5] = 1.0
+        arr = self._reread_array()
+        self.assertEqual(list(arr), [1.0, 7.0, 3.0, 8.5])
+
+    def test_slices(self):
+        expected = list(range(20))
+        arr = self._make_array('q', expected)
+        for s, values in ((slice(2, 5), [-1, -2]),
+                          (slice(0, 0), [100, 101, 102]),
+                          (slice(-3, None), []),
+                          (slice(None, None, 4), [0] * 5),
+                          (slice(None, None, -3), [9] * 7)):
+            arr[s] = values
+            expected[s] = values
+            self.assertEqual(list(arr), expected)
+        with self.assertRaises(ValueError):
+            arr[::2] = [1]
+        for s in (slice(3, 6), slice(None, None, 3), slice(10, 2, -2)):
+            del arr[s]
+            del expected[s]
+            self.assertEqual(list(arr), expected)
+        arr = self._reread_array()
+        self.assertEqual(list(arr), expected)
+        del arr[:]
+        self.assertEqual(list(arr), [])
+
+    def test_insert_pop(self):
+        arr = self._make_array('B', [1, 2, 3])
+        arr.insert(0, 0)
+        arr.insert(-1, 9)
+        arr.insert(10, 4)
+        self.assertEqual(list(arr), [0, 1, 2, 9, 3, 4])
+        self.assertEqual(arr.pop(), 4)
+        self.assertEqual(arr.pop(3), 9)
+        del arr[0]
+        arr = self._reread_array()
+        self.assertEqual(list(arr), [1, 2, 3])
+
+    def test_bytes(self):
+        arr = self._make_array('q', [1, 2, 3])
+        data = arr.tobytes()
+        self.assertEqual(data, array.array('q', [1, 2, 3]).tobytes())
+        arr.frombytes(data)
+        self.assertEqual(list(arr), [1, 2, 3, 1, 2, 3])
+        with self.assertRaises(ValueError):
+            arr.frombytes(b'123')
+        self.assertEqual(self._make_array('d').tobytes(), b'')
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'memoryview.cast is py3 only')
+    def test_buffer(self):
+        arr = self._make_array('q', range(10))
+        view = arr.buffer()
+        self.assertEqual(view.format, 'q')
+        self.assertEqual(view.tolist(), list(range(10)))
+        view[3] = 42
+        self.assertEqual(arr[3], 42)
+        self.assertEqual(self._make_array('d').buffer().tolist(), [])
+
+    def test_eq_repr(self):
+        arr = self._make_array('q', [1, 2])
+        self.assertEqual(arr, array.array('d', [1.0, 2.0]))
+        self.assertNotEqual(arr, array.array('d', [1.0, 3.0]))
+        self.assertNotEqual(arr, [1, 2])
+        self.assertEqual(repr(arr), "PersistentArray('q', [1, 2])")
+        del arr[:]
+        self.assertEqual(repr(arr), "PersistentArray('q')")
+
+    def test_gc(self):
+        lst = self._make_array('q', range(100))
+        self.pop.root = self.pop.new(pmemobj.PersistentList, [lst])
+        self.pop.gc(debug=True)
+        self.pop.root = None
+        self.pop.gc(debug=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
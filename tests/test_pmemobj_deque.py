@@ -0,0 +1,208 @@
+# -*- coding: utf8 -*-
+import collections
+import unittest
+
+from nvm import pmemobj
+
+from tests.support import TestCase
+
+
+class TestPersistentDeque(TestCase):
+
+    def _make_deque(self, *args, **kw):
+        self.fn = self._test_fn()
+        self.pop = pmemobj.create(self.fn, debug=True)
+        self.addCleanup(self.pop.close)
+        self.pop.root = self.pop.new(pmemobj.PersistentDeque, *args, **kw)
+        return self.pop.root
+
+    def _reread_deque(self):
+        self.pop.close()
+        self.pop = pmemobj.open(self.fn)
+        return self.pop.root
+
+    def test_append_pop(self):
+        d = self._make_deque()
+        for i in range(20):
+            d.append(i)
+        self.assertEqual(list(d), list(range(20)))
+        d = self._reread_deque()
+        self.assertEqual(list(d), list(range(20)))
+        self.assertEqual(d.pop(), 19)
+        self.assertEqual(d.popleft(), 0)
+        d = self._reread_deque()
+        self.assertEqual(list(d), list(range(1, 19)))
+
+    def test_appendleft_popleft(self):
+        d = self._make_deque()
+        for i in range(20):
+            d.appendleft(i)
+        self.assertEqual(list(d), list(range(19, -1, -1)))
+        d = self._reread_deque()
+        self.assertEqual(list(d), list(range(19, -1, -1)))
+        self.assertEqual([d.popleft() for i in range(20)],
+                         list(range(19, -1, -1)))
+        self.assertEqual(len(d), 0)
+        with self.assertRaises(IndexError):
+            d.pop()
+        with self.assertRaises(IndexError):
+            d.popleft()
+
+    def test_queue(self):
+        # Keep the ring wrapping around its end, growing and shrinking.
+        d = self._make_deque()
+        expected = collections.deque()
+        for i in range(200):
+            d.append(i)
+            expected.append(i)
+            if i % 3:
+                self.assertEqual(d.popleft(), expected.popleft())
+        self.assertEqual(list(d), list(expected))
+        while expected:
+            self.assertEqual(d.popleft(), expected.popleft())
+            d.appendleft('x')
+            expected.appendleft('x')
+            self.assertEqual(d.popleft(), expected.popleft())
+        self.assertEqual(len(d), 0)
+        d = self._reread_deque()
+        self.assertEqual(list(d), [])
+
+    def test_maxlen(self):
+        d = self._make_deque(range(5), maxlen=3)
+        self.assertEqual(d.maxlen, 3)
+        self.assertEqual(list(d), [2, 3, 4])
+        d.append(5)
+        self.assertEqual(list(d), [3, 4, 5])
+        d.appendleft(2)
+        self.assertEqual(list(d), [2, 3, 4])
+        with self.assertRaises(IndexError):
+            d.insert(0, 1)
+        d = self._reread_deque()
+        self.assertEqual(d.maxlen, 3)
+        self.assertEqual(list(d), [2, 3, 4])
+        self.assertEqual(repr(d), 'PersistentDeque([2, 3, 4], maxlen=3)')
+
+    def test_maxlen_zero(self):
+        d = self._make_deque('abc', maxlen=0)
+        d.append('d')
+        d.appendleft('e')
+        self.assertEqual(list(d), [])
+        self.pop.gc(debug=True)
+
+    def test_bad_maxlen(self):
+        self.fn = self._test_fn()
+        self.pop = pmemobj.create(self.fn, debug=True)
+        self.addCleanup(self.pop.close)
+        with self.assertRaises(ValueError):
+            self.pop.new(pmemobj.PersistentDeque, maxlen=-1)
+
+    def test_extend(self):
+        d = self._make_deque('ab')
+        d.extend('cd')
+        d.extendleft('yz')
+        self.assertEqual(list(d), ['z', 'y', 'a', 'b', 'c', 'd'])
+        d.extend(d)
+        self.assertEqual(list(d), list('zyabcd' * 2))
+        d = self._reread_deque()
+        self.assertEqual(list(d), list('zyabcd' * 2))
+
+    def test_getitem_setitem(self):
+        d = self._make_deque(range(10))
+        d.appendleft(-1)
+        self.assertEqual(d[0], -1)
+        self.assertEqual(d[-1], 9)
+        d[0] = 'a'
+        d[-1] = 'z'
+        self.assertEqual(list(d), ['a'] + list(range(9)) + ['z'])
+        with self.assertRaises(IndexError):
+            d[11]
+        with self.assertRaises(IndexError):
+            d[-12] = 1
+        with self.assertRaises(TypeError):
+            d[1:2]
+        d = self._reread_deque()
+        self.assertEqual(list(d), ['a'] + list(range(9)) + ['z'])
+
+    def test_insert_delitem(self):
+        expected = collections.deque(range(10))
+        d = self._make_deque(expected)
+        for index in (0, 9, 3, -2, 20, -20):
+            d.insert(index, 'x')
+            expected.insert(index, 'x')
+            self.assertEqual(list(d), list(expected))
+        for index in (0, -1, 3, -4, 7):
+            del d[index]
+            del expected[index]
+            self.assertEqual(list(d), list(expected))
+        d.remove('x')
+        expected.remove('x')
+        self.assertEqual(list(d), list(expected))
+        d = self._reread_deque()
+        self.assertEqual(list(d), list(expected))
+
+    def test_rotate(self):
+        expected = collections.deque(range(7))
+        d = self._make_deque(expected)
+        for n in (1, 3, -2, 6, 0, 15, -20):
+            d.rotate(n)
+            expected.rotate(n)
+            self.assertEqual(list(d), list(expected))
+        # A full ring rotates by moving its head.
+        d.append(7)
+        expected.append(7)
+        d.rotate(3)
+        expected.rotate(3)
+        self.assertEqual(list(d), list(expected))
+        d = self._reread_deque()
+        self.assertEqual(list(d), list(expected))
+
+    def test_reverse(self):
+        d = self._make_deque(range(10))
+        d.rotate(4)
+        d.reverse()
+        expected = collections.deque(range(10))
+        expected.rotate(4)
+        expected.reverse()
+        self.assertEqual(list(d), list(expected))
+        self.assertEqual(list(reversed(d)), list(reversed(expected)))
+
+    def test_clear(self):
+        d = self._make_deque(range(10))
+        d.clear()
+        self.assertEqual(list(d), [])
+        d.append(1)
+        self.assertEqual(list(d), [1])
+        d = self._reread_deque()
+        self.assertEqual(list(d), [1])
+
+    def test_mutation_during_iteration(self):
+        d = self._make_deque(range(3))
+        with self.assertRaises(RuntimeError):
+            for x in d:
+                d.append(x)
+
+    def test_eq_repr(self):
+        d = self._make_deque('abc')
+        self.assertEqual(d, collections.deque('abc'))
+        self.assertNotEqual(d, collections.deque('abd'))
+        self.assertNotEqual(d, ['a', 'b', 'c'])
+        self.assertEqual(repr(d), "PersistentDeque(['a', 'b', 'c'])")
+        self.assertEqual(repr(self._reread_deque()),
+                         "PersistentDeque(['a', 'b', 'c'])")
+
+    def test_refcounts(self):
+        d = self._make_deque()
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        d.extend([sub, 'a', sub])
+        d.rotate(1)
+        d[1] = sub
+        d.popleft()
+        self.pop.gc(debug=True)
+        d = self._reread_deque()
+        self.assertEqual(list(d), [['x'], 'a'])
+        d.clear()
+        self.pop.gc(debug=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 import unittest
 
 from nvm import pmemobj
+from nvm.pmemobj import dict as dict_module, set as set_module
 
 from tests.support import TestCase
 
@@ -200,6 +201,329 @@ class TestPersistentDict(TestCase):
         self.assertEqual(d, {})
 
 
+    def test_equal_numeric_keys(self):
+        d = self._make_dict()
+        d[1] = 'a'
+        self.assertEqual(d[1.0], 'a')
+        self.assertEqual(d[True], 'a')
+        d[2.0] = 'b'
+        self.assertEqual(d[2], 'b')
+        d = self._reload_root()
+        self.assertEqual(d[True], 'a')
+        self.assertEqual(d[2], 'b')
+        self.assertEqual(len(d), 2)
+
+    def test_keys_with_reserved_hashes(self):
+        # 0 and -1 hash to the values that mark unused and dummy set entries.
+        d = self._make_dict()
+        keys = [0, 1, -1, 2**64 - 1]
+        for key in keys:
+            d[key] = key
+        d = self._reload_root()
+        self.assertEqual(len(d), 4)
+        for key in keys:
+            self.assertEqual(d[key], key)
+        self.assertEqual(d[False], 0)
+
+    def test_empty_string_key(self):
+        d = self._make_dict()
+        d[''] = 1
+        d = self._reload_root()
+        self.assertEqual(d[''], 1)
+
+    def test_unhashable_key(self):
+        d = self._make_dict()
+        with self.assertRaises(TypeError):
+            d[[1]] = 1
+        with self.assertRaises(TypeError):
+            d[{}]
+
+    def test_hash_scheme_migration(self):
+        # Build a dict and a set using different hash values, and mark the
+        # pool as written with an older hash scheme.  Reopening the pool must
+        # rehash them.
+        orig = dict_module.fixed_hash
+        def other_hash(key):
+            return orig(key) ^ 0x5a5a5a5a
+        dict_module.fixed_hash = set_module.fixed_hash = other_hash
+        try:
+            d = self._make_dict()
+            for i in range(20):
+                d[str(i)] = i
+            d['set'] = self.pop.new(pmemobj.PersistentSet, 'abcdef')
+        finally:
+            dict_module.fixed_hash = set_module.fixed_hash = orig
+        self.pop._pmem_root.hash_scheme = 0
+        d = self._reload_root()
+        self.assertEqual(self.pop._pmem_root.hash_scheme,
+                         dict_module.HASH_SCHEME)
+        for i in range(20):
+            self.assertEqual(d[str(i)], i)
+        self.assertIn('c', d['set'])
+        self.assertNotIn('z', d['set'])
+        d = self._reload_root()
+        self.assertEqual(d['7'], 7)
+
+    def test_immutable_keys(self):
+        d = self._make_dict()
+        tpl = self.pop.new(pmemobj.PersistentTuple, ['a', 1])
+        fs = self.pop.new(pmemobj.PersistentFrozenSet, ['b', 2])
+        d[tpl] = 'tuple'
+        d[fs] = 'frozenset'
+        self.assertEqual(d[('a', 1)], 'tuple')
+        self.assertEqual(d[frozenset([2, 'b'])], 'frozenset')
+        with self.assertRaises(TypeError):
+            d[self.pop.new(pmemobj.PersistentSet, ['b', 2])]
+        d = self._reload_root()
+        self.assertEqual(d[('a', 1)], 'tuple')
+        self.assertEqual(d[frozenset([2, 'b'])], 'frozenset')
+        self.pop.gc(debug=True)
+
+    def test_hash_scheme_migration_clears_cached_hashes(self):
+        d = self._make_dict()
+        tpl = self.pop.new(pmemobj.PersistentTuple, ['a', 1])
+        d[tpl] = 1
+        # A hash cached under an older scheme must not be reused.
+        tpl._p_cache_hash(12345)
+        self.pop._pmem_root.hash_scheme = 0
+        d = self._reload_root()
+        self.assertEqual(d[('a', 1)], 1)
+
+    def test_unknown_hash_scheme(self):
+        self._make_dict()
+        self.pop._pmem_root.hash_scheme = dict_module.HASH_SCHEME + 1
+        self.pop.close()
+        with self.assertRaises(ValueError):
+            pmemobj.open(self.fn)
+
+    def test_insertion_order(self):
+        d = self._make_dict()
+        keys = ['z', 3, 'a', 17, (1, 2), 'm']
+        for i, k in enumerate(keys):
+            d[k] = i
+        self.assertEqual(list(d), keys)
+        del d[3]
+        d['z'] = 'new'
+        d[3] = 'again'
+        expected = ['z', 'a', 17, (1, 2), 'm', 3]
+        self.assertEqual(list(d), expected)
+        d = self._reload_root()
+        self.assertEqual(list(d), expected)
+        self.assertEqual(d['z'], 'new')
+
+    def test_order_survives_resize(self):
+        # Enough keys to need the wider index types.
+        d = self._make_dict()
+        keys = [str(i) for i in range(400, 0, -1)]
+        for k in keys:
+            d[k] = k
+        for k in keys[::3]:
+            del d[k]
+        expected = [k for k in keys if k not in set(keys[::3])]
+        self.assertEqual(list(d), expected)
+        d = self._reload_root()
+        self.assertEqual(list(d), expected)
+        self.assertEqual(d['200'], '200')
+        self.pop.gc(debug=True)
+
+    def test_popitem(self):
+        d = self._make_dict()
+        for k in 'abcd':
+            d[k] = k.upper()
+        del d['d']
+        self.assertEqual(d.popitem(), ('c', 'C'))
+        d['e'] = 'E'
+        self.assertEqual(d.popitem(), ('e', 'E'))
+        d = self._reload_root()
+        self.assertEqual(list(d), ['a', 'b'])
+        self.assertEqual(d.popitem(), ('b', 'B'))
+        self.assertEqual(d.popitem(), ('a', 'A'))
+        with self.assertRaises(KeyError):
+            d.popitem()
+        self.pop.gc(debug=True)
+
+    def test_contains(self):
+        d = self._make_dict(a=1, b=None)
+        self.assertIn('a', d)
+        self.assertIn('b', d)
+        self.assertNotIn('c', d)
+        del d['a']
+        self.assertNotIn('a', d)
+
+    def test_mutation_during_iteration(self):
+        d = self._make_dict(a=1, b=2)
+        with self.assertRaises(RuntimeError):
+            for k in d:
+                d[k + 'x'] = 1
+
+    def test_refcounts(self):
+        d = self._make_dict()
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        d['a'] = sub
+        d['b'] = sub
+        d['a'] = 'y'
+        del d['b']
+        self.pop.gc(debug=True)
+        d = self._reload_root()
+        d['c'] = self.pop.new(pmemobj.PersistentList, ['z'])
+        d.clear()
+        self.pop.gc(debug=True)
+
+    def test_update(self):
+        d = self._make_dict(a=1)
+        d.update({'b': 2}, c=3)
+        d.update([('d', 4), ('a', 5), ('d', 6)])
+        self.assertEqual(list(d.items()),
+                         [('a', 5), ('b', 2), ('c', 3), ('d', 6)])
+        with self.assertRaises(TypeError):
+            d.update({}, {})
+        d = self._reload_root()
+        self.assertEqual(d, {'a': 5, 'b': 2, 'c': 3, 'd': 6})
+
+    def test_update_resizes_once(self):
+        d = self._make_dict()
+        keys_oid = d._body.ma_keys.off
+        d.update((i, str(i)) for i in range(1000))
+        self.assertNotEqual(d._body.ma_keys.off, keys_oid)
+        self.assertEqual(d._keys.dk_size, 2048)
+        self.assertEqual(d._keys.dk_nentries, 1000)
+        d = self._reload_root()
+        self.assertEqual(d, {i: str(i) for i in range(1000)})
+
+    def test_update_refcounts(self):
+        d = self._make_dict()
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        d['a'] = sub
+        d.update([('a', sub), ('b', sub), ('a', 'y')])
+        self.pop.gc(debug=True)
+        d = self._reload_root()
+        self.assertEqual(d, {'a': 'y', 'b': ['x']})
+        d.clear()
+        self.pop.gc(debug=True)
+
+    def test_reserve(self):
+        d = self._make_dict(a=1)
+        d.reserve(100)
+        keys_oid = d._body.ma_keys.off
+        for i in range(99):
+            d[i] = i
+        self.assertEqual(d._body.ma_keys.off, keys_oid)
+        d.reserve(10)
+        self.assertEqual(d._body.ma_keys.off, keys_oid)
+        d = self._reload_root()
+        self.assertEqual(len(d), 100)
+        self.assertEqual(d['a'], 1)
+
+    def test_fromkeys(self):
+        d = self._make_dict()
+        e = d.fromkeys('abca')
+        self.assertIsInstance(e, pmemobj.PersistentDict)
+        self.assertEqual(list(e.items()),
+                         [('a', None), ('b', None), ('c', None)])
+        d['e'] = d.fromkeys(range(3), 'x')
+        d = self._reload_root()
+        self.assertEqual(d['e'], {0: 'x', 1: 'x', 2: 'x'})
+        self.pop.gc(debug=True)
+
+    def test_delete_shrinks(self):
+        d = self._make_dict((i, i) for i in range(1000))
+        self.assertEqual(d._keys.dk_size, 2048)
+        for i in range(990):
+            del d[i]
+        self.assertLessEqual(d._keys.dk_size, 64)
+        self.assertEqual(list(d), list(range(990, 1000)))
+        d = self._reload_root()
+        self.assertEqual(d, {i: i for i in range(990, 1000)})
+        self.pop.gc(debug=True)
+
+    def test_churn_reuses_space(self):
+        # A dict whose items keep being replaced by new ones doesn't grow.
+        d = self._make_dict((i, i) for i in range(10))
+        for i in range(10, 1000):
+            d[i] = i
+            del d[i - 10]
+            self.assertLessEqual(d._keys.dk_size, 32)
+        self.assertEqual(list(d), list(range(990, 1000)))
+        for i in range(5):
+            d.popitem()
+        self.assertEqual(list(d), list(range(990, 995)))
+
+    def test_compact(self):
+        d = self._make_dict()
+        d.reserve(1000)
+        d.update((i, i) for i in range(20))
+        for i in range(0, 20, 2):
+            del d[i]
+        d.compact()
+        keys = d._keys
+        self.assertEqual(keys.dk_size, 16)
+        self.assertEqual(keys.dk_nentries, 10)
+        self.assertEqual(keys.dk_usable, 1)
+        keys_oid = d._body.ma_keys.off
+        d.compact()
+        self.assertEqual(d._body.ma_keys.off, keys_oid)
+        d = self._reload_root()
+        self.assertEqual(list(d.items()), [(i, i) for i in range(1, 20, 2)])
+        d[20] = 20
+        self.assertEqual(len(d), 11)
+
+    def test_items_values(self):
+        d = self._make_dict([('b', 1), ('a', 2), ('c', 3)])
+        del d['a']
+        d['d'] = 4
+        items = d.items()
+        values = d.values()
+        self.assertEqual(list(items), [('b', 1), ('c', 3), ('d', 4)])
+        self.assertEqual(list(values), [1, 3, 4])
+        self.assertIn(('c', 3), items)
+        self.assertNotIn(('c', 4), items)
+        self.assertIn(4, values)
+        self.assertEqual(list(d.keys()), ['b', 'c', 'd'])
+        d = self._reload_root()
+        self.assertEqual(list(d.items()), [('b', 1), ('c', 3), ('d', 4)])
+
+    def test_items_values_without_lookups(self):
+        d = self._make_dict(a=1, b=2)
+        def fail(self, key):
+            raise AssertionError("looked up {!r}".format(key))
+        orig = pmemobj.PersistentDict.__getitem__
+        pmemobj.PersistentDict.__getitem__ = fail
+        try:
+            self.assertEqual(sorted(d.items()), [('a', 1), ('b', 2)])
+            self.assertEqual(sorted(d.values()), [1, 2])
+        finally:
+            pmemobj.PersistentDict.__getitem__ = orig
+
+    def test_items_mutation_during_iteration(self):
+        d = self._make_dict(a=1, b=2)
+        with self.assertRaises(RuntimeError):
+            for k, v in d.items():
+                del d['b']
+
+    def _track_resurrects(self):
+        mm = self.pop.mm
+        calls = []
+        orig = mm.resurrect
+        def resurrect(oid):
+            calls.append(mm.otuple(oid))
+            return orig(oid)
+        mm.resurrect = resurrect
+        self.addCleanup(delattr, mm, 'resurrect')
+        return calls
+
+    def test_lookup_by_known_oid(self):
+        d = self._make_dict()
+        key = 'a key'
+        d[key] = 1
+        k_oid = self.pop.mm.known_oid(key)
+        self.assertIsNotNone(k_oid)
+        calls = self._track_resurrects()
+        self.assertEqual(d[key], 1)
+        self.assertIn(key, d)
+        d[key] = 2
+        self.assertNotIn(k_oid, calls)
+        self.assertEqual(d['a key'], 2)
+
     # XXX test(s) for dict mutating on comparison during lookdict
 
 
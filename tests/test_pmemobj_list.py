@@ -43,6 +43,42 @@ class TestPersistentList(TestCase):
         lst = self._reread_list()
         self.assertEqual(lst, ['z', 'a', 'b', 'c', 'y'])
 
+    def test_append(self):
+        lst = self._make_list([])
+        for i in range(20):
+            lst.append(i)
+        self.assertEqual(lst, list(range(20)))
+        lst = self._reread_list()
+        self.assertEqual(lst, list(range(20)))
+
+    def test_extend(self):
+        lst = self._make_list([])
+        lst.extend([])
+        self.assertEqual(lst, [])
+        lst.extend(['a', 'b'])
+        self.assertEqual(lst, ['a', 'b'])
+        lst.extend(x for x in range(100))
+        self.assertEqual(lst, ['a', 'b'] + list(range(100)))
+        lst = self._reread_list()
+        self.assertEqual(lst, ['a', 'b'] + list(range(100)))
+
+    def test_extend_self(self):
+        lst = self._make_list([1, 2])
+        lst.extend(lst)
+        self.assertEqual(lst, [1, 2, 1, 2])
+        lst = self._reread_list()
+        self.assertEqual(lst, [1, 2, 1, 2])
+
+    def test_extend_refcounts_repeated_object(self):
+        lst = self._make_list([])
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        lst.extend([sub, sub, sub])
+        del lst[0]
+        del lst[0]
+        self.pop.gc(debug=True)
+        lst = self._reread_list()
+        self.assertEqual(lst, [['x']])
+
     def test_repr(self):
         expected = "PersistentList(['a', 'b', 'c'])"
         lst = self._make_list(['a', 'b', 'c'])
@@ -107,6 +143,30 @@ class TestPersistentList(TestCase):
         lst = self._reread_list()
         self.assertEqual(lst, [])
 
+    def test_insert_delete_at_head(self):
+        lst = self._make_list(list(range(50)))
+        for i in range(10):
+            lst.insert(0, -i)
+        self.assertEqual(lst, list(range(-9, 1)) + list(range(50)))
+        for i in range(20):
+            del lst[0]
+        self.assertEqual(lst, list(range(10, 50)))
+        lst = self._reread_list()
+        self.assertEqual(lst, list(range(10, 50)))
+
+    def test_pop(self):
+        lst = self._make_list(['a', 'b', 'c', 'd'])
+        self.assertEqual(lst.pop(), 'd')
+        self.assertEqual(lst.pop(0), 'a')
+        self.assertEqual(lst, ['b', 'c'])
+        lst = self._reread_list()
+        self.assertEqual(lst, ['b', 'c'])
+        self.assertEqual(lst.pop(-2), 'b')
+        self.assertEqual(lst.pop(), 'c')
+        self.assertEqual(lst, [])
+        with self.assertRaises(IndexError):
+            lst.pop()
+
     def test_delitem_index_errors(self):
         lst = self._make_list(['a', 'b', 'c'])
         with self.assertRaises(IndexError):
@@ -118,6 +178,147 @@ class TestPersistentList(TestCase):
         with self.assertRaises(IndexError):
             del lst[-10]
 
+    def test_getitem_slice(self):
+        expected = list(range(10))
+        lst = self._make_list(expected)
+        for s in (slice(None), slice(2, 5), slice(-3, None), slice(8, 2),
+                  slice(None, None, 3), slice(None, None, -1),
+                  slice(7, 1, -2), slice(20, 30)):
+            self.assertEqual(lst[s], expected[s])
+            self.assertIsInstance(lst[s], list)
+        lst = self._reread_list()
+        self.assertEqual(lst[3:6], [3, 4, 5])
+        self.assertEqual(self._make_list([])[:], [])
+
+    def test_setitem_slice(self):
+        expected = list(range(10))
+        lst = self._make_list(expected)
+        for s, values in ((slice(2, 5), ['a', 'b', 'c']),
+                          (slice(0, 1), ['x', 'y', 'z']),
+                          (slice(3, 9), ['q']),
+                          (slice(-2, None), []),
+                          (slice(4, 4), [1.5, 2.5]),
+                          (slice(20, 30), ['end'])):
+            lst[s] = values
+            expected[s] = values
+            self.assertEqual(lst, expected)
+        lst = self._reread_list()
+        self.assertEqual(lst, expected)
+        lst[:] = []
+        self.assertEqual(lst, [])
+        lst = self._reread_list()
+        self.assertEqual(lst, [])
+
+    def test_setitem_slice_self(self):
+        lst = self._make_list([1, 2, 3])
+        lst[1:2] = lst
+        self.assertEqual(lst, [1, 1, 2, 3, 3])
+
+    def test_setitem_extended_slice(self):
+        expected = list(range(10))
+        lst = self._make_list(expected)
+        lst[::2] = 'abcde'
+        expected[::2] = 'abcde'
+        self.assertEqual(lst, expected)
+        lst[::-3] = 'wxyz'
+        expected[::-3] = 'wxyz'
+        self.assertEqual(lst, expected)
+        with self.assertRaises(ValueError):
+            lst[::2] = 'ab'
+        lst = self._reread_list()
+        self.assertEqual(lst, expected)
+
+    def test_delitem_slice(self):
+        expected = list(range(20))
+        lst = self._make_list(expected)
+        for s in (slice(2, 5), slice(-3, None), slice(None, None, 3),
+                  slice(None, None, -4), slice(5, 2), slice(20, 30)):
+            del lst[s]
+            del expected[s]
+            self.assertEqual(lst, expected)
+        lst = self._reread_list()
+        self.assertEqual(lst, expected)
+        del lst[:]
+        self.assertEqual(lst, [])
+        lst = self._reread_list()
+        self.assertEqual(lst, [])
+
+    def test_slice_refcounts(self):
+        lst = self._make_list([])
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        lst[:] = [sub, sub, 'a', sub]
+        del lst[::2]
+        self.assertEqual(lst, [['x'], ['x']])
+        lst[0:1] = []
+        self.pop.gc(debug=True)
+        lst = self._reread_list()
+        self.assertEqual(lst, [['x']])
+
+    def test_iter(self):
+        lst = self._make_list([])
+        self.assertEqual(list(iter(lst)), [])
+        self.assertEqual(list(reversed(lst)), [])
+        lst.extend(range(50))
+        self.assertEqual(list(iter(lst)), list(range(50)))
+        self.assertEqual(list(reversed(lst)), list(range(49, -1, -1)))
+        lst = self._reread_list()
+        self.assertEqual([x for x in lst], list(range(50)))
+
+    def test_iter_with_resize(self):
+        lst = self._make_list([0])
+        seen = []
+        for x in lst:
+            seen.append(x)
+            if x < 100:
+                lst.append(x + 1)
+        self.assertEqual(seen, list(range(101)))
+        seen = []
+        for x in lst:
+            seen.append(x)
+            del lst[-10:]
+        self.assertEqual(seen, list(range(10)))
+
+    def test_iterchunks(self):
+        lst = self._make_list(list(range(10)))
+        self.assertEqual(list(lst.iterchunks(4)),
+                         [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(list(lst.iterchunks()), [list(range(10))])
+        with self.assertRaises(ValueError):
+            list(lst.iterchunks(0))
+
+    def test_contains(self):
+        sub = ['x']
+        lst = self._make_list(['a', u'\u20ac', 1, True, 2.5, None])
+        lst.append(self.pop.new(pmemobj.PersistentList, sub))
+        for lst in (lst, self._reread_list()):
+            for value in ('a', u'\u20ac', 1, True, 2.5, None, 1.0, sub,
+                          lst[-1]):
+                self.assertIn(value, lst)
+            for value in ('b', '1', 2, False, ['y'], []):
+                self.assertNotIn(value, lst)
+
+    def test_index(self):
+        lst = self._make_list(['a', 'b', 1, 'a', True])
+        for lst in (lst, self._reread_list()):
+            self.assertEqual(lst.index('a'), 0)
+            self.assertEqual(lst.index('a', 1), 3)
+            self.assertEqual(lst.index('a', -2), 3)
+            self.assertEqual(lst.index(1), 2)
+            self.assertEqual(lst.index(True), 2)
+            self.assertEqual(lst.index('b', 0, 2), 1)
+            with self.assertRaises(ValueError):
+                lst.index('a', 1, 3)
+            with self.assertRaises(ValueError):
+                lst.index('c')
+
+    def test_count(self):
+        lst = self._make_list(['a', 'b', 'a', 1, 1.0, True, 'ab'])
+        for lst in (lst, self._reread_list()):
+            self.assertEqual(lst.count('a'), 2)
+            self.assertEqual(lst.count('ab'), 1)
+            self.assertEqual(lst.count(1), 3)
+            self.assertEqual(lst.count('z'), 0)
+
     def test_len(self):
         lst = self._make_list([])
         for i in range(6):
@@ -134,6 +335,73 @@ class TestPersistentList(TestCase):
         lst.append(1)
         self.assertEqual(lst, [1])
 
+    def test_reverse(self):
+        lst = self._make_list([])
+        lst.reverse()
+        self.assertEqual(lst, [])
+        lst.extend(['a', 'b', 'c', 'd'])
+        lst.reverse()
+        self.assertEqual(lst, ['d', 'c', 'b', 'a'])
+        lst = self._reread_list()
+        self.assertEqual(lst, ['d', 'c', 'b', 'a'])
+
+    def test_sort(self):
+        expected = [5, 3, 9, 1, 3, 7, 0]
+        lst = self._make_list(expected)
+        lst.sort()
+        self.assertEqual(lst, sorted(expected))
+        lst = self._reread_list()
+        self.assertEqual(lst, sorted(expected))
+        lst.sort(reverse=True)
+        self.assertEqual(lst, sorted(expected, reverse=True))
+        lst = self._reread_list()
+        self.assertEqual(lst, sorted(expected, reverse=True))
+
+    def test_sort_key_is_stable(self):
+        expected = ['bb', 'a', 'ccc', 'd', 'ee', 'f']
+        lst = self._make_list(expected)
+        lst.sort(key=len)
+        self.assertEqual(lst, sorted(expected, key=len))
+        lst.sort(key=len, reverse=True)
+        self.assertEqual(lst, sorted(expected, key=len, reverse=True))
+        lst = self._reread_list()
+        self.assertEqual(lst, sorted(expected, key=len, reverse=True))
+
+    def test_sort_refcounts(self):
+        lst = self._make_list([])
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        lst.extend(['b', sub, 'a', sub])
+        lst.sort(key=str)
+        lst.reverse()
+        self.pop.gc(debug=True)
+        lst = self._reread_list()
+        self.assertEqual(lst, sorted(['b', ['x'], 'a', ['x']], key=str,
+                                     reverse=True))
+        del lst[:]
+        self.pop.gc(debug=True)
+
+    def test_sort_modified(self):
+        lst = self._make_list([3, 1, 2])
+        def key(value):
+            lst.append(value)
+            return value
+        with self.assertRaises(ValueError):
+            lst.sort(key=key)
+
+    def test_sort_item_replaced(self):
+        lst = self._make_list([3, 1, 2])
+        lst[0] = self.pop.new(pmemobj.PersistentList, ['x'])
+        def key(value):
+            if value == 1:
+                lst[0] = 'replaced'
+            return str(value)
+        with self.assertRaises(ValueError):
+            lst.sort(key=key)
+        self.assertEqual(lst, ['replaced', 1, 2])
+        self.pop.gc(debug=True)
+        lst = self._reread_list()
+        self.assertEqual(lst, ['replaced', 1, 2])
+
     def test_eq(self):
         lst = self._make_list([])
         self.assertEqual(lst, [])
@@ -153,6 +421,19 @@ class TestPersistentList(TestCase):
         lst[0].append(5)
         self.assertNotEqual(lst[0],lst[1])
 
+    def test_eq_shared_items(self):
+        lst = self._make_list(['a', 'b', 1])
+        other = self.pop.new(pmemobj.PersistentList, lst)
+        self.assertEqual(lst, other)
+        self.assertEqual(lst, ['a', 'b', 1])
+        self.assertEqual(lst, ['a', 'b', True])
+        self.assertNotEqual(lst, ['a', 'b', 2])
+        other[1] = 'c'
+        self.assertNotEqual(lst, other)
+        lst = self._reread_list()
+        self.assertEqual(lst, ['a', 'b', 1])
+        self.assertNotEqual(lst, ['a', 'c', 1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -20,6 +20,40 @@ class Foo3(pmemobj.PersistentObject):
         self.bar = None
         self.bing = 'this is a test'
 
+class Point(pmemobj.PersistentObject):
+    __pslots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class Point3(Point):
+    __pslots__ = 'z'
+
+class Point4(Point3):
+    __pslots__ = u'w'
+
+class Record(pmemobj.PersistentObject):
+    __pslots__ = ('key', '__dict__')
+
+class PointWithExtras(Point):
+    pass
+
+class Pair(pmemobj.PersistentObject):
+    __pslots__ = ('a', 'b')
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+
+def _redeclare_pslots(cls, pslots):
+    # Stand in for changing the __pslots__ in the class statement.
+    for name in ('_p_slot_layout', '_p_dict', 'a', 'b', 'c'):
+        if name in vars(cls):
+            delattr(cls, name)
+    cls.__pslots__ = pslots
+
 
 class TestPersistentObject(TestCase):
 
@@ -130,6 +164,243 @@ class TestPersistentObject(TestCase):
         self.assertEqual(o.bar, None)
         self.assertEqual(o.bing, 'this is a test')
 
+    def _count_dict_lookups(self, obj):
+        calls = []
+        d = obj._p_dict
+        orig = d.get
+        def get(key, default=None):
+            calls.append(key)
+            return orig(key, default)
+        d.get = get
+        self.addCleanup(delattr, d, 'get')
+        return calls
+
+    def test_attribute_cache(self):
+        d = self._make_object(Foo)
+        d.bar = 1
+        calls = self._count_dict_lookups(d)
+        for i in range(3):
+            self.assertEqual(d.bar, 1)
+            self.assertEqual(d.no_fubar(1), 2)
+            self.assertEqual(d.class_attr, 10)
+        self.assertEqual(sorted(calls), ['bar', 'class_attr', 'no_fubar'])
+        d.bar = 2
+        self.assertEqual(d.bar, 2)
+        d.no_fubar = 'shadowed'
+        self.assertEqual(d.no_fubar, 'shadowed')
+        del d.no_fubar
+        self.assertEqual(d.no_fubar(1), 2)
+        del d.bar
+        with self.assertRaises(AttributeError):
+            d.bar
+
+    def test_attribute_cache_after_abort(self):
+        d = self._make_object(Foo)
+        d.bar = 1
+        self.assertEqual(d.bar, 1)
+        with self.assertRaises(ValueError):
+            with self.pop.transaction():
+                d.bar = 2
+                d.baz = 3
+                self.assertEqual(d.bar, 2)
+                self.assertEqual(d.baz, 3)
+                raise ValueError()
+        self.assertEqual(d.bar, 1)
+        with self.assertRaises(AttributeError):
+            d.baz
+
+    def test_attribute_cache_direct_dict_writes(self):
+        d = self._make_object(Foo)
+        d.bar = 1
+        self.assertEqual(d.bar, 1)
+        self.assertEqual(d.no_fubar(1), 2)
+        d._p_dict['bar'] = 2
+        self.assertEqual(d.bar, 2)
+        d._p_dict['no_fubar'] = 'shadowed'
+        self.assertEqual(d.no_fubar, 'shadowed')
+        d._p_dict.update(bar=3, baz=4)
+        self.assertEqual((d.bar, d.baz), (3, 4))
+        d._p_dict.clear()
+        self.assertFalse(hasattr(d, 'bar'))
+        self.assertEqual(d.no_fubar(1), 2)
+
+    def test_attribute_cache_new_and_reopen(self):
+        self._make_object(pmemobj.PersistentList)
+        o = self.pop.new(Foo3)
+        self.pop.root.append(o)
+        self.assertEqual(o.bing, 'this is a test')
+        self.assertFalse(hasattr(o, 'x'))
+        o = self._reload_root()[0]
+        self.assertIsInstance(o, Foo3)
+        self.assertEqual(o.bar, None)
+        self.assertEqual(o.bing, 'this is a test')
+        o.bar = 'set'
+        o = self._reload_root()[0]
+        self.assertEqual(o.bar, 'set')
+
+    def test_double_underscore_attribute(self):
+        # Only the special __x__ names bypass the persistent attributes.
+        d = self._make_object(Foo)
+        setattr(d, '__foo', 1)
+        setattr(d, '__bar_', 2)
+        self.assertEqual(getattr(d, '__foo'), 1)
+        d = self._reload_root()
+        self.assertEqual(getattr(d, '__foo'), 1)
+        self.assertEqual(getattr(d, '__bar_'), 2)
+        self.assertIs(d.__class__, Foo)
+
+    def test_pslots(self):
+        p = self._make_object(Point, 1, 'a')
+        self.assertEqual((p.x, p.y), (1, 'a'))
+        self.assertIsNone(p._p_dict)
+        with self.assertRaises(AttributeError):
+            p.other = 1
+        with self.assertRaises(AttributeError):
+            p.other
+        p.x = [1, 2]
+        del p.y
+        with self.assertRaises(AttributeError):
+            p.y
+        with self.assertRaises(AttributeError):
+            del p.y
+        self.assertFalse(hasattr(p, 'y'))
+        self.pop.gc(debug=True)
+        p = self._reload_root()
+        self.assertEqual(p.x, [1, 2])
+        self.assertFalse(hasattr(p, 'y'))
+        p.y = 3
+        self.assertEqual(p.y, 3)
+        self.pop.root = None
+        self.pop.gc(debug=True)
+
+    def test_pslots_single_allocation(self):
+        # No attribute dicts are allocated for the instances.
+        self._make_object(Point, 0, 0)
+        before, _ = self.pop.gc()
+        objs = self.pop.root = self.pop.new(pmemobj.PersistentList,
+                                            [self.pop.new(Point, i, i)
+                                             for i in range(10)])
+        self.assertEqual(objs[9].x, 9)
+        after, _ = self.pop.gc()
+        self.assertEqual(after['Point'], 10)
+        self.assertEqual(after.get('PersistentDict', 0),
+                         before.get('PersistentDict', 0))
+
+    def test_pslots_subclass(self):
+        p = self._make_object(Point3, 1, 2)
+        p.z = 3
+        self.assertEqual((p.x, p.y, p.z), (1, 2, 3))
+        self.assertIsNone(p._p_dict)
+        p = self._reload_root()
+        self.assertEqual((p.x, p.y, p.z), (1, 2, 3))
+        # A text string declares a single slot, as with __slots__.
+        p = self.pop.root = self.pop.new(Point4, 1, 2)
+        p.w = 4
+        self.assertEqual((p.x, p.y, p.w), (1, 2, 4))
+        self.assertEqual(p._p_body.ob_nslots, 4)
+        self.assertIsNone(p._p_dict)
+
+    def test_pslots_extras(self):
+        r = self._make_object(Record)
+        r.key = 'k'
+        self.assertIsNone(r._p_dict)
+        r.extra = 'e'
+        self.assertEqual(r._p_dict, {'extra': 'e'})
+        self.assertEqual((r.key, r.extra), ('k', 'e'))
+        p = self.pop.new(PointWithExtras, 1, 2)
+        p.color = 'red'
+        self.pop.root = [r, p]
+        self.pop.gc(debug=True)
+        r, p = self._reload_root()
+        self.assertEqual((r.key, r.extra), ('k', 'e'))
+        self.assertEqual((p.x, p.y, p.color), (1, 2, 'red'))
+        del r.extra
+        with self.assertRaises(AttributeError):
+            r.extra
+        self.pop.root = None
+        self.pop.gc(debug=True)
+
+    def test_pslots_abort(self):
+        r = self._make_object(Record)
+        with self.assertRaises(ValueError):
+            with self.pop.transaction():
+                r.key = 'k'
+                r.extra = 'e'
+                raise ValueError()
+        self.assertFalse(hasattr(r, 'key'))
+        self.assertIsNone(r._p_dict)
+        self.pop.gc(debug=True)
+
+    def test_pslots_changed(self):
+        self._make_object(Pair, 1, 2)
+        self.pop.close()
+        self.addCleanup(_redeclare_pslots, Pair, ('a', 'b'))
+        # Renaming or reordering the slots invalidates stored instances.
+        for pslots in (('b', 'a'), ('a', 'c')):
+            _redeclare_pslots(Pair, pslots)
+            self.pop = pmemobj.open(self.fn)
+            try:
+                with self.assertRaises(TypeError):
+                    self.pop.root
+            finally:
+                self.pop.close()
+        _redeclare_pslots(Pair, ('a', 'b'))
+        self.pop = pmemobj.open(self.fn)
+        self.addCleanup(self.pop.close)
+        p = self.pop.root
+        self.assertEqual((p.a, p.b), (1, 2))
+
+    def test_instances_share_keys(self):
+        self._make_object(Foo)
+        objs = self.pop.root = self.pop.new(pmemobj.PersistentList,
+                                            [self.pop.new(Foo3)
+                                             for i in range(3)])
+        for i, o in enumerate(objs):
+            o.bar = i
+        keys = set(o._p_dict._body.ma_keys.off for o in objs)
+        self.assertEqual(len(keys), 1)
+        self.pop.gc(debug=True)
+        objs = self._reload_root()
+        self.assertEqual([(o.bar, o.bing) for o in objs],
+                         [(i, 'this is a test') for i in range(3)])
+        o = self.pop.new(Foo3)
+        self.assertEqual(o._p_dict._body.ma_keys.off, keys.pop())
+
+    def test_split_dict_combines(self):
+        self._make_object(Foo)
+        objs = self.pop.root = self.pop.new(pmemobj.PersistentList,
+                                            [self.pop.new(Foo)
+                                             for i in range(4)])
+        objs[0].a = 1
+        objs[0].b = 2
+        # Attributes set in a different order.
+        objs[1].b = 2
+        objs[1].a = 1
+        # Deleting anything but the most recent attribute.
+        objs[2].a = 1
+        objs[2].b = 2
+        del objs[2].a
+        # More attributes than the shared keys can hold.
+        objs[3].a = 1
+        objs[3].b = 2
+        for i in range(100):
+            setattr(objs[3], 'x%s' % i, i)
+        self.assertTrue(objs[0]._p_dict._is_split())
+        for o in objs[1:]:
+            self.assertFalse(o._p_dict._is_split())
+        self.pop.gc(debug=True)
+        objs = self._reload_root()
+        self.assertEqual(list(objs[0]._p_dict.items()), [('a', 1), ('b', 2)])
+        self.assertEqual(list(objs[1]._p_dict.items()), [('b', 2), ('a', 1)])
+        self.assertEqual(list(objs[2]._p_dict.items()), [('b', 2)])
+        self.assertEqual(objs[3].x99, 99)
+        self.assertEqual(len(objs[3]._p_dict), 102)
+        del objs[0].b
+        self.assertTrue(objs[0]._p_dict._is_split())
+        self.assertEqual(list(objs[0]._p_dict), ['a'])
+        self.pop.root = None
+        self.pop.gc(debug=True)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -180,6 +180,45 @@ class TestPersistence(TestCase):
         pop = self._reopen_pop()
         self.assertIs(pop.root, obj)
 
+    def test_builtin_containers(self):
+        pop = self._setup()
+        pop.root = {'a': [1, 2, {'b': (3, 4)}], 'c': {5}, 'd': frozenset('x')}
+        pop = self._reopen_pop()
+        root = pop.root
+        self.assertIsInstance(root, pmemobj.PersistentDict)
+        self.assertIsInstance(root['a'], pmemobj.PersistentList)
+        self.assertIsInstance(root['a'][2], pmemobj.PersistentDict)
+        self.assertIsInstance(root['a'][2]['b'], pmemobj.PersistentTuple)
+        self.assertIsInstance(root['c'], pmemobj.PersistentSet)
+        self.assertIsInstance(root['d'], pmemobj.PersistentFrozenSet)
+        self.assertEqual(root['a'][:2], [1, 2])
+        self.assertEqual(root['a'][2]['b'], (3, 4))
+        self.assertEqual(root['c'], {5})
+        self.assertEqual(root['d'], frozenset('x'))
+        root['a'].append([6])
+        self.assertIsInstance(root['a'][3], pmemobj.PersistentList)
+        pop.gc(debug=True)
+
+    def test_builtin_containers_shared_and_cyclic(self):
+        pop = self._setup()
+        shared = [1]
+        cyclic = {}
+        cyclic['self'] = cyclic
+        pop.root = [shared, (shared,), cyclic]
+        pop = self._reopen_pop()
+        root = pop.root
+        self.assertIs(root[0], root[1][0])
+        self.assertIs(root[2]['self'], root[2])
+        root[0].append(2)
+        self.assertEqual(root[1][0], [1, 2])
+        pop.gc(debug=True)
+
+    def test_builtin_container_with_unknown_item(self):
+        pop = self._setup()
+        with self.assertRaises(TypeError):
+            pop.root = [1, (TestFoo(),)]
+        self.assertIsNone(pop.root)
+
     def test_persistence_via_pickle(self):
         from decimal import Decimal
         pop = self._setup()
@@ -325,6 +364,191 @@ class TestTransactions(TestCase):
         self.assertEqual(pop.root, 10)
 
 
+class TestSnapshotTracker(TestCase):
+
+    def _setup(self):
+        self.fn = self._test_fn()
+        pop = self.pop = pmemobj.create(self.fn)
+        self.addCleanup(lambda: self.pop.close())
+        return pop
+
+    def test_gaps(self):
+        tracker = pmemobj.pool._SnapshotTracker()
+        self.assertEqual(tracker.add(100, 10), [(100, 10)])
+        self.assertEqual(tracker.add(100, 10), [])
+        self.assertEqual(tracker.add(104, 2), [])
+        self.assertEqual(tracker.add(110, 10), [(110, 10)])
+        self.assertEqual(tracker.add(130, 10), [(130, 10)])
+        self.assertEqual(tracker.add(90, 60), [(90, 10), (120, 10),
+                                               (140, 10)])
+        self.assertEqual(tracker.add(95, 50), [])
+        self.assertEqual(tracker._starts, [90])
+        self.assertEqual(tracker._ends, [150])
+        self.assertEqual(tracker.stats['calls'], 7)
+        self.assertEqual(tracker.stats['suppressed'], 3)
+        self.assertEqual(tracker.stats['bytes-snapshotted'], 60)
+        tracker.reset()
+        self.assertEqual(tracker.add(100, 10), [(100, 10)])
+
+    def test_adjacent_ranges_merge(self):
+        tracker = pmemobj.pool._SnapshotTracker()
+        for i in range(10):
+            tracker.add(1000 + 16*i, 16)
+        self.assertEqual(tracker._starts, [1000])
+        self.assertEqual(tracker._ends, [1160])
+
+    def test_repeated_snapshots_suppressed(self):
+        pop = self._setup()
+        lst = pop.root = pop.new(pmemobj.PersistentList, [1, 2, 3])
+        before = pop.mm.snapshot_stats()
+        with pop.transaction():
+            for i in range(10):
+                lst[1] = i
+        after = pop.mm.snapshot_stats()
+        self.assertGreater(after['suppressed'], before.get('suppressed', 0))
+        self.assertEqual(lst, [1, 9, 3])
+
+    def test_ranges_forgotten_after_transaction(self):
+        pop = self._setup()
+        lst = pop.root = pop.new(pmemobj.PersistentList, [1, 2, 3])
+        with self.assertRaises(OSError):
+            with pop.transaction() as trans:
+                lst[1] = 10
+                trans.abort()
+        self.assertEqual(lst, [1, 2, 3])
+        with self.assertRaisesRegex(Exception, 'boo'):
+            with pop.transaction():
+                lst[1] = 10
+                raise Exception('boo')
+        self.assertEqual(lst, [1, 2, 3])
+
+
+class TestBulkLoad(TestCase):
+
+    def _setup(self):
+        self.fn = self._test_fn()
+        pop = self.pop = pmemobj.create(self.fn)
+        self.addCleanup(lambda: self.pop.close())
+        pop.root = pop.new(pmemobj.PersistentList)
+        return pop
+
+    def _reopen_pop(self):
+        self.pop.close()
+        pop = self.pop = pmemobj.open(self.fn)
+        return pop
+
+    def test_load_in_chunks(self):
+        pop = self._setup()
+        lst = pop.root
+        with pop.bulk_load(chunk=3) as loader:
+            for x in loader(range(10)):
+                lst.append(x)
+        self.assertEqual(loader.cursor, 10)
+        self.assertEqual(lst, list(range(10)))
+        pop = self._reopen_pop()
+        self.assertEqual(pop.root, list(range(10)))
+
+    def test_step(self):
+        pop = self._setup()
+        lst = pop.root
+        with pop.bulk_load(chunk=2) as loader:
+            for x in range(5):
+                lst.append(x)
+                loader.step()
+        self.assertEqual(loader.cursor, 5)
+        self.assertEqual(lst, list(range(5)))
+
+    def test_failure_keeps_committed_chunks_and_resumes(self):
+        pop = self._setup()
+        lst = pop.root
+        with self.assertRaisesRegex(Exception, 'boo'):
+            with pop.bulk_load(chunk=3) as loader:
+                for x in loader(range(10)):
+                    if x == 7:
+                        raise Exception('boo')
+                    lst.append(x)
+        self.assertEqual(loader.cursor, 6)
+        self.assertEqual(lst, list(range(6)))
+        with pop.bulk_load(chunk=3, start=loader.cursor) as loader:
+            for x in loader(range(10)):
+                lst.append(x)
+        self.assertEqual(loader.cursor, 10)
+        self.assertEqual(lst, list(range(10)))
+
+    def test_checkpoint_is_committed_with_chunk(self):
+        pop = self._setup()
+        lst = pop.root
+        progress = pop.new(pmemobj.PersistentList, [0])
+        lst.append(progress)
+
+        def checkpoint(cursor):
+            progress[0] = cursor
+        with self.assertRaisesRegex(Exception, 'boo'):
+            with pop.bulk_load(chunk=4, checkpoint=checkpoint) as loader:
+                for x in loader(range(10)):
+                    if x == 9:
+                        raise Exception('boo')
+                    lst.append(x)
+        self.assertEqual(progress[0], 8)
+        self.assertEqual(len(lst), 9)
+
+    def test_log_size(self):
+        pop = self._setup()
+        lst = pop.root
+        with self.assertRaisesRegex(Exception, 'boo'):
+            with pop.bulk_load(chunk=4, log_size=4096) as loader:
+                for x in loader(range(10)):
+                    if x == 9:
+                        raise Exception('boo')
+                    lst.append(x)
+        self.assertEqual(lst, list(range(8)))
+        type_counts, gc_counts = pop.gc()
+        self.assertEqual(gc_counts['logbuffers-gced'], 0)
+
+    def test_bulk_load_inside_transaction_raises(self):
+        pop = self._setup()
+        with pop.transaction():
+            with self.assertRaisesRegex(RuntimeError, 'inside a transaction'):
+                with pop.bulk_load():
+                    pass
+
+    def test_bad_chunk_size(self):
+        pop = self._setup()
+        with self.assertRaises(ValueError):
+            pop.bulk_load(chunk=0)
+
+    def test_reserve_log(self):
+        pop = self._setup()
+        lst = pop.root
+        pop.mm.reserve_log(pop.mm.snapshot_log_size([4096] * 4))
+        with pop.transaction():
+            lst.extend(range(100))
+        self.assertEqual(lst, list(range(100)))
+        type_counts, gc_counts = pop.gc()
+        self.assertEqual(gc_counts['logbuffers-gced'], 0)
+
+    def test_reserve_log_abort(self):
+        pop = self._setup()
+        lst = pop.root
+        pop.mm.reserve_log(pop.mm.snapshot_log_size([4096] * 4))
+        # A gc before the transaction begins leaves the reserved space alone.
+        type_counts, gc_counts = pop.gc()
+        self.assertEqual(gc_counts['logbuffers-gced'], 0)
+        with self.assertRaises(ValueError):
+            with pop.transaction():
+                lst.extend(range(100))
+                raise ValueError()
+        self.assertEqual(lst, [])
+        type_counts, gc_counts = pop.gc()
+        self.assertEqual(gc_counts['logbuffers-gced'], 0)
+
+    def test_reserve_log_inside_transaction_raises(self):
+        pop = self._setup()
+        with pop.transaction():
+            with self.assertRaisesRegex(RuntimeError, 'inside a transaction'):
+                pop.mm.reserve_log(4096)
+
+
 class TestGC(TestCase):
 
     def _pop(self):
@@ -340,11 +340,240 @@ class TestPersistentSet(JointOps, TestCase):
             self.assertNotIn(elem, self.s)
         self.assertRaises(KeyError, self.s.pop)
 
+    def test_keys_with_reserved_hashes(self):
+        # 0 and -1 hash to the values that mark unused and dummy entries.
+        # -1 and 2**64 - 1 have the same hash but are not equal.
+        keys = [0, 1, -1, 2**64 - 1]
+        s = self._make_set(keys)
+        self.assertEqual(len(s), 4)
+        for key in keys + [True, False]:
+            self.assertIn(key, s)
+        self.assertNotIn(2, s)
+        self.assertEqual(s, set(keys))
+
+    def test_lookup_by_known_oid(self):
+        s = self._make_set(['a key', 'other'])
+        k_oid = self.pop.mm.known_oid('a key')
+        self.assertIsNotNone(k_oid)
+        mm = self.pop.mm
+        calls = []
+        orig = mm.resurrect
+        def resurrect(oid):
+            calls.append(mm.otuple(oid))
+            return orig(oid)
+        mm.resurrect = resurrect
+        self.addCleanup(delattr, mm, 'resurrect')
+        self.assertIn('a key', s)
+        s.add('a key')
+        self.assertEqual(len(s), 2)
+        self.assertNotIn(k_oid, calls)
+
+    def test_set_algebra_between_persistent_sets(self):
+        a = self._make_set(['x', 'y', 'z', 1, 2])
+        b = self._make_set(['y', 2, 3, 'w'])
+        c = self._make_set([3, 'z'])
+        self.assertEqual(a.union(b, c), {'x', 'y', 'z', 'w', 1, 2, 3})
+        self.assertEqual(a.intersection(b), {'y', 2})
+        self.assertEqual(b.intersection(a, [2]), {2})
+        self.assertEqual(a.difference(b, c), {'x', 1})
+        self.assertEqual(a.symmetric_difference(b), {'x', 'z', 1, 3, 'w'})
+        for result in (a | b, a & b, a - b, a ^ b):
+            self._track_set(result)
+        self.pop.gc(debug=True)
+
+    def test_set_algebra_without_resurrects(self):
+        a = self._make_set(['x', 'y', 'z'])
+        b = self._make_set(['y', 'z', 'w'])
+        mm = self.pop.mm
+        calls = []
+        orig = mm.resurrect
+        def resurrect(oid):
+            calls.append(mm.otuple(oid))
+            return orig(oid)
+        mm.resurrect = resurrect
+        self.addCleanup(delattr, mm, 'resurrect')
+        results = [a.union(b), a.intersection(b), a.difference(b),
+                   a.symmetric_difference(b)]
+        self.assertEqual(calls, [])
+        del mm.resurrect
+        self.assertEqual(results, [{'x', 'y', 'z', 'w'}, {'y', 'z'}, {'x'},
+                                   {'x', 'w'}])
+
+    def test_set_algebra_after_reopen(self):
+        # Equal elements persisted separately have different oids and must
+        # still be matched by value.
+        a = self._make_set(['x', 'y'])
+        self.pop.close()
+        self.pop = pmemobj.open(self.fn)
+        self.addCleanup(self.pop.close)
+        b = self._make_set(['y', 'z'])
+        a = self.pop.root[0]
+        self.assertEqual(a.union(b), {'x', 'y', 'z'})
+        self.assertEqual(a.intersection(b), {'y'})
+        self.assertEqual(a.difference(b), {'x'})
+        self.assertEqual(b.symmetric_difference(a), {'x', 'z'})
+
+    def test_union_fills_once(self):
+        a = self._make_set(range(5))
+        b = self._make_set(range(3, 50))
+        c = self._make_set(range(40, 100))
+        mm = self.pop.mm
+        increfs = []
+        orig = mm.incref
+        def incref(oid):
+            increfs.append(oid)
+            return orig(oid)
+        mm.incref = incref
+        self.addCleanup(delattr, mm, 'incref')
+        u = a.union(b, c, b)
+        # The elements are incref'd together, not one by one as they are
+        # inserted.
+        self.assertEqual(increfs, [])
+        del mm.incref
+        self._track_set(u)
+        self.assertEqual(len(u), 100)
+        self.assertEqual(u, set(range(100)))
+        self.pop.gc(debug=True)
+
+    def test_union_after_reopen(self):
+        # Equal elements of different arguments may have different oids.
+        a = self._make_set(['x', 'y'])
+        self.pop.close()
+        self.pop = pmemobj.open(self.fn)
+        self.addCleanup(self.pop.close)
+        b = self._make_set(['y', 'z'])
+        c = self._make_set(['w'])
+        a = self.pop.root[0]
+        u = self._track_set(c.union(a, b))
+        self.assertEqual(len(u), 4)
+        self.assertEqual(u, {'w', 'x', 'y', 'z'})
+
+    def test_constructor_sizes_table_once(self):
+        s = self._make_set([])
+        tables = []
+        orig = s._alloc_empty_table
+        def alloc(tablesize):
+            tables.append(tablesize)
+            return orig(tablesize)
+        s._alloc_empty_table = alloc
+        s.update(range(1000))
+        self.assertEqual(tables, [4096])
+        self.assertEqual(s._body.mask + 1, 4096)
+        self.assertEqual(s, set(range(1000)))
+        s = self._make_set(range(1000))
+        self.assertEqual(s._body.mask + 1, 4096)
+        self.assertEqual(len(s), 1000)
+
+    def test_resize_fills_new_table(self):
+        s = self._make_set()
+        mm = self.pop.mm
+        snapshots = []
+        orig = mm.snapshot_range
+        def snapshot_range(*args):
+            snapshots.append(args)
+            return orig(*args)
+        mm.snapshot_range = snapshot_range
+        self.addCleanup(delattr, mm, 'snapshot_range')
+        counts = []
+        for i in range(200):
+            del snapshots[:]
+            s.add(i)
+            counts.append(len(snapshots))
+        # The adds that grow the table don't snapshot the copied entries.
+        self.assertLess(max(counts), 10)
+        del mm.snapshot_range
+        self.assertEqual(s, set(range(200)))
+        self.pop.gc(debug=True)
+
+    def test_update(self):
+        s = self._make_set('abc')
+        other = self._make_set('cdx')
+        s.update('aef', other, [1, 2, 1])
+        self.assertEqual(s, set('abcdefx') | {1, 2})
+        s |= {'y', 'a'}
+        s |= other
+        self.assertEqual(s, set('abcdefxy') | {1, 2})
+        with self.assertRaises(TypeError):
+            s |= ['z']
+        self.pop.gc(debug=True)
+
+    def test_intersection_update(self):
+        s = self._make_set(range(100))
+        s.intersection_update(range(0, 100, 2), [0, 2, 4, 6, 'x'])
+        self.assertEqual(s, {0, 2, 4, 6})
+        s &= self._make_set([2, 6, 8])
+        self.assertEqual(s, {2, 6})
+        s &= {6}
+        self.assertEqual(s, {6})
+        self.assertEqual(s._body.mask + 1, 8)
+        with self.assertRaises(TypeError):
+            s &= [6]
+        self.pop.gc(debug=True)
+
+    def test_small_sets(self):
+        s = self._make_set()
+        self._make_set()
+        mm = self.pop.mm
+        self.assertEqual(mm.otuple(s._body.table), mm.OID_NULL)
+        self.assertNotIn('a', s)
+        self.assertEqual(list(s), [])
+        s.discard('a')
+        for i in range(4):
+            s.add(i)
+            self.assertEqual(s._body.mask + 1, 8)
+        s.add(4)
+        self.assertEqual(s._body.mask + 1, 32)
+        self.assertEqual(s, set(range(5)))
+        s.clear()
+        self.assertEqual(mm.otuple(s._body.table), mm.OID_NULL)
+        self.assertEqual(len(s), 0)
+        s.add('x')
+        self.assertEqual(s, {'x'})
+        self.pop.gc(debug=True)
+        self.pop.close()
+        self.pop = pmemobj.open(self.fn)
+        self.addCleanup(self.pop.close)
+        self.assertEqual(self.pop.root[0], {'x'})
+        self.assertEqual(self.pop.root[1], set())
+
+    def test_update_refcounts(self):
+        s = self._make_set()
+        s.update(['x', 'x'], self._make_set(['x', 'y']), range(50))
+        self.assertEqual(len(s), 52)
+        s &= {'x', 0}
+        self.assertEqual(len(s), 2)
+        self.pop.gc(debug=True)
+
 
 class TestPersistentFrozenSet(JointOps, TestCase):
     thetype = pmemobj.PersistentFrozenSet
     basetype = thetype
 
+    def test_frozen_set_members(self):
+        s = self._make_set('ab')
+        self.assertIsNone(s._p_cached_hash())
+        outer = self.pop.new(pmemobj.PersistentSet, [s])
+        self._track_set(outer)
+        self.assertIsNotNone(s._p_cached_hash())
+        self.assertIn(frozenset('ab'), outer)
+        self.assertIn(s, outer)
+        self.assertNotIn(frozenset('a'), outer)
+        self.pop.gc(debug=True)
+
+    def test_frozen_update(self):
+        s = self._make_set('ab')
+        with self.assertRaises(AttributeError):
+            s.update('c')
+        with self.assertRaises(AttributeError):
+            s.intersection_update('a')
+        t = s
+        t |= {'c'}
+        self.assertIsNot(t, s)
+        self.assertEqual(s, {'a', 'b'})
+        self.assertEqual(t, {'a', 'b', 'c'})
+        self._track_set(t)
+        self.pop.gc(debug=True)
+
 
 if __name__ == '__main__':
     unittest.main()
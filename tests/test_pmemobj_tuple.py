@@ -2,6 +2,7 @@
 import unittest
 
 from nvm import pmemobj
+from nvm.pmemobj.dict import fixed_hash
 
 from tests.support import TestCase
 
@@ -46,6 +47,21 @@ class TestPersistentTuple(TestCase):
         self.assertEqual(tpl[1], 'b')
         self.assertEqual(tpl[2], 'c')
 
+    def test_getitem_slice(self):
+        tpl = self._make_tuple(['a', 'b', 'c', 'd'])
+        self.assertEqual(tpl[1:3], ('b', 'c'))
+        self.assertEqual(tpl[::-2], ('d', 'b'))
+        self.assertEqual(tpl[5:], ())
+        tpl = self._reread_tuple()
+        self.assertEqual(tpl[:], ('a', 'b', 'c', 'd'))
+
+    def test_iter(self):
+        tpl = self._make_tuple(['a', 'b', 'c'])
+        self.assertEqual(list(tpl), ['a', 'b', 'c'])
+        self.assertEqual(list(reversed(tpl)), ['c', 'b', 'a'])
+        tpl = self._reread_tuple()
+        self.assertEqual(list(tpl), ['a', 'b', 'c'])
+
     def test_getitem_index_errors(self):
         tpl = self._make_tuple(['a', 'b', 'c'])
         with self.assertRaises(IndexError):
@@ -78,6 +94,12 @@ class TestPersistentTuple(TestCase):
         with self.assertRaises(TypeError):
             del tpl[1]
 
+    def test_pop(self):
+        tpl = self._make_tuple(['a', 'b', 'c'])
+        with self.assertRaises(TypeError):
+            tpl.pop()
+        self.assertEqual(tpl, ('a', 'b', 'c'))
+
     def test_len(self):
         lst = []
         for x in range(0, 6):
@@ -98,5 +120,47 @@ class TestPersistentTuple(TestCase):
         tpl_2 = self._make_tuple([1, 2, 3])
         self.assertNotEqual(tpl_1, tpl_2)
 
+    def test_construction(self):
+        tpl = self._make_tuple(str(i) for i in range(50))
+        self.assertEqual(tpl, tuple(str(i) for i in range(50)))
+        sub = self.pop.new(pmemobj.PersistentList, ['x'])
+        before = self.pop.mm.snapshot_stats()
+        tpl = self.pop.new(pmemobj.PersistentTuple, [sub] * 100)
+        after = self.pop.mm.snapshot_stats()
+        self.pop.root = tpl
+        # The items are copied in without being snapshotted one by one.
+        self.assertLess(after['calls'] - before['calls'], 10)
+        self.pop.gc(debug=True)
+        tpl = self._reread_tuple()
+        self.assertEqual(len(tpl), 100)
+        self.assertIs(tpl[0], tpl[99])
+        self.pop.root = None
+        self.pop.gc(debug=True)
+
+    def test_hash_is_cached(self):
+        tpl = self._make_tuple(['a', 1])
+        self.assertIsNone(tpl._p_cached_hash())
+        self.assertEqual(fixed_hash(tpl), fixed_hash(('a', 1)))
+        self.assertIsNotNone(tpl._p_cached_hash())
+        mm = self.pop.mm
+        calls = []
+        orig = mm.resurrect
+        def resurrect(oid):
+            calls.append(oid)
+            return orig(oid)
+        mm.resurrect = resurrect
+        self.addCleanup(delattr, mm, 'resurrect')
+        fixed_hash(tpl)
+        self.assertEqual(calls, [])
+        del mm.resurrect
+        tpl = self._reread_tuple()
+        self.assertIsNotNone(tpl._p_cached_hash())
+        self.assertEqual(fixed_hash(tpl), fixed_hash(('a', 1)))
+
+    def test_hash_of_empty_tuple(self):
+        tpl = self._make_tuple([])
+        self.assertEqual(fixed_hash(tpl), fixed_hash(()))
+        self.pop.gc(debug=True)
+
 if __name__ == '__main__':
     unittest.main()